@@ -0,0 +1,138 @@
+"""asv benchmarks for fitting, prediction and model size of the skranger estimators.
+
+Run the suite against the current commit, or compare two builds::
+
+    asv run
+    asv continuous master HEAD
+    asv compare master HEAD
+
+Benchmarks are parametrized over the number of rows, features, trees and threads
+of synthetic datasets. ``time_*`` benchmarks record wall time, ``peakmem_*``
+benchmarks record the peak RSS of the process, and ``track_model_size`` records
+the size of the pickled, fitted estimator in bytes. Fit and predict benchmarks are
+in separate suites, so that only the predict benchmarks fit an estimator in setup.
+"""
+import pickle
+
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.datasets import make_regression
+
+from skranger.ensemble import RangerForestClassifier
+from skranger.ensemble import RangerForestRegressor
+from skranger.ensemble import RangerForestSurvival
+
+PARAMS = ([1000, 10000], [10, 100], [10, 100], [1, -1])
+PARAM_NAMES = ["n_samples", "n_features", "n_estimators", "n_jobs"]
+
+
+def make_survival(n_samples, n_features, random_state=0):
+    """Make a synthetic survival dataset with exponential event and censoring times."""
+    rng = np.random.RandomState(random_state)
+    X = rng.normal(size=(n_samples, n_features))
+    hazard = np.exp(X[:, : min(n_features, 5)].sum(axis=1) / 5)
+    event_time = rng.exponential(1 / hazard)
+    censor_time = rng.exponential(1 / hazard.mean(), size=n_samples)
+    y = np.empty(n_samples, dtype=[("event", bool), ("time", float)])
+    y["event"] = event_time <= censor_time
+    y["time"] = np.minimum(event_time, censor_time)
+    return X, y
+
+
+def make_classification_data(n_samples, n_features):
+    """Make a synthetic classification dataset."""
+    return make_classification(n_samples, n_features, n_informative=min(n_features, 5), random_state=0)
+
+
+def make_regression_data(n_samples, n_features):
+    """Make a synthetic regression dataset."""
+    return make_regression(n_samples, n_features, n_informative=min(n_features, 5), random_state=0)
+
+
+class _EstimatorBenchmark:
+    """Base of the benchmarks of an estimator, skipped by asv as its name is private.
+
+    Subclasses set ``estimator_class``, its ``estimator_params`` and ``make_data``, a
+    function making a dataset of ``n_samples`` rows and ``n_features`` features.
+    """
+
+    params = PARAMS
+    param_names = PARAM_NAMES
+    timeout = 600
+    estimator_class = None
+    estimator_params = {}
+    make_data = None
+
+    def make_estimator(self, n_estimators, n_jobs):
+        return self.estimator_class(n_estimators=n_estimators, n_jobs=n_jobs, **self.estimator_params)
+
+
+class _FitBenchmark(_EstimatorBenchmark):
+    def setup(self, n_samples, n_features, n_estimators, n_jobs):
+        self.X, self.y = self.make_data(n_samples, n_features)
+
+    def time_fit(self, n_samples, n_features, n_estimators, n_jobs):
+        self.make_estimator(n_estimators, n_jobs).fit(self.X, self.y)
+
+    def peakmem_fit(self, n_samples, n_features, n_estimators, n_jobs):
+        self.make_estimator(n_estimators, n_jobs).fit(self.X, self.y)
+
+
+class _PredictBenchmark(_EstimatorBenchmark):
+    def setup(self, n_samples, n_features, n_estimators, n_jobs):
+        self.X, self.y = self.make_data(n_samples, n_features)
+        self.estimator = self.make_estimator(n_estimators, n_jobs).fit(self.X, self.y)
+
+    def time_predict(self, n_samples, n_features, n_estimators, n_jobs):
+        self.estimator.predict(self.X)
+
+    def peakmem_predict(self, n_samples, n_features, n_estimators, n_jobs):
+        self.estimator.predict(self.X)
+
+    def track_model_size(self, n_samples, n_features, n_estimators, n_jobs):
+        return len(pickle.dumps(self.estimator))
+
+    track_model_size.unit = "bytes"
+
+
+class _Classifier:
+    estimator_class = RangerForestClassifier
+    make_data = staticmethod(make_classification_data)
+
+
+class _Regressor:
+    estimator_class = RangerForestRegressor
+    estimator_params = {"quantiles": True}
+    make_data = staticmethod(make_regression_data)
+
+
+class _Survival:
+    estimator_class = RangerForestSurvival
+    make_data = staticmethod(make_survival)
+
+
+class ClassifierFitSuite(_Classifier, _FitBenchmark):
+    pass
+
+
+class ClassifierPredictSuite(_Classifier, _PredictBenchmark):
+    def time_predict_proba(self, n_samples, n_features, n_estimators, n_jobs):
+        self.estimator.predict_proba(self.X)
+
+
+class RegressorFitSuite(_Regressor, _FitBenchmark):
+    pass
+
+
+class RegressorPredictSuite(_Regressor, _PredictBenchmark):
+    def time_predict_quantiles(self, n_samples, n_features, n_estimators, n_jobs):
+        self.estimator.predict_quantiles(self.X, quantiles=[0.1, 0.5, 0.9])
+
+
+class SurvivalFitSuite(_Survival, _FitBenchmark):
+    pass
+
+
+class SurvivalPredictSuite(_Survival, _PredictBenchmark):
+    def time_predict_survival_function(self, n_samples, n_features, n_estimators, n_jobs):
+        self.estimator.predict_survival_function(self.X)
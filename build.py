@@ -51,7 +51,11 @@ def create_extension(module_name):
         language="c++",
         extra_compile_args=["-std=c++11", "-Wall"],
         extra_link_args=["-std=c++11", "-g"],
-        define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
+        define_macros=[
+            ("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION"),
+            # export public functions with C linkage, so threadpoolctl finds them by name
+            ("CYTHON_EXTERN_C", 'extern "C"'),
+        ],
     )
 
 
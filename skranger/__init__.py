@@ -1 +1,4 @@
 from skranger._version import __version__
+from skranger.codegen import compile
+from skranger.parallel import get_num_threads
+from skranger.parallel import set_num_threads
@@ -0,0 +1,103 @@
+"""Micro-batching of concurrent prediction requests."""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_executor = None
+
+
+def get_executor():
+    """Get the thread pool used to run batched predictions off the event loop."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="skranger")
+    return _executor
+
+
+class MicroBatcher:
+    """Coalesce concurrent prediction requests into single batched calls.
+
+    Requests submitted within ``max_wait`` seconds of the first pending request are
+    stacked into one 2d array per number of columns, passed once to ``func`` in a
+    worker thread, and the result rows are split back to the waiting callers. A batch
+    is sent early once it holds ``max_batch_size`` rows. If a batched call fails, its
+    requests are run separately, so that only the failing requests raise.
+
+    :param callable func: A prediction function which accepts a 2darray and returns
+        an array with one row per input row, e.g. ``estimator.predict_proba``.
+    :param int max_batch_size: The number of rows at which a batch is sent without
+        waiting.
+    :param float max_wait: The number of seconds to wait for more requests after the
+        first request of a batch arrives.
+    :param Executor executor: The executor in which ``func`` is run. The default is a
+        thread pool shared by all batchers.
+    """
+
+    def __init__(self, func, max_batch_size=1024, max_wait=0.002, executor=None):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self._pending = []
+        self._pending_rows = 0
+        self._timer = None
+
+    async def submit(self, X):
+        """Submit rows for prediction and wait for their results.
+
+        :param array2d X: prediction input features
+        """
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise ValueError("X must be a 2d array")
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((X, future))
+        self._pending_rows += X.shape[0]
+        if self._pending_rows >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        """Send the pending requests as a single batch."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        """Run ``func`` on the requests of a batch, grouped by their number of columns."""
+        groups = {}
+        for x, future in batch:
+            groups.setdefault(x.shape[1], []).append((x, future))
+        await asyncio.gather(*(self._run_group(group) for group in groups.values()))
+
+    async def _run_group(self, group):
+        """Run ``func`` on stacked requests in the executor and resolve their futures."""
+        loop = asyncio.get_event_loop()
+        try:
+            X = np.concatenate([x for x, _ in group]) if len(group) > 1 else group[0][0]
+            result = await loop.run_in_executor(self.executor or get_executor(), self.func, X)
+        except Exception as exc:
+            if len(group) > 1:
+                # run the requests separately, so that only the invalid ones fail
+                await asyncio.gather(*(self._run_group([request]) for request in group))
+                return
+            _, future = group[0]
+            if not future.done():
+                future.set_exception(exc)
+            return
+
+        start = 0
+        for x, future in group:
+            stop = start + x.shape[0]
+            if not future.done():
+                future.set_result(result[start:stop])
+            start = stop
@@ -0,0 +1,304 @@
+"""Ahead-of-time compilation of fitted forests into native shared libraries.
+
+A fitted forest is written out as C threshold tables, one entry per node of every
+tree, together with a small traversal routine mirroring ranger's prediction code.
+The source is compiled with the local C compiler into a shared library, which is
+loaded back with :mod:`ctypes`::
+
+    from skranger import compile
+
+    compiled = compile(rfc, "model.so")
+    compiled.predict_proba(X)
+
+Predictions are identical to those of the estimator, as trees are traversed and
+their terminal node values summed in the same order as ranger. Input must be the
+numeric array passed to ranger, so DataFrames with ``category`` columns should be
+converted first.
+"""
+import ctypes
+import hashlib
+import json
+import math
+import os
+import shlex
+import subprocess
+import tempfile
+
+import numpy as np
+from sklearn.utils.validation import check_is_fitted
+
+_SOURCE = """\
+#include <float.h>
+#include <math.h>
+#include <stddef.h>
+#include <stdint.h>
+
+#define N_TREES {n_trees}
+#define N_FEATURES {n_features}
+#define N_OUTPUTS {n_outputs}
+
+/* missing value sentinels, see DataNumpy.h */
+static const double MISSING_LEFT = -DBL_MAX / 4;
+static const double MISSING_RIGHT = DBL_MAX / 4;
+
+static const int32_t tree_roots[] = {{{tree_roots}}};
+static const int32_t left_child[] = {{{left_child}}};
+static const int32_t right_child[] = {{{right_child}}};
+static const int32_t split_var[] = {{{split_var}}};
+static const double split_value[] = {{{split_value}}};
+static const int64_t leaf_offset[] = {{{leaf_offset}}};
+static const double leaf_value[] = {{{leaf_value}}};
+static const uint8_t is_ordered[] = {{{is_ordered}}};
+static const int32_t twin_source[] = {{{twin_source}}};
+
+static double feature_value(const double* x, int32_t var) {{
+    double value;
+    if (var < N_FEATURES) {{
+        value = x[var];
+        return isnan(value) ? MISSING_LEFT : value;
+    }}
+    value = x[twin_source[var - N_FEATURES]];
+    return isnan(value) ? MISSING_RIGHT : value;
+}}
+
+void skranger_predict(const double* X, size_t n_samples, double* out) {{
+    for (size_t i = 0; i < n_samples; ++i) {{
+        const double* x = X + i * N_FEATURES;
+        double* y = out + i * N_OUTPUTS;
+        for (size_t k = 0; k < N_OUTPUTS; ++k) {{
+            y[k] = 0;
+        }}
+        for (size_t t = 0; t < N_TREES; ++t) {{
+            int32_t node = tree_roots[t];
+            while (leaf_offset[node] < 0) {{
+                double value = feature_value(x, split_var[node]);
+                if (is_ordered[split_var[node]]) {{
+                    node = value <= split_value[node] ? left_child[node] : right_child[node];
+                }} else {{
+                    size_t factor = floor(value) - 1;
+                    size_t split = floor(split_value[node]);
+                    node = !(split & (1ULL << factor)) ? left_child[node] : right_child[node];
+                }}
+            }}
+            for (size_t k = 0; k < N_OUTPUTS; ++k) {{
+                y[k] += leaf_value[leaf_offset[node] + k];
+            }}
+        }}
+        for (size_t k = 0; k < N_OUTPUTS; ++k) {{
+            y[k] /= N_TREES;
+        }}
+    }}
+}}
+"""
+
+
+def _c_double(value):
+    """Format a float as an exact C literal."""
+    if math.isnan(value):
+        return "NAN"
+    if math.isinf(value):
+        return "INFINITY" if value > 0 else "-INFINITY"
+    return float(value).hex()
+
+
+def _c_array(values, fmt=str):
+    """Format values as a C array initializer, which may not be empty."""
+    return ", ".join(fmt(v) for v in values) or "0"
+
+
+def _leaf_values(estimator):
+    """Get a function returning the values of a terminal node, in output order.
+
+    :param estimator: a fitted RangerForestClassifier or RangerForestRegressor
+    """
+    forest = estimator.ranger_forest_["forest"]
+    if estimator.tree_type_ == 3:
+        return lambda tree_idx, node: [forest["split_values"][tree_idx][node]]
+    if estimator.tree_type_ != 9:
+        raise ValueError("Only RangerForestClassifier and RangerForestRegressor can be compiled")
+    if "class_fractions" in forest:
+        fractions = forest["class_fractions"].tocsr()
+        return lambda tree_idx, node: fractions[forest["node_offsets"][tree_idx] + node].toarray().ravel()
+    order = estimator.ranger_class_order_
+    return lambda tree_idx, node: np.asarray(forest["terminal_class_counts"][tree_idx][node])[order]
+
+
+def generate_source(estimator):
+    """Generate the C source of a fitted forest.
+
+    The source defines ``void skranger_predict(const double* X, size_t n_samples,
+    double* out)``, which reads a C ordered ``(n_samples, n_features)`` array and
+    writes the ``(n_samples, n_outputs)`` predictions.
+
+    :param estimator: a fitted RangerForestClassifier or RangerForestRegressor
+    """
+    check_is_fitted(estimator)
+    leaf_values = _leaf_values(estimator)
+    forest = estimator.ranger_forest_["forest"]
+    n_outputs = getattr(estimator, "n_classes_", 1)
+
+    tree_roots, left_child, right_child, split_var, split_value = [], [], [], [], []
+    leaf_offset, leaf_value = [], []
+    for tree_idx, (children, var_ids, values) in enumerate(
+        zip(forest["child_node_ids"], forest["split_var_ids"], forest["split_values"])
+    ):
+        root = len(split_var)
+        tree_roots.append(root)
+        for node, (left, right) in enumerate(zip(*children)):
+            is_leaf = left == 0 and right == 0
+            left_child.append(root + left)
+            right_child.append(root + right)
+            split_var.append(var_ids[node])
+            split_value.append(values[node])
+            leaf_offset.append(len(leaf_value) if is_leaf else -1)
+            if is_leaf:
+                node_values = np.asarray(leaf_values(tree_idx, node), dtype="float64")
+                leaf_value.extend(node_values if len(node_values) else np.zeros(n_outputs))
+
+    return _SOURCE.format(
+        n_trees=forest["num_trees"],
+        n_features=estimator.n_features_,
+        n_outputs=n_outputs,
+        tree_roots=_c_array(tree_roots),
+        left_child=_c_array(left_child),
+        right_child=_c_array(right_child),
+        split_var=_c_array(split_var),
+        split_value=_c_array(split_value, _c_double),
+        leaf_offset=_c_array(leaf_offset),
+        leaf_value=_c_array(leaf_value, _c_double),
+        is_ordered=_c_array(int(ordered) for ordered in forest["is_ordered"]),
+        twin_source=_c_array(estimator.missing_features_),
+    )
+
+
+def compile(estimator, path):
+    """Compile a fitted forest into a shared library.
+
+    The C source is written next to ``path`` with a ``.c`` extension, and a JSON
+    sidecar with a ``.json`` extension holds the metadata needed to load the library.
+    The compiler is taken from the ``CC`` environment variable, defaulting to ``cc``,
+    and extra flags from ``CFLAGS``.
+
+    :param estimator: a fitted RangerForestClassifier or RangerForestRegressor
+    :param str path: the path of the shared library to write, e.g. ``model.so``
+    :return: the loaded :class:`CompiledForest`
+    """
+    path = os.fspath(path)
+    base = os.path.splitext(path)[0]
+    source = generate_source(estimator)
+    with open(base + ".c", "w") as f:
+        f.write(source)
+
+    compiler = shlex.split(os.environ.get("CC", "cc"))
+    flags = shlex.split(os.environ.get("CFLAGS", ""))
+    # build to a new file replacing the library, so that a loaded library isn't
+    # overwritten in place
+    fd, build_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        subprocess.run(
+            compiler + ["-O2", "-shared", "-fPIC"] + flags + ["-o", build_path, base + ".c", "-lm"],
+            check=True,
+            capture_output=True,
+        )
+        os.replace(build_path, path)
+    finally:
+        if os.path.exists(build_path):
+            os.remove(build_path)
+
+    metadata = {
+        "estimator": type(estimator).__name__,
+        "n_features": estimator.n_features_,
+        "n_outputs": getattr(estimator, "n_classes_", 1),
+    }
+    if hasattr(estimator, "classes_"):
+        metadata["classes"] = estimator.classes_.tolist()
+    with open(base + ".json", "w") as f:
+        json.dump(metadata, f)
+    return CompiledForest(path)
+
+
+# the digests of the libraries loaded by this process, by path
+_loaded_digests = {}
+
+
+def _load_library(path):
+    """Load a shared library with :mod:`ctypes`.
+
+    The dynamic loader returns the library already loaded from a path, even if the
+    file was rebuilt since. A rebuilt library is therefore loaded from a copy named
+    by the digest of its contents.
+
+    :param str path: the path of the shared library
+    """
+    path = os.path.abspath(path)
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if _loaded_digests.setdefault(path, digest) != digest:
+        copy = os.path.join(tempfile.gettempdir(), f"skranger-{digest[:32]}{os.path.splitext(path)[1]}")
+        if not os.path.exists(copy):
+            fd, copy_path = tempfile.mkstemp(dir=tempfile.gettempdir())
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                dst.write(src.read())
+            os.replace(copy_path, copy)
+        path = copy
+    return ctypes.CDLL(path)
+
+
+def load(path):
+    """Load a forest compiled by :func:`compile`.
+
+    :param str path: the path of the shared library
+    """
+    return CompiledForest(path)
+
+
+class CompiledForest:
+    """A forest compiled into a shared library.
+
+    Exposes ``predict`` and, for classifiers, ``predict_proba`` like the estimator it
+    was compiled from. The compiled code runs without holding the GIL.
+
+    :param str path: the path of the shared library
+    """
+
+    def __init__(self, path):
+        path = os.fspath(path)
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            metadata = json.load(f)
+        self.path = path
+        self.estimator = metadata["estimator"]
+        self.n_features_ = metadata["n_features"]
+        self.n_outputs_ = metadata["n_outputs"]
+        if "classes" in metadata:
+            self.classes_ = np.asarray(metadata["classes"])
+        self._lib = _load_library(path)
+        self._lib.skranger_predict.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        self._lib.skranger_predict.restype = None
+
+    def _predict(self, X):
+        X = np.ascontiguousarray(X, dtype="float64")
+        if X.ndim != 2 or X.shape[1] != self.n_features_:
+            raise ValueError(f"X must be a 2d array with {self.n_features_} features")
+        out = np.empty((X.shape[0], self.n_outputs_), dtype="float64")
+        self._lib.skranger_predict(X.ctypes.data, X.shape[0], out.ctypes.data)
+        return out
+
+    def predict_proba(self, X):
+        """Predict probabilities for classes from X.
+
+        :param array2d X: prediction input features
+        """
+        if not hasattr(self, "classes_"):
+            raise ValueError("predict_proba is only available for classifiers")
+        return self._predict(X)
+
+    def predict(self, X):
+        """Predict classes or regression targets from X.
+
+        :param array2d X: prediction input features
+        """
+        predictions = self._predict(X)
+        if hasattr(self, "classes_"):
+            return self.classes_.take(np.argmax(predictions, axis=1), axis=0)
+        return predictions[:, 0]
@@ -1,3 +1,6 @@
+#include <cfloat>
+#include <cmath>
+
 #include "globals.h"
 #include "utility.h"
 #include "Data.h"
@@ -7,18 +10,33 @@
 
 namespace ranger {
 
+// Missing values are read as a sentinel below all observed values, so that they
+// are sent to the left child of any split. Columns listed in missing_cols get a
+// virtual twin column appended, in which missing values are above all observed
+// values and sent to the right child. Splitting on either the column or its twin
+// sends missing values to the child that is better for the split.
+// The sentinels are far from DBL_MAX so that split values averaging a sentinel
+// with an observed value don't overflow.
+const double MISSING_LEFT = -DBL_MAX / 4;
+const double MISSING_RIGHT = DBL_MAX / 4;
+
+// The numpy buffers are read in place rather than copied, so they must outlive the
+// Data object. x may be stored in either column-major (Fortran) or row-major (C)
+// order, y is always column-major.
 class DataNumpy: public Data {
 public:
   DataNumpy() = default;
-  DataNumpy(double* x, double* y, std::vector<std::string> variable_names, size_t num_rows, size_t num_cols, size_t num_cols_y) {
-    std::vector<double> xv(x, x + num_cols * num_rows);
-    std::vector<double> yv(y, y + num_cols_y * num_rows);
-    this->x = xv;
-    this->y = yv;
+  DataNumpy(double* x, double* y, std::vector<std::string> variable_names, size_t num_rows, size_t num_cols, size_t num_cols_y,
+      bool row_major, std::vector<size_t> missing_cols) {
+    this->x = x;
+    this->y = y;
+    this->row_major = row_major;
+    this->missing_cols = missing_cols;
+    this->num_cols_x = num_cols;
     this->variable_names = variable_names;
     this->num_rows = num_rows;
-    this->num_cols = num_cols;
-    this->num_cols_no_snp = num_cols;
+    this->num_cols = num_cols + missing_cols.size();
+    this->num_cols_no_snp = this->num_cols;
   }
 
   DataNumpy(const DataNumpy&) = delete;
@@ -33,8 +51,12 @@ public:
       row = getPermutedSampleID(row);
     }
 
-    if (col < num_cols_no_snp) {
-      return x[col * num_rows + row];
+    if (col < num_cols_x) {
+      double value = x[index(row, col)];
+      return std::isnan(value) ? MISSING_LEFT : value;
+    } else if (col < num_cols_no_snp) {
+      double value = x[index(row, missing_cols[col - num_cols_x])];
+      return std::isnan(value) ? MISSING_RIGHT : value;
     } else {
       return getSnp(row, col, col_permuted);
     }
@@ -45,12 +67,15 @@ public:
   }
 
   void reserveMemory(size_t y_cols) override {
-    x.resize(num_cols * num_rows);
-    y.resize(y_cols * num_rows);
+    x_owned.resize(num_cols_x * num_rows);
+    y_owned.resize(y_cols * num_rows);
+    x = x_owned.data();
+    y = y_owned.data();
+    row_major = false;
   }
 
   void set_x(size_t col, size_t row, double value, bool& error) override {
-    x[col * num_rows + row] = value;
+    x[index(row, col)] = value;
   }
 
   void set_y(size_t col, size_t row, double value, bool& error) override {
@@ -58,11 +83,19 @@ public:
   }
 
 private:
-  std::vector<double> x;
-  std::vector<double> y;
+  size_t index(size_t row, size_t col) const {
+    return row_major ? row * num_cols_x + col : col * num_rows + row;
+  }
+
+  double* x = nullptr;
+  double* y = nullptr;
+  bool row_major = false;
+  std::vector<double> x_owned;
+  std::vector<double> y_owned;
+  std::vector<size_t> missing_cols;
+  size_t num_cols_x = 0;
 };
 
 } // namespace ranger
 
 #endif
-
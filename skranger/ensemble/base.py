@@ -1,6 +1,66 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
 import warnings
+import weakref
 
 import numpy as np
+from scipy import sparse
+from sklearn import get_config
+from sklearn.utils.validation import check_array
+from sklearn.utils.validation import check_is_fitted
+
+from skranger import memory
+from skranger import parallel
+from skranger import profiling
+from skranger.batching import MicroBatcher
+from skranger.ensemble import ranger
+
+# batchers per event loop, per estimator, per prediction method
+_batchers = weakref.WeakKeyDictionary()
+
+# input validation arguments allowing missing values, which ranger handles natively
+if "ensure_all_finite" in inspect.signature(check_array).parameters:
+    ALLOW_NAN = {"ensure_all_finite": "allow-nan"}
+else:
+    ALLOW_NAN = {"force_all_finite": "allow-nan"}
+
+# the number of rows of a proximity matrix computed at once
+_PROXIMITY_BLOCK_SIZE = 1024
+
+# the number of trees grown between progress checks, when monitoring training
+_TREE_BLOCK_SIZE = 16
+
+# the number of elements of the intermediate jackknife matrix computed at once
+_JACKKNIFE_BLOCK_ELEMENTS = 2 ** 24
+
+
+def _is_arrow(X):
+    """Whether X is Arrow data."""
+    return type(X).__module__.startswith("pyarrow")
+
+
+def _mean_over_trees(tree_predictions):
+    """Average the predictions of trees, summing them in tree order as ranger does.
+
+    :param array tree_predictions: predictions of shape ``(n_samples, n_trees, ...)``
+    """
+    total = np.zeros(tree_predictions.shape[:1] + tree_predictions.shape[2:])
+    for tree in range(tree_predictions.shape[1]):
+        total += tree_predictions[:, tree]
+    return total / tree_predictions.shape[1]
+
+
+def _arrow_data(data):
+    """Open the path of a Parquet file or directory as an Arrow dataset."""
+    if isinstance(data, (str, os.PathLike)):
+        import pyarrow.dataset
+
+        return pyarrow.dataset.dataset(data, format="parquet")
+    return data
 
 
 class RangerValidationMixin:
@@ -16,18 +76,182 @@ class RangerValidationMixin:
         self._set_split_rule(y)
         self.order_snps_ = self.respect_categorical_features == "order"
         self._set_categorical_features()
+        self._check_growth_parameters()
+        self._set_missing_features(X)
+        self._check_memory_limit(X, y)
+
+    def _check_input(self, X):
+        """Validate prediction input.
+
+        When scikit-learn's ``assume_finite`` option is set, for example with
+        ``sklearn.config_context(assume_finite=True)``, float64 arrays with the fitted
+        number of features are trusted and returned without validation, except for
+        missing values in categorical features, which are not supported.
+
+        :param X: prediction input features
+        """
+        if not (
+            get_config()["assume_finite"]
+            and isinstance(X, np.ndarray)
+            and X.dtype == np.float64
+            and X.ndim == 2
+            and X.shape[1] == self.n_features_
+        ):
+            X = check_array(self._convert_frame(X), **ALLOW_NAN)
+        categorical = [c for c, name in enumerate(self.feature_names_) if name in self.categorical_features_]
+        if categorical and X.shape[1] == self.n_features_ and np.isnan(X[:, categorical]).any():
+            raise ValueError("Missing values are not supported in categorical features")
+        return X
+
+    def _convert_frame(self, X, reset=False):
+        """Convert a pandas DataFrame or Arrow data to a Fortran ordered float64 array.
+
+        Columns of ``category`` dtype are converted from their category codes, plus one
+        since ranger expects unordered factor levels starting at 1, with missing values
+        as an additional last level. The columns are written into a single array in
+        the column major layout ranger uses. Arrow data is converted by
+        :meth:`_convert_arrow`. Other input is returned unchanged.
+
+        :param X: input features
+        :param bool reset: whether to set ``feature_names_`` and ``categories_`` from X
+        """
+        if _is_arrow(X):
+            return self._convert_arrow(X, reset)
+        is_frame = hasattr(X, "columns") and hasattr(X, "dtypes")
+        if reset:
+            columns = X.columns if is_frame else range(np.shape(X)[-1] if np.ndim(X) else 0)
+            self.feature_names_ = [str(c).encode() for c in columns]
+            self.categories_ = {}
+            if is_frame:
+                self.categories_ = {c: X[c].cat.categories for c, dtype in X.dtypes.items() if dtype.name == "category"}
+        if not is_frame:
+            return X
+
+        # select the training columns in training order, if present
+        names = {str(c).encode(): c for c in X.columns}
+        if all(name in names for name in self.feature_names_):
+            X = X[[names[name] for name in self.feature_names_]]
+
+        X_array = np.empty(X.shape, dtype="float64", order="F")
+        for idx, c in enumerate(X.columns):
+            column = X.iloc[:, idx]
+            categories = self.categories_.get(c)
+            if categories is None and column.dtype.name == "category":
+                categories = column.cat.categories
+            if categories is None:
+                X_array[:, idx] = column.to_numpy(dtype="float64", na_value=np.nan)
+                continue
+            # values outside the categories are missing
+            if column.dtype.name == "category":
+                if not column.cat.categories.equals(categories):
+                    column = column.cat.set_categories(categories)
+            else:
+                import pandas as pd
+
+                column = column.where(column.isin(categories))
+                column = pd.Series(pd.Categorical(column, categories=categories), index=column.index)
+            codes = column.cat.codes.to_numpy()
+            X_array[:, idx] = codes + 1
+            X_array[codes < 0, idx] = len(categories) + 1
+        return X_array
+
+    def _convert_arrow(self, X, reset=False):
+        """Convert Arrow data to a Fortran ordered float64 array.
+
+        The record batches of X are streamed into a single array in ranger's column
+        major layout, which matches Arrow's columnar layout, so only one copy of the
+        data is made. Dictionary encoded columns are converted like ``category``
+        columns of a DataFrame.
+
+        :param X: a pyarrow ``Table``, ``RecordBatch``, ``Dataset`` or ``Scanner``
+        :param bool reset: whether to set ``feature_names_`` and ``categories_`` from X
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        schema = getattr(X, "projected_schema", None) or X.schema
+        if reset:
+            self.feature_names_ = [name.encode() for name in schema.names]
+            self.categories_ = {f.name: [] for f in schema if pa.types.is_dictionary(f.type)}
+        # select the training columns in training order, if present
+        names = [name.encode() for name in schema.names]
+        if all(name in names for name in self.feature_names_):
+            names = self.feature_names_
+        columns = [name.decode() for name in names]
+
+        n_rows = X.count_rows() if hasattr(X, "count_rows") else X.num_rows
+        X_array = np.empty((n_rows, len(columns)), dtype="float64", order="F")
+        categories = {
+            c: self.categories_.get(c, [])
+            for c in columns
+            if c in self.categories_ or pa.types.is_dictionary(schema.field(c).type)
+        }
+        codes = {c: {value: code for code, value in enumerate(categories[c], 1)} for c in categories}
+        start = 0
+        for batch in X.to_batches() if hasattr(X, "to_batches") else [X]:
+            stop = start + batch.num_rows
+            for idx, c in enumerate(columns):
+                chunk = batch.column(c)
+                if c not in categories:
+                    values = pc.cast(chunk, pa.float64()).to_numpy(zero_copy_only=False)
+                    X_array[start:stop, idx] = values
+                    continue
+                if not pa.types.is_dictionary(chunk.type):
+                    chunk = chunk.dictionary_encode()
+                # map the batch's dictionary onto the category codes, adding unseen
+                # categories in fit and leaving them missing in predict
+                lookup = []
+                for value in chunk.dictionary.to_pylist():
+                    if value not in codes[c] and reset:
+                        categories[c].append(value)
+                        codes[c][value] = len(categories[c])
+                    lookup.append(codes[c].get(value, np.nan))
+                indices = pc.fill_null(chunk.indices, len(lookup)).to_numpy(zero_copy_only=False)
+                X_array[start:stop, idx] = np.append(np.array(lookup, dtype="float64"), np.nan)[indices]
+            start = stop
+        # missing values are the additional last level
+        for idx, c in enumerate(columns):
+            if c in categories:
+                X_array[np.isnan(X_array[:, idx]), idx] = len(categories[c]) + 1
+        return X_array
+
+    def _feature_name(self, feature):
+        """Get the ranger variable name of a feature given by column index or name."""
+        if isinstance(feature, str):
+            return feature.encode()
+        return self.feature_names_[feature]
 
     def _set_categorical_features(self):
-        """Determine categorical feature names."""
+        """Determine categorical feature names.
+
+        Features of ``category`` dtype in a DataFrame are included automatically.
+        """
         if self.respect_categorical_features == "partition":
-            self.categorical_features_ = (
-                [str(c).encode() for c in self.categorical_features] if self.categorical_features is not None else []
-            )
+            self.categorical_features_ = [self._feature_name(c) for c in self.categorical_features or []]
+            for c in self.categories_:
+                if str(c).encode() not in self.categorical_features_:
+                    self.categorical_features_.append(str(c).encode())
         elif self.respect_categorical_features == "ignore" or self.respect_categorical_features == "order":
             self.categorical_features_ = []
         else:
             raise ValueError("respect ordered factors must be one of `partition`, `ignore` or `order`")
 
+    def _set_missing_features(self, X):
+        """Determine the features with missing values.
+
+        Missing values are sent to the left child of every split on a feature. Each
+        feature with missing values in the training data also gets a twin feature
+        which sends them to the right child, so that trees learn the better
+        direction per split.
+        """
+        self.missing_features_ = np.flatnonzero(np.isnan(X).any(axis=0)).tolist()
+        if any(self.feature_names_[c] in self.categorical_features_ for c in self.missing_features_):
+            raise ValueError("Missing values are not supported in categorical features")
+        # extratrees draws split values between the minimum and maximum of a node,
+        # which would include the missing value sentinels
+        if self.missing_features_ and self.split_rule == "extratrees":
+            raise ValueError("Missing values are not supported with the extratrees splitrule")
+
     def _evaluate_mtry(self, num_features):
         """Evaluate mtry if callable."""
         if callable(self.mtry):
@@ -93,9 +317,9 @@ class RangerValidationMixin:
                 raise ValueError("split rule must be either logrank, extratrees, C or maxstat")
 
     def _set_respect_categorical_features(self):
-        """Set ``respect_categorical_features`` based on ``split_rule``."""
+        """Set ``respect_categorical_features`` based on ``split_rule`` and ``category`` features."""
         if self.respect_categorical_features is None:
-            if self.split_rule == "extratrees":
+            if self.split_rule == "extratrees" or self.categories_:
                 self.respect_categorical_features = "partition"
             else:
                 self.respect_categorical_features = "ignore"
@@ -114,16 +338,16 @@ class RangerValidationMixin:
                 raise ValueError("The regularization coefficients must be > 0")
             if len(self.regularization_factor) != 1 and len(self.regularization_factor) != num_features:
                 raise ValueError("There must be either one 1 or (number of features) regularization coefficients")
-            if len(self.regularization_factor) == 1:
-                self.regularization_factor_ = [self.regularization_factor] * num_features
 
         if all([r == 1 for r in self.regularization_factor]):
             self.regularization_factor_ = []
             self.use_regularization_factor_ = False
         else:
-            if self.n_jobs_ != 1:
+            if self.n_jobs_ != 1 and not self.parallel_regularization:
                 self.n_jobs_ = 1
-                warnings.warn("Parallelization cannot be used with regularization.")
+                warnings.warn(
+                    "Parallelization cannot be used with regularization, unless parallel_regularization is set."
+                )
             self.regularization_factor_ = self.regularization_factor
             self.use_regularization_factor_ = True
 
@@ -148,10 +372,748 @@ class RangerValidationMixin:
 
     def _check_inbag(self, sample_weights):
         """Validate related input against ``inbag`` counts."""
-        if self.inbag:
+        if self.inbag or self.regenerate_inbag:
             if sample_weights is not None:
                 raise ValueError("Cannot use inbag and sample_weights.")
             if len(self.sample_fraction_) > 1:
                 raise ValueError("Cannot use class sampling and inbag.")
+        if self.inbag:
+            if self.regenerate_inbag:
+                raise ValueError("Cannot use inbag and regenerate_inbag.")
             if len(self.inbag) != self.n_estimators:
                 raise ValueError("Size of inbag must be equal to n_estimators.")
+        if self.regenerate_inbag:
+            self.inbag_seed_ = self.seed or np.random.randint(1, np.iinfo(np.int32).max)
+
+    def _check_growth_parameters(self):
+        """Validate the training progress callback, timeout and early stopping."""
+        if self.on_tree_grown is not None and not callable(self.on_tree_grown):
+            raise ValueError("on_tree_grown must be callable")
+        if self.timeout is not None and self.timeout <= 0:
+            raise ValueError("timeout must be a positive number of seconds")
+        if self.early_stopping:
+            if self.n_iter_no_change < 1:
+                raise ValueError("n_iter_no_change must be at least 1")
+            if self.tol < 0:
+                raise ValueError("tol must be non-negative")
+            if self.holdout:
+                raise ValueError("Cannot use early stopping and holdout.")
+
+    def _check_memory_limit(self, X, y):
+        """Check the estimated peak memory of fitting against ``memory_limit``.
+
+        When the estimate exceeds the limit, ``save_memory`` is enabled if available
+        and if this brings the estimate within the limit. Otherwise fitting fails
+        before training starts. See :func:`skranger.memory.estimate_memory`.
+
+        :param array2d X: training input features
+        :param array2d y: training input targets
+        """
+        self.save_memory_ = getattr(self, "save_memory", False)
+        if self.memory_limit is None:
+            return
+        if self.memory_limit <= 0:
+            raise ValueError("memory_limit must be a positive number of bytes")
+
+        params = self.get_params()
+        # ranger is passed a Fortran ordered float64 copy of other arrays
+        kwargs = {"copy_input": not (X.dtype == np.float64 and X.flags.f_contiguous)}
+        if self.tree_type_ == 9:
+            kwargs["n_classes"] = len(np.unique(y))
+        elif self.tree_type_ == 5:
+            kwargs["n_event_times"] = len(np.unique(y[y[:, 1] > 0, 0]))
+            if self.time_grid is not None:
+                grid_size = self.time_grid if np.isscalar(self.time_grid) else len(self.time_grid)
+                kwargs["n_event_times"] = min(kwargs["n_event_times"], grid_size)
+        estimate = memory.estimate_memory(X.shape, params, **kwargs)["total"]
+
+        can_save_memory = hasattr(self, "save_memory") and not (
+            self.split_rule == "extratrees" and self.respect_categorical_features == "partition"
+        )
+        if estimate > self.memory_limit and not self.save_memory_ and can_save_memory:
+            params["save_memory"] = True
+            estimate = memory.estimate_memory(X.shape, params, **kwargs)["total"]
+            if estimate <= self.memory_limit:
+                warnings.warn("Enabled save_memory to fit within memory_limit.")
+                self.save_memory_ = True
+        if estimate > self.memory_limit:
+            raise ValueError(
+                f"Fitting is estimated to use {estimate} bytes, more than the memory_limit of {self.memory_limit} bytes"
+            )
+
+
+class RangerGrowMixin:
+    def _grow_forest(self, grow, y):
+        """Grow the forest, in blocks of trees if progress is monitored.
+
+        ``grow`` is called with ``(start, stop, seed, regularization_factor,
+        num_threads)`` and must return the ranger result for trees ``start`` to
+        ``stop``. Without ``on_tree_grown``, ``timeout``, ``early_stopping`` or
+        parallel regularization the forest is grown by a single call. Otherwise trees
+        are grown in blocks of ``_TREE_BLOCK_SIZE`` trees by :meth:`_grow_block`, each
+        by a single threaded ranger call, with ``n_jobs_`` blocks grown concurrently
+        in the shared thread pool. The callback is invoked for the trees of each block
+        and training can stop between blocks. Blocks amortize the cost of a ranger
+        call, which loads and sorts the training data. No more blocks are grown than
+        there are threads, and the blocks still being grown when training stops are
+        waited for and dropped. Either way the forest doesn't depend on ``n_jobs_``.
+
+        With early stopping or an out of bag error, the out of bag predictions of the
+        trees are accumulated, weighted by the number of trees for which each sample
+        is out of bag, and the out of bag error of the forest is computed from them.
+        With early stopping, the error is checked every ``_TREE_BLOCK_SIZE`` trees,
+        and training stops once it hasn't improved by more than ``tol`` for
+        ``n_iter_no_change`` blocks.
+
+        :param callable grow: function growing a block of trees
+        :param array2d y: the training target passed to ranger
+        """
+        if not self._grown_in_blocks():
+            num_threads = parallel.num_threads(self.n_jobs_)
+            result = grow(0, self.n_estimators, self.seed, self.regularization_factor_, num_threads)
+            return self._store_inbag_counts(result, y.shape[0])
+
+        if self.use_regularization_factor_ and self.parallel_regularization:
+            blocks = self._grow_regularized_trees(grow)
+        else:
+            starts = range(0, self.n_estimators, _TREE_BLOCK_SIZE)
+            blocks = parallel.imap(functools.partial(self._grow_block, grow), starts, self.n_jobs_)
+        results = []
+        oob_sum = np.zeros((y.shape[0], 1))
+        oob_count = np.zeros(y.shape[0])
+        oob_errors = []
+        n_trees = 0
+        begin = previous = time.perf_counter()
+        try:
+            for result in blocks:
+                results.append(result)
+                if self._tracks_oob():
+                    oob_sum, oob_count = self._accumulate_oob_predictions(result, oob_sum, oob_count)
+                now = time.perf_counter()
+                cancelled = False
+                if self.on_tree_grown is not None:
+                    for tree in range(n_trees, n_trees + result["num_trees"]):
+                        cancelled = bool(self.on_tree_grown(tree, now - begin)) or cancelled
+                n_trees += result["num_trees"]
+                if cancelled:
+                    break
+                # stop if the next block is expected to exceed the timeout
+                if self.timeout is not None and now - begin + (now - previous) > self.timeout:
+                    break
+                previous = now
+                if self.early_stopping and n_trees % _TREE_BLOCK_SIZE == 0:
+                    oob = oob_count > 0
+                    oob_errors.append(self._oob_prediction_error(oob_sum[oob] / oob_count[oob, None], y[oob]))
+                    n = self.n_iter_no_change
+                    if len(oob_errors) > n and min(oob_errors[-n:]) > min(oob_errors[:-n]) - self.tol:
+                        break
+        finally:
+            blocks.close()
+
+        result = self._merge_results(results)
+        if self._tracks_oob():
+            oob = oob_count > 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                predictions = oob_sum / oob_count[:, None]
+            result["predictions"] = (predictions[:, 0] if predictions.shape[1] == 1 else predictions).tolist()
+            result["prediction_error"] = self._oob_prediction_error(predictions[oob], y[oob])
+            if not self.keep_inbag:
+                del result["inbag_counts"]
+        return self._store_inbag_counts(result, y.shape[0])
+
+    def _grow_regularized_trees(self, grow):
+        """Grow the trees of a regularized forest concurrently, yielding them in order.
+
+        Ranger penalizes splitting on features which no tree of the forest has used
+        yet, tracking the used features in a set shared by the threads growing the
+        forest, so regularized forests are otherwise grown by a single thread. Here
+        the trees are grown one per ranger call, rather than in blocks, and each is
+        grown with the features used by the earlier trees unpenalized,
+        by setting their regularization factor to 1, except for the trees which may
+        still be growing concurrently. With ``n`` threads, tree ``i`` waits for trees
+        ``0`` to ``i - n`` to be grown and takes the features they used, so the
+        forest only depends on the number of threads, and with a single thread it is
+        the one grown by ranger.
+
+        :param callable grow: function growing a block of trees
+        """
+        lag = parallel.num_threads(self.n_jobs_)
+        grown = [threading.Event() for _ in range(self.n_estimators)]
+        # the features used by trees 0 to i, set once tree i is grown
+        used_features = [None] * self.n_estimators
+
+        def grow_tree(tree):
+            regularization_factor = self.regularization_factor_
+            if tree >= lag:
+                grown[tree - lag].wait()
+                regularization_factor = np.where(used_features[tree - lag], 1.0, regularization_factor).tolist()
+            return self._grow_tree(grow, regularization_factor, tree)
+
+        trees = parallel.imap(grow_tree, range(self.n_estimators), self.n_jobs_)
+        previous = np.zeros(self.n_features_, dtype=bool)
+        try:
+            for tree, result in enumerate(trees):
+                used_features[tree] = previous = previous.copy()
+                self._add_used_features([result], previous)
+                grown[tree].set()
+                yield result
+        finally:
+            # release the trees waiting for trees which won't be grown, to be dropped
+            for event in grown:
+                event.set()
+            trees.close()
+
+    def _grown_in_blocks(self):
+        """Whether the trees are grown in blocks by separate ranger calls rather than a single one."""
+        regularized = self.use_regularization_factor_ and self.parallel_regularization
+        return bool(self.on_tree_grown is not None or self.timeout is not None or self.early_stopping or regularized)
+
+    def _tracks_oob(self):
+        """Whether out of bag predictions are accumulated over blocks of trees.
+
+        Ranger must then return the in-bag counts of the trees.
+        """
+        return bool(self.early_stopping or (self.oob_error and self._grown_in_blocks()))
+
+    def _grow_block(self, grow, start):
+        """Grow the block of trees starting at tree ``start`` by a single threaded ranger call.
+
+        Ranger seeds tree ``i`` of a call with ``(i + 1) * seed``, so each block is
+        seeded from ``seed`` and its first tree, making the forest independent of the
+        threads growing the blocks.
+
+        :param callable grow: function growing a block of trees
+        :param int start: the first tree of the block
+        """
+        stop = min(start + _TREE_BLOCK_SIZE, self.n_estimators)
+        seed = 0  # ranger seeds randomly if 0
+        if self.seed:
+            seed = int(np.random.RandomState([self.seed, start]).randint(1, 2 ** 32, dtype=np.int64))
+        return grow(start, stop, seed, self.regularization_factor_, 1)
+
+    def _grow_tree(self, grow, regularization_factor, tree):
+        """Grow a single tree by a single threaded ranger call.
+
+        Ranger seeds tree ``i`` of a forest with ``(i + 1) * seed``, so the tree is
+        seeded likewise to be identical to the one grown by a single call.
+
+        :param callable grow: function growing a block of trees
+        :param list regularization_factor: the regularization factors of the tree
+        :param int tree: the index of the tree
+        """
+        seed = (tree + 1) * self.seed % 2 ** 32  # ranger seeds randomly if 0
+        return grow(tree, tree + 1, seed, regularization_factor, 1)
+
+    @staticmethod
+    def _add_used_features(results, used_features):
+        """Mark the features the trees split on as used, for regularization.
+
+        :param list results: ranger results of trees
+        :param array1d used_features: whether each feature has been used for
+            splitting, updated in place
+        """
+        for result in results:
+            forest = result["forest"]
+            for (left, right), var_ids in zip(forest["child_node_ids"], forest["split_var_ids"]):
+                var_ids = np.asarray(var_ids, dtype=np.intp)
+                var_ids = var_ids[(np.asarray(left) != 0) | (np.asarray(right) != 0)]
+                # twin features of missing values aren't regularized
+                used_features[var_ids[var_ids < len(used_features)]] = True
+
+    def _store_inbag_counts(self, result, n_samples):
+        """Store the in-bag counts of the grown forest compactly.
+
+        Counts of at most one, as when sampling without replacement, are bit-packed
+        along samples into ``inbag_bits``. Other counts are stored in ``inbag_counts``
+        as an array of shape ``(n_trees, n_samples)`` of the smallest unsigned integer
+        type holding them, usually uint8. With ``regenerate_inbag`` the counts aren't
+        stored at all. Use :meth:`_get_inbag_counts` to read them.
+
+        :param dict result: the ranger result of the forest
+        :param int n_samples: the number of training samples
+        """
+        result["num_samples"] = n_samples
+        if "inbag_counts" not in result:
+            return result
+        counts = np.asarray(result.pop("inbag_counts"))
+        if self.regenerate_inbag:
+            return result
+        max_count = counts.max() if counts.size else 0
+        if max_count <= 1:
+            result["inbag_bits"] = np.packbits(counts, axis=1)
+        else:
+            result["inbag_counts"] = counts.astype(np.min_scalar_type(max_count), copy=False)
+        return result
+
+    def _get_inbag_counts(self):
+        """Get the in-bag counts of the fitted trees, or None if they weren't kept.
+
+        :return: an array of shape ``(n_trees, n_samples)``, unpacked from bits or
+            drawn again from the tree seeds if needed
+        """
+        forest = self.ranger_forest_
+        if "inbag_bits" in forest:
+            return np.unpackbits(forest["inbag_bits"], axis=1, count=forest["num_samples"])
+        if self.keep_inbag and self.regenerate_inbag:
+            return self._draw_inbag_counts(0, forest["num_trees"], forest["num_samples"])
+        return forest.get("inbag_counts")
+
+    def _get_manual_inbag(self, start, stop, n_samples):
+        """Get the in-bag counts passed to ranger for trees ``start`` to ``stop``.
+
+        These are taken from ``inbag``, or drawn from the tree seeds with
+        ``regenerate_inbag`` as an array, which ranger copies without converting it
+        to python lists. Otherwise ranger samples the trees itself.
+
+        :param int start: the first tree
+        :param int stop: the tree after the last tree
+        :param int n_samples: the number of training samples
+        """
+        if self.inbag:
+            return self.inbag[start:stop]
+        if self.regenerate_inbag:
+            return self._draw_inbag_counts(start, stop, n_samples)
+        return []
+
+    def _draw_inbag_counts(self, start, stop, n_samples):
+        """Draw the in-bag counts of trees ``start`` to ``stop`` from their seeds.
+
+        Each tree has its own random state seeded by ``inbag_seed_`` and the tree
+        index, so the counts of any tree can be drawn again deterministically.
+
+        :param int start: the first tree
+        :param int stop: the tree after the last tree
+        :param int n_samples: the number of training samples
+        """
+        n_inbag = int(n_samples * self.sample_fraction_[0])
+        counts = np.zeros((stop - start, n_samples), dtype=np.uint8)
+        for idx, tree in enumerate(range(start, stop)):
+            random_state = np.random.RandomState([self.inbag_seed_, tree])
+            if self.replace:
+                tree_counts = np.bincount(random_state.randint(0, n_samples, n_inbag), minlength=n_samples)
+                if tree_counts.max(initial=0) > np.iinfo(counts.dtype).max:
+                    counts = counts.astype(np.min_scalar_type(tree_counts.max()))
+                counts[idx] = tree_counts
+            else:
+                counts[idx, random_state.choice(n_samples, n_inbag, replace=False)] = 1
+        return counts
+
+    @staticmethod
+    def _accumulate_oob_predictions(result, oob_sum, oob_count):
+        """Add the out of bag predictions of a block of trees to the running totals.
+
+        :param dict result: the ranger result of a block, with inbag counts
+        :param array2d oob_sum: sums of out of bag predictions, weighted by counts
+        :param array1d oob_count: the number of trees for which samples are out of bag
+        """
+        counts = np.sum(np.array(result["inbag_counts"]) == 0, axis=0)
+        predictions = np.nan_to_num(np.asarray(result["predictions"], dtype=float).reshape(len(counts), -1))
+        return oob_sum + predictions * counts[:, None], oob_count + counts
+
+    @staticmethod
+    def _merge_results(results):
+        """Merge the ranger results of blocks of trees into a single result.
+
+        Per tree structures are concatenated. Variable importances are averaged over
+        the blocks, weighted by their number of trees. The out of bag predictions and
+        error are computed from the predictions accumulated by :meth:`_grow_forest`.
+
+        :param list results: ranger results of the blocks
+        """
+        if len(results) == 1:
+            return results[0]
+        num_trees = np.array([result["num_trees"] for result in results])
+        merged = dict(results[0])
+        merged["num_trees"] = int(num_trees.sum())
+
+        for key in ("variable_importance", "variable_importance_local"):
+            if key in merged:
+                values = np.array([result[key] for result in results], dtype=float)
+                merged[key] = np.average(values, axis=0, weights=num_trees).tolist()
+        if "inbag_counts" in merged:
+            merged["inbag_counts"] = np.concatenate([result["inbag_counts"] for result in results])
+
+        forest = dict(merged["forest"])
+        forest["num_trees"] = merged["num_trees"]
+        for key in (
+            "child_node_ids",
+            "split_var_ids",
+            "split_values",
+            "terminal_class_counts",
+            "cumulative_hazard_function",
+        ):
+            if key in forest:
+                forest[key] = [tree for result in results for tree in result["forest"][key]]
+        merged["forest"] = forest
+        return merged
+
+
+class RangerApplyMixin:
+    def _prediction_threads(self, X):
+        """Get the number of threads ranger predicts X with.
+
+        :param array2d X: prediction input features
+        """
+        return parallel.num_threads(self.n_jobs_, X.shape[0] * self.ranger_forest_["forest"]["num_trees"])
+
+    def _get_terminal_node_forest(self, X):
+        """Get a terminal node forest for X.
+
+        :param array2d X: prediction input features
+        """
+        loaded_forest = dict(self.ranger_forest_["forest"])
+        # terminal node predictions don't use the terminal node class counts or CHFs,
+        # but ranger expects them per tree if they were compressed
+        empty = [[] for _ in range(loaded_forest["num_trees"])]
+        if self.tree_type_ == 9:
+            loaded_forest.setdefault("terminal_class_counts", empty)
+        elif self.tree_type_ == 5:
+            loaded_forest.setdefault("cumulative_hazard_function", empty)
+
+        # many fields defaulted here which are unused
+        with profiling.phase("convert_input"):
+            X_ranger = np.asarray(X, dtype="float64")
+        with profiling.phase("ranger"):
+            forest = ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                np.asfortranarray([[]]),
+                self.feature_names_,  # variable_names
+                0,  # m_try
+                self.ranger_forest_["forest"]["num_trees"],  # num_trees
+                self.verbose,
+                self.seed,
+                self._prediction_threads(X_ranger),  # num_threads
+                False,  # write_forest
+                0,  # importance_mode
+                0,  # min_node_size
+                [],  # split_select_weights
+                False,  # use_split_select_weights
+                [],  # always_split_feature_names
+                False,  # use_always_split_feature_names
+                True,  # prediction_mode
+                loaded_forest,  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                True,  # sample_with_replacement
+                False,  # probability
+                [],  # unordered_feature_names
+                False,  # use_unordered_features
+                False,  # save_memory
+                1,  # split_rule
+                [],  # case_weights
+                False,  # use_case_weights
+                [],  # class_weights
+                False,  # predict_all
+                self.keep_inbag,
+                self.sample_fraction_,
+                0,  # alpha
+                0,  # minprop
+                self.holdout,
+                2,  # prediction_type (terminal nodes)
+                1,  # num_random_splits
+                False,  # use_sparse_data
+                False,  # order_snps_
+                False,  # oob_error
+                0,  # max_depth
+                [],  # inbag
+                False,  # use_inbag
+                [],  # regularization_factor_
+                False,  # use_regularization_factor_
+                False,  # regularization_usedepth
+                self.missing_features_,
+            )
+        return forest
+
+    def _get_terminal_nodes(self, X):
+        """Get the terminal node ids of X in each tree.
+
+        :param array2d X: prediction input features
+        """
+        predictions = self._get_terminal_node_forest(X)["predictions"]
+        return np.atleast_2d(np.asarray(predictions, dtype=np.int32))
+
+    @profiling.profiled("apply")
+    def apply(self, X):
+        """Apply trees in the forest to X, returning terminal node ids.
+
+        :param array2d X: prediction input features
+        :return: an int32 array of shape ``(n_samples, n_trees)`` with the id of the
+            terminal node each sample ends up in, for each tree.
+        """
+        check_is_fitted(self)
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+        return self._get_terminal_nodes(X)
+
+    @profiling.profiled("decision_path")
+    def decision_path(self, X):
+        """Return the decision path in the forest.
+
+        :param array2d X: prediction input features
+        :return: a tuple of a sparse indicator matrix of shape ``(n_samples, n_nodes)``
+            whose nonzero elements indicate the nodes a sample goes through, and an
+            array ``n_nodes_ptr`` such that the columns
+            ``n_nodes_ptr[i]:n_nodes_ptr[i + 1]`` are the nodes of tree ``i``.
+        """
+        terminal_nodes = self.apply(X)
+        n_samples, n_trees = terminal_nodes.shape
+
+        # parents of all nodes of all trees, indexed from n_nodes_ptr; -1 for roots
+        child_node_ids = self.ranger_forest_["forest"]["child_node_ids"]
+        n_nodes_ptr = np.cumsum([0] + [len(tree[0]) for tree in child_node_ids])
+        parents = np.full(n_nodes_ptr[-1], -1, dtype=np.int64)
+        for tree, (left, right) in enumerate(child_node_ids):
+            children = np.array([left, right], dtype=np.int64)
+            nodes = np.flatnonzero(children[0])
+            parents[n_nodes_ptr[tree] + children[:, nodes]] = n_nodes_ptr[tree] + nodes
+
+        # walk from the terminal nodes up to the roots
+        rows = [np.repeat(np.arange(n_samples), n_trees)]
+        cols = [(terminal_nodes + n_nodes_ptr[:-1]).ravel()]
+        while True:
+            cols.append(parents[cols[-1]])
+            rows.append(rows[-1][cols[-1] >= 0])
+            cols[-1] = cols[-1][cols[-1] >= 0]
+            if len(cols[-1]) == 0:
+                break
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        indicator = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_samples, n_nodes_ptr[-1])
+        )
+        return indicator, n_nodes_ptr
+
+    def _leaf_indicator(self, terminal_nodes, trees=None):
+        """Get a sparse one hot matrix of the terminal nodes of all trees.
+
+        :param array2d terminal_nodes: terminal node ids, of shape (n_samples, n_trees)
+        :param array2d trees: optional boolean mask of the trees to include per sample
+        """
+        n_samples, n_trees = terminal_nodes.shape
+        n_nodes_ptr = np.cumsum([0] + [len(tree[0]) for tree in self.ranger_forest_["forest"]["child_node_ids"]])
+        if trees is None:
+            trees = np.ones(terminal_nodes.shape, dtype=bool)
+        return sparse.csr_matrix(
+            (
+                np.ones(np.count_nonzero(trees)),
+                (terminal_nodes + n_nodes_ptr[:-1])[trees],
+                np.concatenate([[0], np.cumsum(trees.sum(axis=1))]),
+            ),
+            shape=(n_samples, n_nodes_ptr[-1]),
+        )
+
+    def _proximity_blocks(self, X, Y, oob_only):
+        """Compute the proximity matrix in blocks of rows using threads.
+
+        Samples sharing a terminal node are found through the sparse product of the
+        terminal node indicators, which iterates the samples of each terminal node
+        like an inverted index, so memory is bounded by the number of proximate pairs
+        per block. Yields ``(start, block)`` tuples in order.
+
+        :param array2d X: input features of the rows
+        :param array2d Y: input features of the columns, or None to use X
+        :param bool oob_only: whether to only count trees for which both samples are
+            out of bag
+        """
+        check_is_fitted(self)
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+            Y = X if Y is None else self._check_input(Y)
+        if oob_only:
+            if Y is not X:
+                raise ValueError("oob_only proximities are only defined between training samples")
+            inbag_counts = self._get_inbag_counts()
+            if inbag_counts is None:
+                raise ValueError("oob_only proximities require keep_inbag=True")
+            oob = inbag_counts.T == 0
+            if oob.shape[0] != X.shape[0]:
+                raise ValueError("oob_only proximities require the training samples as X")
+
+        leaves_X = self._get_terminal_nodes(X)
+        leaves_Y = leaves_X if Y is X else self._get_terminal_nodes(Y)
+        n_trees = leaves_X.shape[1]
+        A = self._leaf_indicator(leaves_X, oob if oob_only else None)
+        B = A if Y is X else self._leaf_indicator(leaves_Y)
+        B = B.T.tocsr()
+        if oob_only:
+            oob_T = oob.T.astype(np.float64)
+
+        def block(start):
+            stop = min(start + _PROXIMITY_BLOCK_SIZE, X.shape[0])
+            shared = A[start:stop] @ B
+            if not oob_only:
+                return shared / n_trees
+            # normalize by the number of trees for which both samples are out of bag
+            shared = shared.tocoo()
+            both_oob = oob[start:stop].astype(np.float64) @ oob_T
+            return sparse.csr_matrix(
+                (shared.data / both_oob[shared.row, shared.col], (shared.row, shared.col)), shape=shared.shape
+            )
+
+        starts = range(0, X.shape[0], _PROXIMITY_BLOCK_SIZE)
+        yield from zip(starts, parallel.imap(block, starts, self.n_jobs_))
+
+    @profiling.profiled("proximity")
+    def proximity(self, X, Y=None, oob_only=False):
+        """Compute the random forest proximity of samples.
+
+        The proximity of two samples is the fraction of trees in which they end up in
+        the same terminal node.
+
+        :param array2d X: input features of the rows
+        :param array2d Y: input features of the columns; the default is X
+        :param bool oob_only: Only count the trees for which both samples are
+            out-of-bag, and normalize by the number of such trees. X must be the
+            training data in its original order, fitted with ``keep_inbag=True``.
+        :return: a sparse matrix of shape ``(n_samples_X, n_samples_Y)``
+        """
+        return sparse.vstack([block for _, block in self._proximity_blocks(X, Y, oob_only)], format="csr")
+
+    @profiling.profiled("proximity_neighbors")
+    def proximity_neighbors(self, X, Y=None, n_neighbors=5, oob_only=False):
+        """Find the samples with the highest random forest proximity.
+
+        :param array2d X: input features of the query samples
+        :param array2d Y: input features of the candidate samples. When None, X is
+            used and each sample is excluded from its own neighbors.
+        :param int n_neighbors: The number of neighbors to find.
+        :param bool oob_only: Only count the trees for which both samples are
+            out-of-bag, as for :meth:`proximity`.
+        :return: a tuple of the proximities and the indices of the neighbors, both
+            of shape ``(n_samples_X, n_neighbors)`` and ordered by decreasing proximity.
+        """
+        if n_neighbors < 1:
+            raise ValueError("n_neighbors must be at least 1")
+        proximities, indices = [], []
+        for start, block in self._proximity_blocks(X, Y, oob_only):
+            block = block.toarray()
+            if Y is None:
+                block[np.arange(block.shape[0]), np.arange(start, start + block.shape[0])] = -1
+            k = min(n_neighbors, block.shape[1])
+            idx = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(block, idx, axis=1), axis=1, kind="stable")
+            idx = np.take_along_axis(idx, order, axis=1)
+            indices.append(idx)
+            proximities.append(np.take_along_axis(block, idx, axis=1))
+        return np.vstack(proximities), np.vstack(indices)
+
+
+class RangerJackknifeMixin:
+    def _jackknife_std(self, tree_predictions):
+        """Bias corrected infinitesimal jackknife standard errors of forest predictions.
+
+        Implements the estimator of Wager, Hastie and Efron (2014), as ranger's
+        ``se.method = "infjack"`` in R without the empirical Bayes calibration. The
+        covariances between the in-bag counts and the tree predictions are computed as
+        a sparse product of the in-bag count matrix with the centered predictions, in
+        blocks of samples. Negative variance estimates are clipped to zero.
+
+        :param array tree_predictions: predictions of each tree, of shape
+            ``(n_samples, n_trees)`` or ``(n_samples, n_trees, n_outputs)``
+        :return: standard errors of shape ``(n_samples,)`` or ``(n_samples, n_outputs)``
+        """
+        inbag = self._get_inbag_counts()
+        if inbag is None:
+            raise ValueError("return_std requires keep_inbag=True")
+        n_trees, n_train = inbag.shape
+
+        # one row per sample and output, one column per tree
+        predictions = np.moveaxis(np.asarray(tree_predictions, dtype=float), 1, -1)
+        shape = predictions.shape[:-1]
+        predictions = predictions.reshape(-1, n_trees)
+        centered = predictions - predictions.mean(axis=1, keepdims=True)
+
+        # the centered predictions sum to zero, so the in-bag counts needn't be centered
+        counts = sparse.csc_matrix(inbag, dtype=float).T
+        raw = np.empty(centered.shape[0])
+        block_size = max(1, _JACKKNIFE_BLOCK_ELEMENTS // n_train)
+        for start in range(0, centered.shape[0], block_size):
+            covariance = counts @ centered[start : start + block_size].T
+            raw[start : start + block_size] = np.sum(np.asarray(covariance) ** 2, axis=0) / n_trees ** 2
+
+        counts_var = np.mean(counts.multiply(counts).mean(axis=1) - np.square(counts.mean(axis=1)))
+        bootstrap_var = np.sum(centered ** 2, axis=1) / n_trees
+        variance = raw - n_train * counts_var * bootstrap_var / n_trees
+        return np.sqrt(np.maximum(variance, 0)).reshape(shape)
+
+
+class RangerArrowMixin:
+    def fit_from_arrow(self, data, target, sample_weight=None):
+        """Fit the ranger random forest using Arrow data, such as Parquet files.
+
+        The feature columns are streamed record batch by record batch into the array
+        passed to ranger, without converting through pandas or intermediate arrays.
+
+        :param data: a pyarrow ``Table``, ``Dataset``, or the path of a Parquet file or
+            directory. All columns other than the target and sample weight columns are
+            used as features.
+        :param str/list target: The name of the target column. For survival, the names
+            of the event indicator and survival time columns.
+        :param str sample_weight: The name of an optional column of sample weights.
+        """
+        data = _arrow_data(data)
+        targets = [target] if isinstance(target, str) else list(target)
+        columns = targets + ([sample_weight] if sample_weight is not None else [])
+        features = [name for name in data.schema.names if name not in columns]
+        if hasattr(data, "scanner"):
+            y_table = data.to_table(columns=columns)
+            X = data.scanner(columns=features)
+        else:
+            y_table = data.select(columns)
+            X = data.select(features)
+
+        values = [y_table.column(name).to_numpy() for name in targets]
+        if len(values) == 1:
+            y = values[0]
+        else:
+            y = np.empty(len(values[0]), dtype=[(name, v.dtype) for name, v in zip(targets, values)])
+            for name, v in zip(targets, values):
+                y[name] = v
+        weights = y_table.column(sample_weight).to_numpy() if sample_weight is not None else None
+        return self.fit(X, y, sample_weight=weights)
+
+    def predict_from_arrow(self, data, method="predict", **kwargs):
+        """Predict from Arrow data record batch by record batch.
+
+        Each record batch is converted and predicted separately, so memory is bounded
+        by the size of a record batch rather than the size of the data.
+
+        :param data: a pyarrow ``Table``, ``Dataset``, or the path of a Parquet file or
+            directory. Columns are matched to the features by name.
+        :param str method: The name of the prediction method, e.g. ``predict``,
+            ``predict_proba`` or ``predict_survival_function``.
+        :param kwargs: Additional arguments of the prediction method.
+        """
+        data = _arrow_data(data)
+        predict = getattr(self, method)
+        batches = data.to_batches() if hasattr(data, "to_batches") else [data]
+        results = [predict(batch, **kwargs) for batch in batches if batch.num_rows > 0]
+        if any(sparse.issparse(result) for result in results):
+            return sparse.vstack(results, format="csr")
+        return np.concatenate(results)
+
+
+class RangerAsyncMixin:
+    async def _submit_batched(self, method, X):
+        """Submit X to the micro-batcher of a prediction method.
+
+        Concurrent calls on the same estimator, method and event loop are coalesced
+        into a single prediction call, which runs in a thread pool so that the event
+        loop isn't blocked.
+
+        :param str method: the name of the prediction method
+        :param array2d X: prediction input features
+        """
+        loop = asyncio.get_event_loop()
+        batchers = _batchers.setdefault(loop, weakref.WeakKeyDictionary()).setdefault(self, {})
+        if method not in batchers:
+            # a bound method would keep the estimator, the key of the batchers, alive
+            predict = weakref.WeakMethod(getattr(self, method))
+            batchers[method] = MicroBatcher(lambda X: predict()(X))
+        return await batchers[method].submit(X)
+
+    async def apredict(self, X):
+        """Predict from X without blocking the event loop.
+
+        :param array2d X: prediction input features
+        """
+        return await self._submit_batched("predict", X)
@@ -9,36 +9,62 @@ from libcpp.string cimport string
 from libcpp.utility cimport move
 from libcpp.vector cimport vector
 
+from skranger import parallel
+from skranger import profiling
 from skranger.ensemble cimport ranger_
 
 
+# the number of threads, exported with C linkage for threadpoolctl, see skranger.parallel
+cdef public int skranger_get_num_threads() noexcept with gil:
+    return parallel.get_num_threads()
+
+
+cdef public void skranger_set_num_threads(int num_threads) noexcept with gil:
+    parallel.set_num_threads(num_threads)
+
+
 cdef class DataNumpy:
     """Cython wrapper for DataNumpy C++ class in ``DataNumpy.h``.
 
     This wraps the Data class in C++, which encapsulates training data passed to the
     random forest classes. It allows us to pass numpy arrays as a ranger-compatible
-    Data object.
+    Data object. The arrays are not copied, so they must outlive the Data object.
+    ``x`` may be Fortran or C contiguous, other layouts are copied to Fortran order.
     """
     cdef unique_ptr[ranger_.DataNumpy] c_data
+    cdef object x
+    cdef object y
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
     def __cinit__(self,
-        np.ndarray[double, ndim=2, mode="fortran"] x not None,
+        np.ndarray[double, ndim=2] x not None,
         np.ndarray[double, ndim=2, mode="fortran"] y not None,
         vector[string] variable_names,
+        vector[size_t] missing_cols,
     ):
+        cdef bool row_major = False
+        if not np.PyArray_IS_F_CONTIGUOUS(x):
+            if np.PyArray_IS_C_CONTIGUOUS(x):
+                row_major = True
+            else:
+                x = np.asfortranarray(x)
+        # keep references so the buffers stay alive as long as this wrapper
+        self.x = x
+        self.y = y
         cdef size_t num_rows = np.PyArray_DIMS(x)[0]  # in lieu of x.shape
         cdef size_t num_cols = np.PyArray_DIMS(x)[1]
         cdef size_t num_cols_y = np.PyArray_DIMS(y)[1]
         self.c_data.reset(
             new ranger_.DataNumpy(
-                &x[0, 0],
-                &y[0, 0],
+                <double*> np.PyArray_DATA(x),
+                <double*> np.PyArray_DATA(y),
                 variable_names,
                 num_rows,
                 num_cols,
                 num_cols_y,
+                row_major,
+                missing_cols,
             )
         )
 
@@ -58,9 +84,101 @@ cdef class DataNumpy:
         return deref(self.c_data).set_y(col, row, value, error)
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef np.ndarray terminal_nodes_array(vector[vector[vector[double]]]& predictions):
+    """Convert ranger's terminal node predictions to an int32 array.
+
+    Ranger returns terminal node ids nested as ``[1][num_samples][num_trees]`` doubles.
+    These are copied directly into an array of shape ``(num_samples, num_trees)``
+    rather than converted through python lists.
+    """
+    cdef size_t num_samples = predictions[0].size()
+    cdef size_t num_trees = predictions[0][0].size() if num_samples > 0 else 0
+    nodes = np.empty((num_samples, num_trees), dtype=np.int32)
+    cdef np.int32_t[:, ::1] nodes_view = nodes
+    cdef size_t i, j
+    with nogil:
+        for i in range(num_samples):
+            for j in range(num_trees):
+                nodes_view[i, j] = <np.int32_t> predictions[0][i][j]
+    return nodes
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef np.ndarray inbag_counts_array(vector[vector[size_t]]& counts):
+    """Convert ranger's in-bag counts to a uint8 array.
+
+    Ranger returns the counts as ``[num_trees][num_samples]``. These are copied
+    directly into an array of shape ``(num_trees, num_samples)`` rather than converted
+    through python lists. Counts above 255 fall back to a wider integer type.
+    """
+    cdef size_t num_trees = counts.size()
+    cdef size_t num_samples = counts[0].size() if num_trees > 0 else 0
+    cdef size_t max_count = 0
+    cdef size_t i, j
+    with nogil:
+        for i in range(num_trees):
+            for j in range(num_samples):
+                if counts[i][j] > max_count:
+                    max_count = counts[i][j]
+    if max_count > 255:
+        return np.asarray(counts, dtype=np.min_scalar_type(max_count))
+
+    inbag = np.empty((num_trees, num_samples), dtype=np.uint8)
+    cdef np.uint8_t[:, ::1] inbag_view = inbag
+    with nogil:
+        for i in range(num_trees):
+            for j in range(num_samples):
+                inbag_view[i, j] = <np.uint8_t> counts[i][j]
+    return inbag
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef vector[vector[size_t]] inbag_vector(inbag) except *:
+    """Convert in-bag counts to ranger's ``[num_trees][num_samples]`` vectors.
+
+    Arrays of shape ``(num_trees, num_samples)`` are copied directly, a tree at a
+    time, rather than converted through python lists. Lists of lists are converted
+    by Cython.
+    """
+    cdef vector[vector[size_t]] counts
+    cdef np.uint64_t[::1] row
+    cdef size_t i, j
+    if not isinstance(inbag, np.ndarray):
+        counts = inbag
+        return counts
+    counts.resize(inbag.shape[0])
+    for i in range(inbag.shape[0]):
+        row = np.ascontiguousarray(inbag[i], dtype=np.uint64)
+        counts[i].resize(row.shape[0])
+        with nogil:
+            for j in range(row.shape[0]):
+                counts[i][j] = row[j]
+    return counts
+
+
+def fold_missing_features(importance, missing_features, size_t num_samples):
+    """Add the importance of twin features to the features they were derived from.
+
+    Importances are laid out feature by feature, with ``num_samples`` values per
+    feature, and the twin features last.
+    """
+    if len(missing_features) == 0:
+        return importance
+    importance = np.asarray(importance).reshape(-1, num_samples)
+    num_cols = importance.shape[0] - len(missing_features)
+    folded = importance[:num_cols].copy()
+    for twin, col in enumerate(missing_features):
+        folded[col] += importance[num_cols + twin]
+    return folded.ravel().tolist()
+
+
 cpdef dict ranger(
     ranger_.TreeType treetype,
-    np.ndarray[double, ndim=2, mode="fortran"] x,
+    np.ndarray[double, ndim=2] x,
     np.ndarray[double, ndim=2, mode="fortran"] y,
     vector[string]& variable_names,
     unsigned int mtry,
@@ -100,11 +218,12 @@ cpdef dict ranger(
     bool order_snps,
     bool oob_error,
     unsigned int max_depth,
-    vector[vector[size_t]]& inbag,
+    inbag,
     bool use_inbag,
     vector[double]& regularization_factor,
     bool use_regularization_factor,
     bool regularization_usedepth,
+    vector[size_t]& missing_features,
 ):
     """Cython function interface to ranger.
     
@@ -155,6 +274,8 @@ cpdef dict ranger(
     cdef vector[double] unique_timepoints
     cdef vector[vector[vector[double]]] terminal_class_counts
     cdef vector[vector[vector[double]]] predictions
+    cdef vector[vector[size_t]] inbag_counts
+    cdef vector[vector[size_t]] manual_inbag
 
     try:
         if not use_split_select_weights:
@@ -165,8 +286,8 @@ cpdef dict ranger(
             unordered_variable_names.clear()
         if not use_case_weights:
             case_weights.clear()
-        if not use_inbag:
-            inbag.clear()
+        if use_inbag:
+            manual_inbag = inbag_vector(inbag)
         if not use_regularization_factor:
             regularization_factor.clear()
 
@@ -175,7 +296,20 @@ cpdef dict ranger(
         else:
             verbose_out = <ranger_.ostream*> new ranger_.stringstream()
 
-        data = DataNumpy(x, y, variable_names)
+        # features with missing values are given twin features, see DataNumpy.h
+        if use_regularization_factor and regularization_factor.size() == 1 and not missing_features.empty():
+            # a single factor applies to all features, including the twins
+            regularization_factor.assign(x.shape[1], regularization_factor[0])
+        for col in missing_features:
+            variable_names.push_back(variable_names[col] + b".missing")
+            if use_split_select_weights:
+                for i in range(split_select_weights.size()):
+                    split_select_weights[i].push_back(split_select_weights[i][col])
+            if use_regularization_factor:
+                regularization_factor.push_back(regularization_factor[col])
+
+        with profiling.phase("load_data"):
+            data = DataNumpy(x, y, variable_names, missing_features)
 
         if treetype == ranger_.TreeType.TREE_CLASSIFICATION:
             if probability:
@@ -189,115 +323,128 @@ cpdef dict ranger(
         elif treetype == ranger_.TreeType.TREE_PROBABILITY:
             forest.reset(new ranger_.ForestProbability())
 
-        deref(forest).initR(
-            move(data.c_data),
-            mtry,
-            num_trees,
-            verbose_out,
-            seed,
-            num_threads,
-            importance_mode,
-            min_node_size,
-            split_select_weights,
-            always_split_variable_names,
-            prediction_mode,
-            sample_with_replacement,
-            unordered_variable_names,
-            save_memory,
-            splitrule,
-            case_weights,
-            inbag,
-            predict_all,
-            keep_inbag,
-            sample_fraction,
-            alpha,
-            minprop,
-            holdout,
-            prediction_type,
-            num_random_splits,
-            order_snps,
-            max_depth,
-            regularization_factor,
-            regularization_usedepth,
-        )
+        with profiling.phase("init"):
+            deref(forest).initR(
+                move(data.c_data),
+                mtry,
+                num_trees,
+                verbose_out,
+                seed,
+                num_threads,
+                importance_mode,
+                min_node_size,
+                split_select_weights,
+                always_split_variable_names,
+                prediction_mode,
+                sample_with_replacement,
+                unordered_variable_names,
+                save_memory,
+                splitrule,
+                case_weights,
+                manual_inbag,
+                predict_all,
+                keep_inbag,
+                sample_fraction,
+                alpha,
+                minprop,
+                holdout,
+                prediction_type,
+                num_random_splits,
+                order_snps,
+                max_depth,
+                regularization_factor,
+                regularization_usedepth,
+            )
 
         if prediction_mode:
-            child_node_ids = loaded_forest["child_node_ids"]
-            split_var_ids = loaded_forest["split_var_ids"]
-            split_values = loaded_forest["split_values"]
-            is_ordered = loaded_forest["is_ordered"]
-
-            if treetype == ranger_.TreeType.TREE_CLASSIFICATION:
-                class_values = loaded_forest["class_values"]
-                (<ranger_.ForestClassification*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, class_values, is_ordered)
-            elif treetype == ranger_.TreeType.TREE_REGRESSION:
-                (<ranger_.ForestRegression*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, is_ordered)
-            elif treetype == ranger_.TreeType.TREE_SURVIVAL:
-                cumulative_hazard_function = loaded_forest["cumulative_hazard_function"]
-                unique_timepoints = loaded_forest["unique_death_times"]
-                (<ranger_.ForestSurvival*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, cumulative_hazard_function, unique_timepoints, is_ordered)
-            elif treetype == ranger_.TreeType.TREE_PROBABILITY:
-                class_values = loaded_forest["class_values"]
-                terminal_class_counts = loaded_forest["terminal_class_counts"]
-                (<ranger_.ForestProbability*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, class_values, terminal_class_counts, is_ordered)
+            with profiling.phase("load_forest"):
+                child_node_ids = loaded_forest["child_node_ids"]
+                split_var_ids = loaded_forest["split_var_ids"]
+                split_values = loaded_forest["split_values"]
+                is_ordered = loaded_forest["is_ordered"]
+
+                if treetype == ranger_.TreeType.TREE_CLASSIFICATION:
+                    class_values = loaded_forest["class_values"]
+                    (<ranger_.ForestClassification*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, class_values, is_ordered)
+                elif treetype == ranger_.TreeType.TREE_REGRESSION:
+                    (<ranger_.ForestRegression*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, is_ordered)
+                elif treetype == ranger_.TreeType.TREE_SURVIVAL:
+                    cumulative_hazard_function = loaded_forest["cumulative_hazard_function"]
+                    unique_timepoints = loaded_forest["unique_death_times"]
+                    (<ranger_.ForestSurvival*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, cumulative_hazard_function, unique_timepoints, is_ordered)
+                elif treetype == ranger_.TreeType.TREE_PROBABILITY:
+                    class_values = loaded_forest["class_values"]
+                    terminal_class_counts = loaded_forest["terminal_class_counts"]
+                    (<ranger_.ForestProbability*> forest.get()).loadForest(num_trees, child_node_ids, split_var_ids, split_values, class_values, terminal_class_counts, is_ordered)
         else:
             if treetype == ranger_.TreeType.TREE_CLASSIFICATION and not class_weights.empty():
                 (<ranger_.ForestClassification*> forest.get()).setClassWeights(class_weights)
             elif treetype == ranger_.TreeType.TREE_PROBABILITY and not class_weights.empty():
                 (<ranger_.ForestProbability*> forest.get()).setClassWeights(class_weights)
 
-        deref(forest).run(verbose, oob_error)
+        # release the GIL while growing or predicting so other python threads can run
+        with profiling.phase("run"):
+            with nogil:
+                deref(forest).run(verbose, oob_error)
 
         if use_split_select_weights and importance_mode != ranger_.ImportanceMode.IMP_NONE:
             if verbose_out:
                 verbose_out.write("Warning: Split select weights used. Variable importance measures are only comparable for variables with equal weights.\n", 1)
 
-        predictions = deref(forest).getPredictions()
-        if predictions.size() == 1:
-            if predictions[0].size() == 1:
-                result["predictions"] = predictions[0][0]
+        with profiling.phase("convert_result"):
+            predictions = deref(forest).getPredictions()
+            if prediction_mode and prediction_type == ranger_.PredictionType.TERMINALNODES:
+                result["predictions"] = terminal_nodes_array(predictions)
+            elif predictions.size() == 1:
+                if predictions[0].size() == 1:
+                    result["predictions"] = predictions[0][0]
+                else:
+                    result["predictions"] = predictions[0]
             else:
-                result["predictions"] = predictions[0]
-        else:
-            result["predictions"] = predictions
-
-        result["num_trees"] = deref(forest).getNumTrees()
-        result["num_independent_variables"] = deref(forest).getNumIndependentVariables()
-        if treetype == ranger_.TreeType.TREE_SURVIVAL:
-            result["unique_death_times"] = (<ranger_.ForestSurvival*> forest.get()).getUniqueTimepoints()
-        if not prediction_mode:
-            result["mtry"] = deref(forest).getMtry()
-            result["min_node_size"] = deref(forest).getMinNodeSize()
-            if importance_mode != ranger_.ImportanceMode.IMP_NONE:
-                result["variable_importance"] = deref(forest).getVariableImportance()
-                if importance_mode == ranger_.ImportanceMode.IMP_PERM_CASEWISE:
-                    result["variable_importance_local"] = deref(forest).getVariableImportanceCasewise()
-            result["prediction_error"] = deref(forest).getOverallPredictionError()
-
-        if keep_inbag:
-            result["inbag_counts"] = deref(forest).getInbagCounts()
-
-        if write_forest:
-            forest_object = {
-                "num_trees": deref(forest).getNumTrees(),
-                "child_node_ids": deref(forest).getChildNodeIDs(),
-                "split_var_ids": deref(forest).getSplitVarIDs(),
-                "split_values": deref(forest).getSplitValues(),
-                "is_ordered": deref(forest).getIsOrderedVariable()
-            }
-
-            if treetype == ranger_.TreeType.TREE_CLASSIFICATION:
-                class_values_ = (<ranger_.ForestClassification*> forest.get()).getClassValues()
-                forest_object["class_values"] = []
-                for c in class_values_[:class_values_.size()]:
-                    forest_object["class_values"].append(c)
-            elif treetype == ranger_.TreeType.TREE_PROBABILITY:
-                forest_object["class_values"] = (<ranger_.ForestProbability*> forest.get()).getClassValues()
-                forest_object["terminal_class_counts"] = (<ranger_.ForestProbability*> forest.get()).getTerminalClassCounts()
-            elif treetype == ranger_.TreeType.TREE_SURVIVAL:
-                forest_object["cumulative_hazard_function"] = (<ranger_.ForestSurvival*> forest.get()).getChf()
-                forest_object["unique_death_times"] = (<ranger_.ForestSurvival*> forest.get()).getUniqueTimepoints()
-            result["forest"] = forest_object
+                result["predictions"] = predictions
+
+            result["num_trees"] = deref(forest).getNumTrees()
+            result["num_independent_variables"] = deref(forest).getNumIndependentVariables()
+            if treetype == ranger_.TreeType.TREE_SURVIVAL:
+                result["unique_death_times"] = (<ranger_.ForestSurvival*> forest.get()).getUniqueTimepoints()
+            if not prediction_mode:
+                result["mtry"] = deref(forest).getMtry()
+                result["min_node_size"] = deref(forest).getMinNodeSize()
+                if importance_mode != ranger_.ImportanceMode.IMP_NONE:
+                    result["variable_importance"] = fold_missing_features(
+                        deref(forest).getVariableImportance(), missing_features, 1
+                    )
+                    if importance_mode == ranger_.ImportanceMode.IMP_PERM_CASEWISE:
+                        result["variable_importance_local"] = fold_missing_features(
+                            deref(forest).getVariableImportanceCasewise(), missing_features, x.shape[0]
+                        )
+                result["prediction_error"] = deref(forest).getOverallPredictionError()
+
+            if keep_inbag:
+                inbag_counts = deref(forest).getInbagCounts()
+                result["inbag_counts"] = inbag_counts_array(inbag_counts)
+
+            if write_forest:
+                forest_object = {
+                    "num_trees": deref(forest).getNumTrees(),
+                    "child_node_ids": deref(forest).getChildNodeIDs(),
+                    "split_var_ids": deref(forest).getSplitVarIDs(),
+                    "split_values": deref(forest).getSplitValues(),
+                    "is_ordered": deref(forest).getIsOrderedVariable()
+                }
+
+                if treetype == ranger_.TreeType.TREE_CLASSIFICATION:
+                    class_values_ = (<ranger_.ForestClassification*> forest.get()).getClassValues()
+                    forest_object["class_values"] = []
+                    for c in class_values_[:class_values_.size()]:
+                        forest_object["class_values"].append(c)
+                elif treetype == ranger_.TreeType.TREE_PROBABILITY:
+                    forest_object["class_values"] = (<ranger_.ForestProbability*> forest.get()).getClassValues()
+                    forest_object["terminal_class_counts"] = (<ranger_.ForestProbability*> forest.get()).getTerminalClassCounts()
+                elif treetype == ranger_.TreeType.TREE_SURVIVAL:
+                    forest_object["cumulative_hazard_function"] = (<ranger_.ForestSurvival*> forest.get()).getChf()
+                    forest_object["unique_death_times"] = (<ranger_.ForestSurvival*> forest.get()).getUniqueTimepoints()
+                result["forest"] = forest_object
 
         if not verbose:
             del verbose_out
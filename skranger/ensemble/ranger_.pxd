@@ -85,7 +85,9 @@ cdef extern from "DataNumpy.h" namespace "ranger":
             vector[string] variable_names,
             size_t num_rows,
             size_t num_cols,
-            size_t num_cols_y
+            size_t num_cols_y,
+            bool row_major,
+            vector[size_t] missing_cols
         )
 
 cdef extern from "./ranger/src/Tree/Tree.cpp":
@@ -180,7 +182,7 @@ cdef extern from "./ranger/src/Forest/Forest.h" namespace "ranger":
             int max_depth,
             const vector[double]& regularization_factor,
             bool regularization_usedepth
-        )
+        ) except +
         void initR(
             unique_ptr[DataNumpy] input_data,
             int mtry,
@@ -211,8 +213,8 @@ cdef extern from "./ranger/src/Forest/Forest.h" namespace "ranger":
             int max_depth,
             const vector[double]& regularization_factor,
             bool regularization_usedepth,
-        )
-        void run(bool verbose, bool compute_oob_error)
+        ) except +
+        void run(bool verbose, bool compute_oob_error) except + nogil
         void saveToFile()
         vector[vector[vector[size_t]]] getChildNodeIDs()
         const vector[bool]& getIsOrderedVariable()
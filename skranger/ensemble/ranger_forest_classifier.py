@@ -1,17 +1,34 @@
 """Scikit-learn wrapper for ranger classification."""
 import numpy as np
+from scipy import sparse
 from sklearn.base import BaseEstimator
 from sklearn.base import ClassifierMixin
 from sklearn.utils import check_X_y
 from sklearn.utils.validation import _check_sample_weight
-from sklearn.utils.validation import check_array
 from sklearn.utils.validation import check_is_fitted
 
+from skranger import profiling
 from skranger.ensemble import ranger
+from skranger.ensemble.base import ALLOW_NAN
+from skranger.ensemble.base import RangerApplyMixin
+from skranger.ensemble.base import RangerArrowMixin
+from skranger.ensemble.base import RangerAsyncMixin
+from skranger.ensemble.base import RangerGrowMixin
+from skranger.ensemble.base import RangerJackknifeMixin
 from skranger.ensemble.base import RangerValidationMixin
+from skranger.ensemble.base import _mean_over_trees
 
 
-class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimator):
+class RangerForestClassifier(
+    RangerValidationMixin,
+    RangerGrowMixin,
+    RangerApplyMixin,
+    RangerJackknifeMixin,
+    RangerArrowMixin,
+    RangerAsyncMixin,
+    ClassifierMixin,
+    BaseEstimator,
+):
     r"""Ranger Random Forest Probability/Classification implementation for sci-kit learn.
 
     Provides a sklearn classifier interface to the Ranger C++ library using Cython.
@@ -33,7 +50,13 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
     :param list class_weights: Weights for the outcome classes.
     :param bool keep_inbag: If true, save how often observations are in-bag in each
         tree. These will be stored in the ``ranger_forest_`` attribute under the key
-        ``"inbag_counts"``.
+        ``"inbag_counts"``, as an array of shape ``(n_estimators, n_samples)`` of the
+        smallest unsigned integer type holding the counts. Counts of at most one, as
+        when sampling without replacement, are bit-packed under ``"inbag_bits"``.
+    :param bool regenerate_inbag: If true, in-bag samples are drawn by skranger from
+        a seed per tree and passed to ranger, so that with ``keep_inbag`` the in-bag
+        counts can be drawn again when needed rather than stored. Cannot be used with
+        ``inbag``, ``sample_weight`` or class-wise ``sample_fraction``.
     :param list inbag: A list of size ``n_estimators``, containing inbag counts for each
         observation. Can be used for stratified sampling.
     :param str split_rule: One of ``gini``, ``extratrees``, ``hellinger``;
@@ -42,12 +65,13 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
     :param list split_select_weights: Vector of weights between 0 and 1 of probabilities
         to select features for splitting.
     :param list always_split_features:  Features which should always be selected for
-        splitting. A list of column index values.
-    :param list categorical_features: A list of column index values which should be
-        considered categorical, or unordered.
+        splitting. A list of column index values or DataFrame column names.
+    :param list categorical_features: A list of column index values or DataFrame column
+        names which should be considered categorical, or unordered. Columns of
+        ``category`` dtype are considered categorical automatically.
     :param str respect_categorical_features: One of ``ignore``, ``order``, ``partition``.
-        The default is ``partition`` for the ``extratrees`` splitrule, otherwise the
-        default is ``ignore``.
+        The default is ``partition`` for the ``extratrees`` splitrule or when ``X`` has
+        columns of ``category`` dtype, otherwise the default is ``ignore``.
     :param bool scale_permutation_importance: For ``permutation`` importance,
         scale permutation importance by standard error as in (Breiman 2001).
     :param bool local_importance: For ``permutation`` importance, calculate and
@@ -55,18 +79,65 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
     :param list regularization_factor: A vector of regularization factors for the
         features.
     :param bool regularization_usedepth: Whether to consider depth in regularization.
+    :param bool parallel_regularization: Grow regularized forests with ``n_jobs``
+        threads. Each tree doesn't penalize the features used by the earlier trees,
+        except by the ``n_jobs - 1`` trees grown concurrently before it, so the forest
+        differs from the one grown by a single thread. By default regularized forests
+        are grown by a single thread.
     :param bool holdout: Hold-out all samples with case weight 0 and use these for
         feature importance and prediction error.
     :param bool oob_error: Whether to calculate out-of-bag prediction error.
-    :param int n_jobs: The number of threads. Default is number of CPU cores.
+    :param bool sparse_class_counts: Store each terminal node's class distribution as
+        a sparse vector of its nonzero class fractions, rather than as a dense vector
+        over all classes. Predictions accumulate the sparse terminal node vectors
+        directly, which reduces model size and prediction memory when there are many
+        classes and few classes per terminal node.
+    :param callable on_tree_grown: A function called with ``(i, elapsed)`` for each
+        grown tree ``i``, where ``elapsed`` is the number of seconds since training
+        started. Returning ``True`` cancels training, keeping the trees grown so far.
+        When set, trees are grown in blocks of 16 trees, ``n_jobs`` blocks at a time,
+        the callback is invoked for the trees of each block once it is grown, in
+        order, and training is cancelled between blocks. Variable importances are
+        averaged over the blocks.
+    :param float timeout: The number of seconds after which training stops, keeping
+        the trees grown so far. Training stops before a block of trees which is
+        expected to exceed the timeout. Trees are grown in blocks as for
+        ``on_tree_grown``.
+    :param bool early_stopping: Grow trees in blocks as for ``on_tree_grown`` and
+        stop once the out-of-bag error of the forest converges, checked after every
+        block. Out-of-bag predictions are accumulated over the blocks, so the error is
+        tracked without predicting again. When stopped early, the forest has fewer
+        than ``n_estimators`` trees.
+    :param int n_iter_no_change: The number of blocks of 16 trees without improvement
+        of the out-of-bag error after which training stops, for ``early_stopping``.
+    :param float tol: The minimal improvement of the out-of-bag error, for
+        ``early_stopping``.
+    :param int memory_limit: The number of bytes fitting may use, checked against an
+        estimate of the peak memory before training starts, see
+        ``skranger.memory.estimate_memory``. If the estimate exceeds the limit,
+        ``save_memory`` is enabled when that brings the estimate within the limit,
+        otherwise fitting raises a ``ValueError``.
+    :param int n_jobs: The number of threads. Default is the number of threads set by
+        ``skranger.set_num_threads``, the number of CPU cores unless set.
     :param bool save_memory: Save memory at the cost of speed growing trees.
-    :param int seed: Random seed value.
+    :param int seed: Random seed value. Each tree is seeded from ``seed`` and its
+        index, or the index of its block when grown in blocks, so the trees don't
+        depend on ``n_jobs``.
 
     :ivar list classes\_: The class labels determined from the fit input ``y``.
     :ivar int n_classes\_: The number of unique class labels from the fit input ``y``.
     :ivar int n_features\_: The number of features (columns) from the fit input ``X``.
     :ivar list feature_names\_: Names for the features of the fit input ``X``.
+    :ivar dict categories\_: The categories of the ``category`` columns of a DataFrame
+        fit input ``X``, by column. Values outside the categories are treated as missing.
+    :ivar list missing_features\_: The indices of the features with missing values in
+        the fit input ``X``. Each of these gets a twin feature sending missing values to
+        the other child, which counts towards the default ``mtry`` of the square root
+        of the number of features. Missing values aren't supported with the
+        ``extratrees`` splitrule.
     :ivar dict ranger_forest\_: The returned result object from calling C++ ranger.
+    :ivar int inbag_seed\_: The seed from which in-bag samples are drawn when
+        ``regenerate_inbag`` is set.
     :ivar int mtry\_: The mtry value as determined if ``mtry`` is callable, otherwise
         it is the same as ``mtry``.
     :ivar list sample_fraction\_: The sample fraction determined by input validation
@@ -76,6 +147,8 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
         input validation.
     :ivar int split_rule\_: The split rule integer corresponding to ranger enum
         ``SplitRule``.
+    :ivar bool save_memory\_: Whether memory is saved growing trees, from
+        ``save_memory`` or enabled by ``memory_limit``.
     :ivar bool use_regularization_factor\_: Input validation determined bool for using
         regularization factor input parameter.
     :ivar int importance_mode\_: The importance mode integer corresponding to ranger
@@ -106,8 +179,17 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
         local_importance=False,
         regularization_factor=None,
         regularization_usedepth=False,
+        parallel_regularization=False,
         holdout=False,
         oob_error=False,
+        sparse_class_counts=False,
+        early_stopping=False,
+        n_iter_no_change=5,
+        tol=1e-4,
+        on_tree_grown=None,
+        timeout=None,
+        regenerate_inbag=False,
+        memory_limit=None,
         n_jobs=-1,
         save_memory=False,
         seed=42,
@@ -133,12 +215,22 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
         self.local_importance = local_importance
         self.regularization_factor = regularization_factor
         self.regularization_usedepth = regularization_usedepth
+        self.parallel_regularization = parallel_regularization
         self.holdout = holdout
         self.oob_error = oob_error
+        self.sparse_class_counts = sparse_class_counts
+        self.early_stopping = early_stopping
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.on_tree_grown = on_tree_grown
+        self.timeout = timeout
+        self.regenerate_inbag = regenerate_inbag
+        self.memory_limit = memory_limit
         self.n_jobs = n_jobs
         self.save_memory = save_memory
         self.seed = seed
 
+    @profiling.profiled("fit", set_timings=True)
     def fit(self, X, y, sample_weight=None):
         """Fit the ranger random forest using training data.
 
@@ -149,12 +241,14 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
         self.tree_type_ = 9  # tree_type, TREE_PROBABILITY enables predict_proba
 
         # Check input
-        X, y = check_X_y(X, y)
-        if sample_weight is not None:
-            sample_weight = _check_sample_weight(sample_weight, X)
+        with profiling.phase("check_input"):
+            X, y = check_X_y(self._convert_frame(X, reset=True), y, **ALLOW_NAN)
+            if sample_weight is not None:
+                sample_weight = _check_sample_weight(sample_weight, X)
 
         # Check the init parameters
-        self._validate_parameters(X, y, sample_weight)
+        with profiling.phase("validate_parameters"):
+            self._validate_parameters(X, y, sample_weight)
 
         # Map classes to indices
         y = np.copy(y)
@@ -162,131 +256,352 @@ class RangerForestClassifier(RangerValidationMixin, ClassifierMixin, BaseEstimat
         self.n_classes_ = len(self.classes_)
 
         # Set X info
-        self.feature_names_ = [str(c).encode() for c in range(X.shape[1])]
         self.n_features_ = X.shape[1]
 
         if self.always_split_features is not None:
-            always_split_features = [str(c).encode() for c in self.always_split_features]
+            always_split_features = [self._feature_name(c) for c in self.always_split_features]
         else:
             always_split_features = []
 
+        with profiling.phase("convert_input"):
+            X_ranger = np.asfortranarray(X, dtype="float64")
+            y_ranger = np.asfortranarray(np.atleast_2d(y).astype("float64").transpose())
         # Fit the forest
-        self.ranger_forest_ = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray(np.atleast_2d(y).astype("float64").transpose()),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            True,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            always_split_features,  # always_split_variable_names
-            bool(always_split_features),  # use_always_split_variable_names
-            False,  # prediction_mode
-            {},  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_variable_names
-            bool(self.categorical_features_),  # use_unordered_variable_names
-            self.save_memory,
-            self.split_rule_,
-            sample_weight or [],  # case_weights
-            bool(sample_weight),  # use_case_weights
-            self.class_weights or [],
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            0.5,  # alpha, ignored because maxstat can't be used on classification
-            0.1,  # minprop, ignored because maxstat can't be used on classification
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            False,  # use_regularization_factor
-            self.regularization_usedepth,
-        )
+        def grow(start, stop, seed, regularization_factor, num_threads):
+            inbag = self._get_manual_inbag(start, stop, X.shape[0])
+            return ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                y_ranger,
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                stop - start,  # num_trees
+                self.verbose,
+                seed,
+                num_threads,
+                True,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                always_split_features,  # always_split_variable_names
+                bool(always_split_features),  # use_always_split_variable_names
+                False,  # prediction_mode
+                {},  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_variable_names
+                bool(self.categorical_features_),  # use_unordered_variable_names
+                self.save_memory_,
+                self.split_rule_,
+                sample_weight if sample_weight is not None else [],  # case_weights
+                sample_weight is not None,  # use_case_weights
+                self.class_weights or [],
+                False,  # predict_all
+                self.keep_inbag or self._tracks_oob(),
+                self.sample_fraction_,
+                0.5,  # alpha, ignored because maxstat can't be used on classification
+                0.1,  # minprop, ignored because maxstat can't be used on classification
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error or self.early_stopping,
+                self.max_depth,
+                inbag,
+                len(inbag) > 0,  # use_inbag
+                regularization_factor,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
+
+        with profiling.phase("ranger"):
+            self.ranger_forest_ = self._grow_forest(grow, y_ranger)
         self.ranger_class_order_ = np.argsort(np.array(self.ranger_forest_["forest"]["class_values"]).astype(int))
+        if self.sparse_class_counts:
+            with profiling.phase("compress"):
+                self._compress_class_counts()
         return self
 
-    def predict(self, X):
+    def _oob_prediction_error(self, predictions, y):
+        """Mean squared error of the out of bag probabilities of the true classes.
+
+        This is the prediction error ranger computes for probability forests.
+
+        :param array2d predictions: out of bag probabilities in ranger's class order
+        :param array2d y: the training target passed to ranger
+        """
+        # ranger orders classes by their first appearance in y
+        _, first = np.unique(y[:, 0], return_index=True)
+        class_values = y[np.sort(first), 0]
+        return np.mean((1 - predictions[y[:, [0]] == class_values]) ** 2)
+
+    def _get_terminal_node_classes(self):
+        """Get the majority class of each terminal node, computed on first use.
+
+        The classes are stored per tree in the ``terminal_node_classes`` of the fitted
+        forest, in ranger's class values, with NaN for the other nodes.
+        """
+        if "terminal_node_classes" in self.ranger_forest_:
+            return self.ranger_forest_["terminal_node_classes"]
+        forest = self.ranger_forest_["forest"]
+        class_values = np.asarray(forest["class_values"], dtype=float)
+        # columns of the class fractions are in the order of classes_
+        class_idx = class_values.astype(int)
+        node_classes = []
+        for tree, (left, right) in enumerate(forest["child_node_ids"]):
+            terminal = np.flatnonzero((np.asarray(left) == 0) & (np.asarray(right) == 0))
+            if self.sparse_class_counts:
+                rows = forest["node_offsets"][tree] + terminal
+                counts = forest["class_fractions"][rows].toarray()[:, class_idx]
+            else:
+                counts = np.array([forest["terminal_class_counts"][tree][node] for node in terminal])
+            classes = np.full(len(left), np.nan)
+            if len(terminal) > 0:
+                classes[terminal] = class_values[np.argmax(counts, axis=1)]
+            node_classes.append(classes)
+        self.ranger_forest_["terminal_node_classes"] = node_classes
+        return node_classes
+
+    def _get_majority_vote_forest(self):
+        """Get the forest to load as a classification forest to count majority votes.
+
+        Probability trees don't use the split values of terminal nodes, while
+        classification trees store the class they predict there, so the forest is
+        copied with the majority class of each terminal node as its split value.
+        """
+        forest = dict(self.ranger_forest_["forest"])
+        forest["split_values"] = [
+            np.where(np.isnan(classes), split_values, classes).tolist()
+            for split_values, classes in zip(forest["split_values"], self._get_terminal_node_classes())
+        ]
+        return forest
+
+    def _compress_class_counts(self):
+        """Replace the dense terminal class counts with a sparse encoding.
+
+        The forest's ``terminal_class_counts`` is replaced by ``class_fractions``, a
+        sparse matrix with one row per node of every tree and one column per class in
+        the order of ``classes_``. Rows of tree ``i`` start at ``node_offsets[i]``.
+        """
+        forest = self.ranger_forest_["forest"]
+        class_counts = forest.pop("terminal_class_counts")
+        class_idx = np.array(forest["class_values"]).astype(int)
+        node_offsets = np.cumsum([0] + [len(tree) for tree in class_counts])
+
+        rows, cols, values = [np.empty(0, dtype=int)], [np.empty(0, dtype=int)], [np.empty(0)]
+        for tree_idx, tree in enumerate(class_counts):
+            terminal_nodes = np.array([node for node, counts in enumerate(tree) if len(counts) > 0], dtype=int)
+            if len(terminal_nodes) == 0:
+                continue
+            fractions = np.array([tree[node] for node in terminal_nodes])
+            count_rows, count_cols = np.nonzero(fractions)
+            rows.append(node_offsets[tree_idx] + terminal_nodes[count_rows])
+            cols.append(class_idx[count_cols])
+            values.append(fractions[count_rows, count_cols])
+
+        forest["class_fractions"] = sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(node_offsets[-1], self.n_classes_),
+        )
+        forest["node_offsets"] = node_offsets[:-1]
+
+    def _tree_probabilities(self, terminal_nodes):
+        """Get the class probabilities predicted by each tree.
+
+        :param array2d terminal_nodes: terminal node ids of shape ``(n_samples, n_trees)``
+        :return: an array of shape ``(n_samples, n_trees, n_classes)``, with classes in
+            the order of ``classes_``
+        """
+        forest = self.ranger_forest_["forest"]
+        n_samples, n_trees = terminal_nodes.shape
+        if self.sparse_class_counts:
+            rows = (terminal_nodes + forest["node_offsets"]).ravel()
+            return forest["class_fractions"][rows].toarray().reshape(n_samples, n_trees, self.n_classes_)
+
+        probas = np.empty((n_samples, n_trees, self.n_classes_))
+        for tree, class_counts in enumerate(forest["terminal_class_counts"]):
+            nodes, inverse = np.unique(terminal_nodes[:, tree], return_inverse=True)
+            node_probas = np.array([class_counts[node] for node in nodes])[:, self.ranger_class_order_]
+            probas[:, tree] = node_probas[inverse.ravel()]
+        return probas
+
+    def _predict_sparse_proba(self, X):
+        """Predict a sparse matrix of class probabilities from the sparse class fractions.
+
+        :param array2d X: prediction input features
+        """
+        forest = self.ranger_forest_["forest"]
+        terminal_nodes = self._get_terminal_nodes(X)
+        n_samples, n_trees = terminal_nodes.shape
+        selection = sparse.csr_matrix(
+            (
+                np.ones(n_samples * n_trees),
+                (terminal_nodes + forest["node_offsets"]).ravel(),
+                np.arange(0, n_samples * n_trees + 1, n_trees),
+            ),
+            shape=(n_samples, forest["class_fractions"].shape[0]),
+        )
+        return (selection @ forest["class_fractions"]) / n_trees
+
+    @staticmethod
+    def _top_k(probas, top_k):
+        """Keep the ``top_k`` largest probabilities in each row of a probability matrix.
+
+        :param array2d probas: dense or sparse matrix of class probabilities
+        :param int top_k: the number of probabilities to keep per row
+        """
+        probas = sparse.csr_matrix(probas)
+        probas.eliminate_zeros()
+        rows = np.repeat(np.arange(probas.shape[0]), np.diff(probas.indptr))
+        order = np.lexsort((-probas.data, rows))
+        rank = np.arange(len(order)) - probas.indptr[rows[order]]
+        keep = order[rank < top_k]
+        return sparse.csr_matrix((probas.data[keep], (rows[keep], probas.indices[keep])), shape=probas.shape)
+
+    @profiling.profiled("predict")
+    def predict(self, X, majority_vote=False, return_std=False):
         """Predict classes from X.
 
         :param array2d X: prediction input features
+        :param bool majority_vote: If True, predict the class most trees vote for, each
+            tree voting for the majority class of the terminal node a sample ends up
+            in. The votes are counted by ranger, without computing the class
+            probabilities. By default the class with the highest mean probability is
+            predicted.
+        :param bool return_std: If True, also return the standard errors of the class
+            probabilities, estimated with the bias corrected infinitesimal jackknife.
+            Requires ``keep_inbag=True``.
+        :return: the predicted classes, or a tuple of predicted classes and standard
+            errors of shape ``(n_samples, n_classes)`` if ``return_std`` is True.
         """
+        if return_std:
+            if majority_vote:
+                raise ValueError("return_std is only available for probability predictions")
+            check_is_fitted(self)
+            with profiling.phase("check_input"):
+                X = self._check_input(X)
+            tree_probas = self._tree_probabilities(self._get_terminal_nodes(X))
+            probas = _mean_over_trees(tree_probas)
+            return self.classes_.take(np.argmax(probas, axis=1), axis=0), self._jackknife_std(tree_probas)
+        if majority_vote:
+            check_is_fitted(self)
+            with profiling.phase("check_input"):
+                X = self._check_input(X)
+            result = self._predict_ranger(X, 1, self._get_majority_vote_forest())  # TREE_CLASSIFICATION
+            predictions = np.asarray(result["predictions"])
+            return self.classes_.take(predictions.astype(int), axis=0)
+        if self.sparse_class_counts:
+            check_is_fitted(self)
+            with profiling.phase("check_input"):
+                X = self._check_input(X)
+            probas = self._predict_sparse_proba(X)
+            return self.classes_.take(np.asarray(probas.argmax(axis=1)).ravel(), axis=0)
         probas = self.predict_proba(X)
         return self.classes_.take(np.argmax(probas, axis=1), axis=0)
 
-    def predict_proba(self, X):
+    @profiling.profiled("predict_proba")
+    def predict_proba(self, X, top_k=None):
         """Predict probabilities for classes from X.
 
         :param array2d X: prediction input features
+        :param int top_k: If set, return a sparse matrix containing only the ``top_k``
+            largest class probabilities of each sample, instead of the dense matrix of
+            probabilities for all classes.
         """
         check_is_fitted(self)
-        X = check_array(X)
-
-        result = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray([[]]),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            False,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            [],  # always_split_variable_names
-            False,  # use_always_split_variable_names
-            True,  # prediction_mode
-            self.ranger_forest_["forest"],  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_feature_names
-            bool(self.categorical_features_),  # use_unordered_features
-            self.save_memory,
-            self.split_rule_,
-            [],  # case_weights
-            False,  # use_case_weights
-            self.class_weights or [],
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            0.5,  # alpha
-            0.1,  # minprop
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            self.use_regularization_factor_,
-            self.regularization_usedepth,
-        )
-        predictions = np.atleast_2d(np.array(result["predictions"]))
-        return predictions[:, self.ranger_class_order_]
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be a positive number of classes")
+
+        if self.sparse_class_counts:
+            probas = self._predict_sparse_proba(X)
+            if top_k is not None:
+                return self._top_k(probas, top_k)
+            return probas.toarray()
+
+        result = self._predict_ranger(X, self.tree_type_)
+        predictions = np.atleast_2d(np.array(result["predictions"]))[:, self.ranger_class_order_]
+        if top_k is not None:
+            return self._top_k(predictions, top_k)
+        return predictions
+
+    def _predict_ranger(self, X, tree_type, forest=None):
+        """Predict X with ranger, loading the forest as the given tree type.
+
+        :param array2d X: prediction input features
+        :param int tree_type: 9 to predict class probabilities, 1 to predict majority
+            votes
+        :param dict forest: the forest to load, by default the fitted forest
+        """
+        if forest is None:
+            forest = self.ranger_forest_["forest"]
+        with profiling.phase("convert_input"):
+            X_ranger = np.asarray(X, dtype="float64")
+        with profiling.phase("ranger"):
+            result = ranger.ranger(
+                tree_type,
+                X_ranger,
+                np.asfortranarray([[]]),
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                self.ranger_forest_["forest"]["num_trees"],  # num_trees
+                self.verbose,
+                self.seed,
+                self._prediction_threads(X_ranger),  # num_threads
+                False,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                [],  # always_split_variable_names
+                False,  # use_always_split_variable_names
+                True,  # prediction_mode
+                forest,  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_feature_names
+                bool(self.categorical_features_),  # use_unordered_features
+                self.save_memory,
+                self.split_rule_,
+                [],  # case_weights
+                False,  # use_case_weights
+                self.class_weights or [],
+                False,  # predict_all
+                self.keep_inbag,
+                self.sample_fraction_,
+                0.5,  # alpha
+                0.1,  # minprop
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error,
+                self.max_depth,
+                self.inbag or [],
+                bool(self.inbag),  # use_inbag
+                self.regularization_factor_,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
+        return result
+
+    async def apredict_proba(self, X):
+        """Predict probabilities for classes from X without blocking the event loop.
+
+        :param array2d X: prediction input features
+        """
+        return await self._submit_batched("predict_proba", X)
 
+    @profiling.profiled("predict_log_proba")
     def predict_log_proba(self, X):
         """Predict log probabilities for classes from X.
 
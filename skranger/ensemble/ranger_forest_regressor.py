@@ -4,14 +4,30 @@ from sklearn.base import BaseEstimator
 from sklearn.base import RegressorMixin
 from sklearn.utils import check_X_y
 from sklearn.utils.validation import _check_sample_weight
-from sklearn.utils.validation import check_array
 from sklearn.utils.validation import check_is_fitted
 
+from skranger import profiling
 from skranger.ensemble import ranger
+from skranger.ensemble.base import ALLOW_NAN
+from skranger.ensemble.base import RangerApplyMixin
+from skranger.ensemble.base import RangerArrowMixin
+from skranger.ensemble.base import RangerAsyncMixin
+from skranger.ensemble.base import RangerGrowMixin
+from skranger.ensemble.base import RangerJackknifeMixin
 from skranger.ensemble.base import RangerValidationMixin
+from skranger.ensemble.base import _mean_over_trees
 
 
-class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator):
+class RangerForestRegressor(
+    RangerValidationMixin,
+    RangerGrowMixin,
+    RangerApplyMixin,
+    RangerJackknifeMixin,
+    RangerArrowMixin,
+    RangerAsyncMixin,
+    RegressorMixin,
+    BaseEstimator,
+):
     r"""Ranger Random Forest Regression implementation for sci-kit learn.
 
     Provides a sklearn regressor interface to the Ranger C++ library using Cython. The
@@ -34,7 +50,13 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
         class specific values.
     :param bool keep_inbag: If true, save how often observations are in-bag in each
         tree. These will be stored in the ``ranger_forest_`` attribute under the key
-        ``"inbag_counts"``.
+        ``"inbag_counts"``, as an array of shape ``(n_estimators, n_samples)`` of the
+        smallest unsigned integer type holding the counts. Counts of at most one, as
+        when sampling without replacement, are bit-packed under ``"inbag_bits"``.
+    :param bool regenerate_inbag: If true, in-bag samples are drawn by skranger from
+        a seed per tree and passed to ranger, so that with ``keep_inbag`` the in-bag
+        counts can be drawn again when needed rather than stored. Cannot be used with
+        ``inbag``, ``sample_weight`` or class-wise ``sample_fraction``.
     :param list inbag: A list of size ``n_estimators``, containing inbag counts for each
         observation. Can be used for stratified sampling.
     :param str split_rule: One of ``variance``, ``extratrees``, ``maxstat``, ``beta``;
@@ -47,12 +69,13 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
     :param list split_select_weights: Vector of weights between 0 and 1 of probabilities
         to select features for splitting.
     :param list always_split_features:  Features which should always be selected for
-        splitting. A list of column index values.
-    :param list categorical_features: A list of column index values which should be
-        considered categorical, or unordered.
+        splitting. A list of column index values or DataFrame column names.
+    :param list categorical_features: A list of column index values or DataFrame column
+        names which should be considered categorical, or unordered. Columns of
+        ``category`` dtype are considered categorical automatically.
     :param str respect_categorical_features: One of ``ignore``, ``order``, ``partition``.
-        The default is ``partition`` for the ``extratrees`` splitrule, otherwise the
-        default is ``ignore``.
+        The default is ``partition`` for the ``extratrees`` splitrule or when ``X`` has
+        columns of ``category`` dtype, otherwise the default is ``ignore``.
     :param bool scale_permutation_importance: For ``permutation`` importance,
         scale permutation importance by standard error as in (Breiman 2001).
     :param bool local_importance: For ``permutation`` importance, calculate and
@@ -60,18 +83,60 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
     :param list regularization_factor: A vector of regularization factors for the
         features.
     :param bool regularization_usedepth: Whether to consider depth in regularization.
+    :param bool parallel_regularization: Grow regularized forests with ``n_jobs``
+        threads. Each tree doesn't penalize the features used by the earlier trees,
+        except by the ``n_jobs - 1`` trees grown concurrently before it, so the forest
+        differs from the one grown by a single thread. By default regularized forests
+        are grown by a single thread.
     :param bool holdout: Hold-out all samples with case weight 0 and use these for
         feature importance and prediction error.
     :param bool quantiles: Enable quantile regression after fitting. This must be
         set to ``True`` in order to call ``predict_quantiles`` after fitting.
     :param bool oob_error: Whether to calculate out-of-bag prediction error.
-    :param int n_jobs: The number of threads. Default is number of CPU cores.
+    :param callable on_tree_grown: A function called with ``(i, elapsed)`` for each
+        grown tree ``i``, where ``elapsed`` is the number of seconds since training
+        started. Returning ``True`` cancels training, keeping the trees grown so far.
+        When set, trees are grown in blocks of 16 trees, ``n_jobs`` blocks at a time,
+        the callback is invoked for the trees of each block once it is grown, in
+        order, and training is cancelled between blocks. Variable importances are
+        averaged over the blocks.
+    :param float timeout: The number of seconds after which training stops, keeping
+        the trees grown so far. Training stops before a block of trees which is
+        expected to exceed the timeout. Trees are grown in blocks as for
+        ``on_tree_grown``.
+    :param bool early_stopping: Grow trees in blocks as for ``on_tree_grown`` and
+        stop once the out-of-bag error of the forest converges, checked after every
+        block. Out-of-bag predictions are accumulated over the blocks, so the error is
+        tracked without predicting again. When stopped early, the forest has fewer
+        than ``n_estimators`` trees.
+    :param int n_iter_no_change: The number of blocks of 16 trees without improvement
+        of the out-of-bag error after which training stops, for ``early_stopping``.
+    :param float tol: The minimal improvement of the out-of-bag error, for
+        ``early_stopping``.
+    :param int memory_limit: The number of bytes fitting may use, checked against an
+        estimate of the peak memory before training starts, see
+        ``skranger.memory.estimate_memory``. If the estimate exceeds the limit,
+        ``save_memory`` is enabled when that brings the estimate within the limit,
+        otherwise fitting raises a ``ValueError``.
+    :param int n_jobs: The number of threads. Default is the number of threads set by
+        ``skranger.set_num_threads``, the number of CPU cores unless set.
     :param bool save_memory: Save memory at the cost of speed growing trees.
-    :param int seed: Random seed value.
+    :param int seed: Random seed value. Each tree is seeded from ``seed`` and its
+        index, or the index of its block when grown in blocks, so the trees don't
+        depend on ``n_jobs``.
 
     :ivar int n_features\_: The number of features (columns) from the fit input ``X``.
     :ivar list feature_names\_: Names for the features of the fit input ``X``.
+    :ivar dict categories\_: The categories of the ``category`` columns of a DataFrame
+        fit input ``X``, by column. Values outside the categories are treated as missing.
+    :ivar list missing_features\_: The indices of the features with missing values in
+        the fit input ``X``. Each of these gets a twin feature sending missing values to
+        the other child, which counts towards the default ``mtry`` of the square root
+        of the number of features. Missing values aren't supported with the
+        ``extratrees`` splitrule.
     :ivar dict ranger_forest\_: The returned result object from calling C++ ranger.
+    :ivar int inbag_seed\_: The seed from which in-bag samples are drawn when
+        ``regenerate_inbag`` is set.
     :ivar int mtry\_: The mtry value as determined if ``mtry`` is callable, otherwise
         it is the same as ``mtry``.
     :ivar list sample_fraction\_: The sample fraction determined by input validation
@@ -81,6 +146,8 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
         input validation.
     :ivar int split_rule\_: The split rule integer corresponding to ranger enum
         ``SplitRule``.
+    :ivar bool save_memory\_: Whether memory is saved growing trees, from
+        ``save_memory`` or enabled by ``memory_limit``.
     :ivar bool use_regularization_factor\_: Input validation determined bool for using
         regularization factor input parameter.
     :ivar int importance_mode\_: The importance mode integer corresponding to ranger
@@ -113,9 +180,17 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
         local_importance=False,
         regularization_factor=None,
         regularization_usedepth=False,
+        parallel_regularization=False,
         holdout=False,
         quantiles=False,
         oob_error=False,
+        early_stopping=False,
+        n_iter_no_change=5,
+        tol=1e-4,
+        on_tree_grown=None,
+        timeout=None,
+        regenerate_inbag=False,
+        memory_limit=None,
         n_jobs=-1,
         save_memory=False,
         seed=42,
@@ -142,13 +217,22 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
         self.local_importance = local_importance
         self.regularization_factor = regularization_factor
         self.regularization_usedepth = regularization_usedepth
+        self.parallel_regularization = parallel_regularization
         self.holdout = holdout
         self.quantiles = quantiles
         self.oob_error = oob_error
+        self.early_stopping = early_stopping
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.on_tree_grown = on_tree_grown
+        self.timeout = timeout
+        self.regenerate_inbag = regenerate_inbag
+        self.memory_limit = memory_limit
         self.n_jobs = n_jobs
         self.save_memory = save_memory
         self.seed = seed
 
+    @profiling.profiled("fit", set_timings=True)
     def fit(self, X, y, sample_weight=None):
         """Fit the ranger random forest using training data.
 
@@ -159,137 +243,102 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
         self.tree_type_ = 3  # tree_type, TREE_REGRESSION
 
         # Check input
-        X, y = check_X_y(X, y)
-        if sample_weight is not None:
-            sample_weight = _check_sample_weight(sample_weight, X)
+        with profiling.phase("check_input"):
+            X, y = check_X_y(self._convert_frame(X, reset=True), y, **ALLOW_NAN)
+            if sample_weight is not None:
+                sample_weight = _check_sample_weight(sample_weight, X)
 
         # Check the init parameters
-        self._validate_parameters(X, y, sample_weight)
+        with profiling.phase("validate_parameters"):
+            self._validate_parameters(X, y, sample_weight)
 
         # Set X info
-        self.feature_names_ = [str(c).encode() for c in range(X.shape[1])]
         self.n_features_ = X.shape[1]
 
         if self.always_split_features is not None:
-            always_split_features = [str(c).encode() for c in self.always_split_features]
+            always_split_features = [self._feature_name(c) for c in self.always_split_features]
         else:
             always_split_features = []
 
+        with profiling.phase("convert_input"):
+            X_ranger = np.asfortranarray(X, dtype="float64")
+            y_ranger = np.asfortranarray(np.atleast_2d(y).astype("float64").transpose())
         # Fit the forest
-        self.ranger_forest_ = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray(np.atleast_2d(y).astype("float64").transpose()),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            True,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            always_split_features,  # always_split_feature_names
-            bool(always_split_features),  # use_always_split_feature_names
-            False,  # prediction_mode
-            {},  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_feature_names
-            bool(self.categorical_features_),  # use_unordered_features
-            self.save_memory,
-            self.split_rule_,
-            sample_weight or [],  # case_weights
-            bool(sample_weight),  # use_case_weights
-            [],  # class_weights
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            self.alpha,
-            self.minprop,
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            False,  # use_regularization_factor
-            self.regularization_usedepth,
-        )
+        def grow(start, stop, seed, regularization_factor, num_threads):
+            inbag = self._get_manual_inbag(start, stop, X.shape[0])
+            return ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                y_ranger,
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                stop - start,  # num_trees
+                self.verbose,
+                seed,
+                num_threads,
+                True,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                always_split_features,  # always_split_feature_names
+                bool(always_split_features),  # use_always_split_feature_names
+                False,  # prediction_mode
+                {},  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_feature_names
+                bool(self.categorical_features_),  # use_unordered_features
+                self.save_memory_,
+                self.split_rule_,
+                sample_weight if sample_weight is not None else [],  # case_weights
+                sample_weight is not None,  # use_case_weights
+                [],  # class_weights
+                False,  # predict_all
+                self.keep_inbag or self._tracks_oob(),
+                self.sample_fraction_,
+                self.alpha,
+                self.minprop,
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error or self.early_stopping,
+                self.max_depth,
+                inbag,
+                len(inbag) > 0,  # use_inbag
+                regularization_factor,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
+
+        with profiling.phase("ranger"):
+            self.ranger_forest_ = self._grow_forest(grow, y_ranger)
 
         if self.quantiles:
-            forest = self._get_terminal_node_forest(X)
-            terminal_nodes = np.array(forest["predictions"]).astype(int)
-            self.random_node_values_ = np.empty((np.max(terminal_nodes) + 1, self.n_estimators))
-            self.random_node_values_[:] = np.nan
-            for tree in range(self.n_estimators):
-                idx = np.arange(X.shape[0])
-                np.random.shuffle(idx)
-                self.random_node_values_[terminal_nodes[idx, tree], tree] = y[idx]
+            with profiling.phase("quantiles"):
+                terminal_nodes = self._get_terminal_nodes(X)
+                n_trees = self.ranger_forest_["forest"]["num_trees"]
+                self.random_node_values_ = np.empty((np.max(terminal_nodes) + 1, n_trees))
+                self.random_node_values_[:] = np.nan
+                random_state = np.random.RandomState(self.seed or None)
+                for tree in range(n_trees):
+                    idx = np.arange(X.shape[0])
+                    random_state.shuffle(idx)
+                    self.random_node_values_[terminal_nodes[idx, tree], tree] = y[idx]
 
         return self
 
-    def _get_terminal_node_forest(self, X):
-        """Get a terminal node forest for X.
+    def _oob_prediction_error(self, predictions, y):
+        """Mean squared error of out of bag predictions.
 
-        :param array2d X: prediction input features
+        :param array2d predictions: out of bag predictions
+        :param array2d y: the training target passed to ranger
         """
-        # many fields defaulted here which are unused
-        forest = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray([[]]),
-            self.feature_names_,  # variable_names
-            0,  # m_try
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            False,  # write_forest
-            0,  # importance_mode
-            0,  # min_node_size
-            [],  # split_select_weights
-            False,  # use_split_select_weights
-            [],  # always_split_feature_names
-            False,  # use_always_split_feature_names
-            True,  # prediction_mode
-            self.ranger_forest_["forest"],  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            True,  # sample_with_replacement
-            False,  # probability
-            [],  # unordered_feature_names
-            False,  # use_unordered_features
-            False,  # save_memory
-            1,  # split_rule
-            [],  # case_weights
-            False,  # use_case_weights
-            [],  # class_weights
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            0,  # alpha
-            0,  # minprop
-            self.holdout,
-            2,  # prediction_type (terminal nodes)
-            1,  # num_random_splits
-            False,  # use_sparse_data
-            False,  # order_snps_
-            False,  # oob_error
-            0,  # max_depth
-            [],  # inbag
-            False,  # use_inbag
-            [],  # regularization_factor_
-            False,  # use_regularization_factor_
-            False,  # regularization_usedepth
-        )
-        return forest
+        return np.mean((predictions[:, 0] - y[:, 0]) ** 2)
 
     def predict_quantiles(self, X, quantiles=None):
         """Predict quantile regression target for X.
@@ -304,71 +353,135 @@ class RangerForestRegressor(RangerValidationMixin, RegressorMixin, BaseEstimator
             raise ValueError("Must set quantiles = True for quantile predictions.")
         quantiles = quantiles or [0.1, 0.5, 0.9]
         check_is_fitted(self)
-        X = check_array(X)
-
-        forest = self._get_terminal_node_forest(X)
-        terminal_nodes = np.array(forest["predictions"]).astype(int)
-        node_values = 0.0 * terminal_nodes
-        for tree in range(self.n_estimators):
-            node_values[:, tree] = self.random_node_values_[terminal_nodes[:, tree], tree]
-        quantile_predictions = np.nanquantile(node_values, quantiles, axis=1)
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        terminal_nodes = self._get_terminal_nodes(X)
+        quantile_predictions = np.nanquantile(self._quantile_node_values(terminal_nodes), quantiles, axis=1)
         if len(quantiles) == 1:
             return np.squeeze(quantile_predictions)
         return quantile_predictions
 
-    def predict(self, X):
+    @profiling.profiled("predict_distribution")
+    def predict_distribution(self, X, quantiles=None, return_mean=True, return_variance=False):
+        """Predict the mean, quantiles and variance of the target for X.
+
+        The terminal nodes of X are computed once and used for all outputs, rather
+        than traversing the forest for each of ``predict`` and ``predict_quantiles``.
+
+        :param array2d X: prediction input features
+        :param list(float) quantiles: a list of quantiles on which to predict. Default
+            is ``[0.1, 0.5, 0.9]``.
+        :param bool return_mean: Whether to return the mean prediction, identical to
+            ``predict``.
+        :param bool return_variance: Whether to return the variance of the quantile
+            regression distribution.
+        :return: a dict with the 2darray ``quantiles``, shaped like the output of
+            ``predict_quantiles`` for multiple quantiles, and optionally the 1darrays
+            ``mean`` and ``variance``.
+        """
+        if not hasattr(self, "random_node_values_"):
+            raise ValueError("Must set quantiles = True for quantile predictions.")
+        quantiles = quantiles or [0.1, 0.5, 0.9]
+        check_is_fitted(self)
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        terminal_nodes = self._get_terminal_nodes(X)
+        node_values = self._quantile_node_values(terminal_nodes)
+        distribution = {"quantiles": np.nanquantile(node_values, quantiles, axis=1)}
+        if return_mean:
+            distribution["mean"] = _mean_over_trees(self._tree_predictions(terminal_nodes))
+        if return_variance:
+            distribution["variance"] = np.nanvar(node_values, axis=1)
+        return distribution
+
+    def _tree_predictions(self, terminal_nodes):
+        """Get the prediction of each tree, the value of the terminal node of each sample.
+
+        :param array2d terminal_nodes: terminal node ids of shape ``(n_samples, n_trees)``
+        """
+        split_values = self.ranger_forest_["forest"]["split_values"]
+        predictions = np.empty(terminal_nodes.shape)
+        for tree in range(terminal_nodes.shape[1]):
+            predictions[:, tree] = np.asarray(split_values[tree])[terminal_nodes[:, tree]]
+        return predictions
+
+    def _quantile_node_values(self, terminal_nodes):
+        """Get the sampled target value of each terminal node, per sample and tree.
+
+        :param array2d terminal_nodes: terminal node ids of shape ``(n_samples, n_trees)``
+        """
+        return self.random_node_values_[terminal_nodes, np.arange(terminal_nodes.shape[1])]
+
+    @profiling.profiled("predict")
+    def predict(self, X, return_std=False):
         """Predict regression target for X.
 
         :param array2d X: prediction input features
+        :param bool return_std: If True, also return the standard errors of the
+            predictions, estimated with the bias corrected infinitesimal jackknife.
+            Requires ``keep_inbag=True``.
+        :return: the predictions, or a tuple of predictions and standard errors if
+            ``return_std`` is True.
         """
         check_is_fitted(self)
-        X = check_array(X)
-
-        result = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray([[]]),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            False,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            [],  # always_split_feature_names
-            False,  # use_always_split_feature_names
-            True,  # prediction_mode
-            self.ranger_forest_["forest"],  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_feature_names
-            bool(self.categorical_features_),  # use_unordered_features
-            self.save_memory,
-            self.split_rule_,
-            [],  # case_weights
-            False,  # use_case_weights
-            [],  # class_weights
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            self.alpha,
-            self.minprop,
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            self.use_regularization_factor_,
-            self.regularization_usedepth,
-        )
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        if return_std:
+            tree_predictions = self._tree_predictions(self._get_terminal_nodes(X))
+            return _mean_over_trees(tree_predictions), self._jackknife_std(tree_predictions)
+
+        with profiling.phase("convert_input"):
+            X_ranger = np.asarray(X, dtype="float64")
+        with profiling.phase("ranger"):
+            result = ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                np.asfortranarray([[]]),
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                self.ranger_forest_["forest"]["num_trees"],  # num_trees
+                self.verbose,
+                self.seed,
+                self._prediction_threads(X_ranger),  # num_threads
+                False,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                [],  # always_split_feature_names
+                False,  # use_always_split_feature_names
+                True,  # prediction_mode
+                self.ranger_forest_["forest"],  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_feature_names
+                bool(self.categorical_features_),  # use_unordered_features
+                self.save_memory,
+                self.split_rule_,
+                [],  # case_weights
+                False,  # use_case_weights
+                [],  # class_weights
+                False,  # predict_all
+                self.keep_inbag,
+                self.sample_fraction_,
+                self.alpha,
+                self.minprop,
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error,
+                self.max_depth,
+                self.inbag or [],
+                bool(self.inbag),  # use_inbag
+                self.regularization_factor_,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
         return np.array(result["predictions"])
@@ -1,15 +1,47 @@
 """Scikit-learn wrapper for ranger survival."""
 import numpy as np
+from scipy import sparse
 from sklearn.base import BaseEstimator
 from sklearn.utils.validation import _check_sample_weight
 from sklearn.utils.validation import check_array
 from sklearn.utils.validation import check_is_fitted
 
+from skranger import profiling
 from skranger.ensemble import ranger
+from skranger.ensemble.base import ALLOW_NAN
+from skranger.ensemble.base import RangerApplyMixin
+from skranger.ensemble.base import RangerArrowMixin
+from skranger.ensemble.base import RangerAsyncMixin
+from skranger.ensemble.base import RangerGrowMixin
 from skranger.ensemble.base import RangerValidationMixin
 
 
-class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
+def _concordance_index(time, status, risk, chunk_size=1024):
+    """Harrell's concordance index of risk scores.
+
+    Pairs are comparable when the sample with the shorter time had an event, and are
+    concordant when that sample has the higher risk. Ties in risk count one half.
+
+    :param array1d time: the survival times
+    :param array1d status: the event indicators
+    :param array1d risk: the predicted risk scores
+    :param int chunk_size: the number of events compared at once
+    """
+    events = np.flatnonzero(status)
+    concordant = 0.0
+    comparable = 0
+    for start in range(0, len(events), chunk_size):
+        idx = events[start : start + chunk_size]
+        later = time[None, :] > time[idx, None]
+        concordant += np.sum(later & (risk[None, :] < risk[idx, None]))
+        concordant += 0.5 * np.sum(later & (risk[None, :] == risk[idx, None]))
+        comparable += np.sum(later)
+    return concordant / comparable if comparable else 0.5
+
+
+class RangerForestSurvival(
+    RangerValidationMixin, RangerGrowMixin, RangerApplyMixin, RangerArrowMixin, RangerAsyncMixin, BaseEstimator,
+):
     r"""Ranger Random Forest Survival implementation for sci-kit survival.
 
     Provides a sksurv interface to the Ranger C++ library using Cython. The
@@ -32,7 +64,13 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         class specific values.
     :param bool keep_inbag: If true, save how often observations are in-bag in each
         tree. These will be stored in the ``ranger_forest_`` attribute under the key
-        ``"inbag_counts"``.
+        ``"inbag_counts"``, as an array of shape ``(n_estimators, n_samples)`` of the
+        smallest unsigned integer type holding the counts. Counts of at most one, as
+        when sampling without replacement, are bit-packed under ``"inbag_bits"``.
+    :param bool regenerate_inbag: If true, in-bag samples are drawn by skranger from
+        a seed per tree and passed to ranger, so that with ``keep_inbag`` the in-bag
+        counts can be drawn again when needed rather than stored. Cannot be used with
+        ``inbag``, ``sample_weight`` or class-wise ``sample_fraction``.
     :param list inbag: A list of size ``n_estimators``, containing inbag counts for each
         observation. Can be used for stratified sampling.
     :param str split_rule: One of ``logrank``, ``extratrees``, ``C``, or ``maxstat``,
@@ -45,12 +83,13 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
     :param list split_select_weights: Vector of weights between 0 and 1 of probabilities
         to select features for splitting.
     :param list always_split_features:  Features which should always be selected for
-        splitting. A list of column index values.
-    :param list categorical_features: A list of column index values which should be
-        considered categorical, or unordered.
+        splitting. A list of column index values or DataFrame column names.
+    :param list categorical_features: A list of column index values or DataFrame column
+        names which should be considered categorical, or unordered. Columns of
+        ``category`` dtype are considered categorical automatically.
     :param str respect_categorical_features: One of ``ignore``, ``order``, ``partition``.
-        The default is ``partition`` for the ``extratrees`` splitrule, otherwise the
-        default is ``ignore``.
+        The default is ``partition`` for the ``extratrees`` splitrule or when ``X`` has
+        columns of ``category`` dtype, otherwise the default is ``ignore``.
     :param bool scale_permutation_importance: For ``permutation`` importance,
         scale permutation importance by standard error as in (Breiman 2001).
     :param bool local_importance: For ``permutation`` importance, calculate and
@@ -58,15 +97,68 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
     :param list regularization_factor: A vector of regularization factors for the
         features.
     :param bool regularization_usedepth: Whether to consider depth in regularization.
+    :param bool parallel_regularization: Grow regularized forests with ``n_jobs``
+        threads. Each tree doesn't penalize the features used by the earlier trees,
+        except by the ``n_jobs - 1`` trees grown concurrently before it, so the forest
+        differs from the one grown by a single thread. By default regularized forests
+        are grown by a single thread.
     :param bool holdout: Hold-out all samples with case weight 0 and use these for
         feature importance and prediction error.
     :param bool oob_error: Whether to calculate out-of-bag prediction error.
-    :param int n_jobs: The number of threads. Default is number of CPU cores.
-    :param int seed: Random seed value.
+    :param int/list time_grid: Coarsen the event times onto a grid before fitting.
+        When an int is passed, the grid consists of that many quantiles of the
+        observed event times. When a list is passed, it is used as the grid. Each
+        time is moved up to the nearest grid point, and times after the last grid
+        point are assigned to the last grid point. This bounds the size of the
+        stored cumulative hazard functions by the grid size rather than by the
+        number of unique event times.
+    :param bool sparse_chf: Store each terminal node's cumulative hazard function as
+        the increments at the event times where it changes, rather than as a dense
+        vector over all event times. Predictions aggregate the increments of the
+        terminal nodes directly, which reduces model size and prediction memory when
+        there are many unique event times.
+    :param callable on_tree_grown: A function called with ``(i, elapsed)`` for each
+        grown tree ``i``, where ``elapsed`` is the number of seconds since training
+        started. Returning ``True`` cancels training, keeping the trees grown so far.
+        When set, trees are grown in blocks of 16 trees, ``n_jobs`` blocks at a time,
+        the callback is invoked for the trees of each block once it is grown, in
+        order, and training is cancelled between blocks. Variable importances are
+        averaged over the blocks.
+    :param float timeout: The number of seconds after which training stops, keeping
+        the trees grown so far. Training stops before a block of trees which is
+        expected to exceed the timeout. Trees are grown in blocks as for
+        ``on_tree_grown``.
+    :param bool early_stopping: Grow trees in blocks as for ``on_tree_grown`` and
+        stop once the out-of-bag error of the forest converges, checked after every
+        block. Out-of-bag predictions are accumulated over the blocks, so the error is
+        tracked without predicting again. When stopped early, the forest has fewer
+        than ``n_estimators`` trees.
+    :param int n_iter_no_change: The number of blocks of 16 trees without improvement
+        of the out-of-bag error after which training stops, for ``early_stopping``.
+    :param float tol: The minimal improvement of the out-of-bag error, for
+        ``early_stopping``.
+    :param int memory_limit: The number of bytes fitting may use, checked against an
+        estimate of the peak memory before training starts, see
+        ``skranger.memory.estimate_memory``. If the estimate exceeds the limit,
+        fitting raises a ``ValueError``.
+    :param int n_jobs: The number of threads. Default is the number of threads set by
+        ``skranger.set_num_threads``, the number of CPU cores unless set.
+    :param int seed: Random seed value. Each tree is seeded from ``seed`` and its
+        index, or the index of its block when grown in blocks, so the trees don't
+        depend on ``n_jobs``.
 
     :ivar int n_features\_: The number of features (columns) from the fit input ``X``.
     :ivar list feature_names\_: Names for the features of the fit input ``X``.
+    :ivar dict categories\_: The categories of the ``category`` columns of a DataFrame
+        fit input ``X``, by column. Values outside the categories are treated as missing.
+    :ivar list missing_features\_: The indices of the features with missing values in
+        the fit input ``X``. Each of these gets a twin feature sending missing values to
+        the other child, which counts towards the default ``mtry`` of the square root
+        of the number of features. Missing values aren't supported with the
+        ``extratrees`` splitrule.
     :ivar dict ranger_forest\_: The returned result object from calling C++ ranger.
+    :ivar int inbag_seed\_: The seed from which in-bag samples are drawn when
+        ``regenerate_inbag`` is set.
     :ivar int mtry\_: The mtry value as determined if ``mtry`` is callable, otherwise
         it is the same as ``mtry``.
     :ivar list sample_fraction\_: The sample fraction determined by input validation
@@ -80,6 +172,8 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         regularization factor input parameter.
     :ivar int importance_mode\_: The importance mode integer corresponding to ranger
         enum ``ImportanceMode``.
+    :ivar 1darray time_grid\_: The time grid determined from ``time_grid``, or ``None``
+        if event times were not coarsened.
     """
 
     def __init__(
@@ -106,8 +200,18 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         local_importance=False,
         regularization_factor=None,
         regularization_usedepth=False,
+        parallel_regularization=False,
         holdout=False,
         oob_error=False,
+        time_grid=None,
+        sparse_chf=False,
+        early_stopping=False,
+        n_iter_no_change=5,
+        tol=1e-4,
+        on_tree_grown=None,
+        timeout=None,
+        regenerate_inbag=False,
+        memory_limit=None,
         n_jobs=0,
         seed=42,
     ):
@@ -133,11 +237,22 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         self.local_importance = local_importance
         self.regularization_factor = regularization_factor
         self.regularization_usedepth = regularization_usedepth
+        self.parallel_regularization = parallel_regularization
         self.holdout = holdout
         self.oob_error = oob_error
+        self.time_grid = time_grid
+        self.sparse_chf = sparse_chf
+        self.early_stopping = early_stopping
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.on_tree_grown = on_tree_grown
+        self.timeout = timeout
+        self.regenerate_inbag = regenerate_inbag
+        self.memory_limit = memory_limit
         self.n_jobs = n_jobs
         self.seed = seed
 
+    @profiling.profiled("fit", set_timings=True)
     def fit(self, X, y, sample_weight=None):
         """Fit the ranger random forest using training data.
 
@@ -148,140 +263,255 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         """
         self.tree_type_ = 5  # tree_type, TREE_SURVIVAL
         # Check input
-        X = check_array(X)
-        # convert 1d array of 2tuples to 2d array
-        # ranger expects the time first, and status second
-        # since we follow the scikit-survival convention, we fliplr
-        y = np.fliplr(np.array(y.tolist()))
+        with profiling.phase("check_input"):
+            X = check_array(self._convert_frame(X, reset=True), **ALLOW_NAN)
+            # convert 1d array of 2tuples to 2d array
+            # ranger expects the time first, and status second
+            # since we follow the scikit-survival convention, we fliplr
+            y = np.fliplr(np.array(y.tolist()))
 
-        if sample_weight is not None:
-            sample_weight = _check_sample_weight(sample_weight, X)
+            if sample_weight is not None:
+                sample_weight = _check_sample_weight(sample_weight, X)
 
         # Check the init parameters
-        self._validate_parameters(X, y, sample_weight)
+        with profiling.phase("validate_parameters"):
+            self._validate_parameters(X, y, sample_weight)
+        y = self._bin_event_times(y)
 
         # Set X info
-        self.feature_names_ = [str(c).encode() for c in range(X.shape[1])]
         self.n_features_ = X.shape[1]
 
         if self.always_split_features is not None:
-            always_split_features = [str(c).encode() for c in self.always_split_features]
+            always_split_features = [self._feature_name(c) for c in self.always_split_features]
         else:
             always_split_features = []
 
+        with profiling.phase("convert_input"):
+            X_ranger = np.asfortranarray(X, dtype="float64")
+            y_ranger = np.asfortranarray(y.astype("float64"))
         # Fit the forest
-        self.ranger_forest_ = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray(y.astype("float64")),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            True,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            always_split_features,  # always_split_variable_names
-            bool(always_split_features),  # use_always_split_variable_names
-            False,  # prediction_mode
-            {},  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_feature_names
-            bool(self.categorical_features_),  # use_unordered_features
-            False,  # save_memory
-            self.split_rule_,
-            sample_weight or [],  # case_weights
-            bool(sample_weight),  # use_case_weights
-            [],  # class_weights
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            self.alpha,
-            self.minprop,
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            False,  # use_regularization_factor
-            self.regularization_usedepth,
-        )
+        def grow(start, stop, seed, regularization_factor, num_threads):
+            inbag = self._get_manual_inbag(start, stop, X.shape[0])
+            return ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                y_ranger,
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                stop - start,  # num_trees
+                self.verbose,
+                seed,
+                num_threads,
+                True,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                always_split_features,  # always_split_variable_names
+                bool(always_split_features),  # use_always_split_variable_names
+                False,  # prediction_mode
+                {},  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_feature_names
+                bool(self.categorical_features_),  # use_unordered_features
+                False,  # save_memory
+                self.split_rule_,
+                sample_weight if sample_weight is not None else [],  # case_weights
+                sample_weight is not None,  # use_case_weights
+                [],  # class_weights
+                False,  # predict_all
+                self.keep_inbag or self._tracks_oob(),
+                self.sample_fraction_,
+                self.alpha,
+                self.minprop,
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error or self.early_stopping,
+                self.max_depth,
+                inbag,
+                len(inbag) > 0,  # use_inbag
+                regularization_factor,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
+
+        with profiling.phase("ranger"):
+            self.ranger_forest_ = self._grow_forest(grow, y_ranger)
         self.event_times_ = np.array(self.ranger_forest_["forest"]["unique_death_times"])
-        self.cumulative_hazard_function_ = np.array(self.ranger_forest_["forest"]["cumulative_hazard_function"])
+        if self.sparse_chf:
+            with profiling.phase("compress"):
+                self._compress_chf()
+        else:
+            self.cumulative_hazard_function_ = np.array(self.ranger_forest_["forest"]["cumulative_hazard_function"])
         return self
 
-    def _predict(self, X):
+    def _oob_prediction_error(self, predictions, y):
+        """One minus Harrell's concordance index of out of bag risk scores.
+
+        :param array2d predictions: out of bag cumulative hazard functions
+        :param array2d y: the training target passed to ranger
+        """
+        return 1 - _concordance_index(y[:, 0], y[:, 1], predictions.sum(axis=1))
+
+    def _compress_chf(self):
+        """Replace the dense terminal node CHFs with their step changes.
+
+        The forest's ``cumulative_hazard_function`` is replaced by ``chf_steps``, a
+        sparse matrix with one row per node of every tree and one column per event
+        time, holding the increase of the node's CHF at each event time. Rows of tree
+        ``i`` start at ``node_offsets[i]``.
+        """
+        forest = self.ranger_forest_["forest"]
+        chf = forest.pop("cumulative_hazard_function")
+        n_times = len(self.event_times_)
+        node_offsets = np.cumsum([0] + [len(tree) for tree in chf])
+
+        rows, cols, values = [np.empty(0, dtype=int)], [np.empty(0, dtype=int)], [np.empty(0)]
+        for tree_idx, tree in enumerate(chf):
+            terminal_nodes = np.array([node for node, node_chf in enumerate(tree) if len(node_chf) > 0], dtype=int)
+            if len(terminal_nodes) == 0:
+                continue
+            steps = np.diff(np.array([tree[node] for node in terminal_nodes]), axis=1, prepend=0.0)
+            step_rows, step_cols = np.nonzero(steps)
+            rows.append(node_offsets[tree_idx] + terminal_nodes[step_rows])
+            cols.append(step_cols)
+            values.append(steps[step_rows, step_cols])
+
+        forest["chf_steps"] = sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(node_offsets[-1], n_times),
+        )
+        forest["node_offsets"] = node_offsets[:-1]
+
+    def _predict_sparse_chf(self, X):
+        """Predict the cumulative hazard function from the sparse step encoding.
+
+        Each sample selects one terminal node per tree. The selected rows of the step
+        matrix are summed with a single sparse product, and the cumulative sum over
+        event times gives the forest CHF.
+
+        :param array2d X: prediction input features
+        """
         check_is_fitted(self)
-        X = check_array(X)
-
-        result = ranger.ranger(
-            self.tree_type_,
-            np.asfortranarray(X.astype("float64")),
-            np.asfortranarray([[]]),
-            self.feature_names_,  # variable_names
-            self.mtry_,
-            self.n_estimators,  # num_trees
-            self.verbose,
-            self.seed,
-            self.n_jobs_,  # num_threads
-            False,  # write_forest
-            self.importance_mode_,
-            self.min_node_size,
-            self.split_select_weights or [],
-            bool(self.split_select_weights),  # use_split_select_weights
-            [],  # always_split_variable_names
-            False,  # use_always_split_variable_names
-            True,  # prediction_mode
-            self.ranger_forest_["forest"],  # loaded_forest
-            np.asfortranarray([[]]),  # snp_data
-            self.replace,  # sample_with_replacement
-            False,  # probability
-            self.categorical_features_,  # unordered_feature_names
-            bool(self.categorical_features_),  # use_unordered_features
-            False,  # save_memory
-            self.split_rule_,
-            [],  # case_weights
-            False,  # use_case_weights
-            [],  # class_weights
-            False,  # predict_all
-            self.keep_inbag,
-            self.sample_fraction_,
-            self.alpha,
-            self.minprop,
-            self.holdout,
-            1,  # prediction_type
-            self.num_random_splits,
-            False,  # use_sparse_data
-            self.order_snps_,
-            self.oob_error,
-            self.max_depth,
-            self.inbag or [],
-            bool(self.inbag),  # use_inbag
-            self.regularization_factor_,
-            self.use_regularization_factor_,
-            self.regularization_usedepth,
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        forest = self.ranger_forest_["forest"]
+        terminal_nodes = self._get_terminal_nodes(X)
+        n_samples, n_trees = terminal_nodes.shape
+        selection = sparse.csr_matrix(
+            (
+                np.ones(n_samples * n_trees),
+                (terminal_nodes + forest["node_offsets"]).ravel(),
+                np.arange(0, n_samples * n_trees + 1, n_trees),
+            ),
+            shape=(n_samples, forest["chf_steps"].shape[0]),
         )
+        steps = (selection @ forest["chf_steps"]).toarray()
+        return np.cumsum(steps, axis=1) / n_trees
+
+    def _bin_event_times(self, y):
+        """Move the times of ``y`` onto the grid determined by ``time_grid``.
+
+        :param array2d y: training targets, rows of (time, status)
+        """
+        if self.time_grid is None:
+            self.time_grid_ = None
+            return y
+
+        if np.isscalar(self.time_grid):
+            if self.time_grid < 1:
+                raise ValueError("time_grid must be a positive number of time points")
+            event_times = np.unique(y[y[:, 1] > 0, 0])
+            if len(event_times) == 0:
+                event_times = np.unique(y[:, 0])
+            # upper bin edges, so that the last grid point is the last event time
+            quantiles = np.linspace(0, 1, int(self.time_grid) + 1)[1:]
+            self.time_grid_ = np.unique(np.quantile(event_times, quantiles))
+        else:
+            self.time_grid_ = np.unique(np.asarray(self.time_grid, dtype="float64"))
+            if len(self.time_grid_) == 0:
+                raise ValueError("time_grid must contain at least one time point")
+
+        idx = np.searchsorted(self.time_grid_, y[:, 0], side="left")
+        idx = np.minimum(idx, len(self.time_grid_) - 1)
+        return np.column_stack((self.time_grid_[idx], y[:, 1]))
+
+    def _predict(self, X):
+        check_is_fitted(self)
+        with profiling.phase("check_input"):
+            X = self._check_input(X)
+
+        with profiling.phase("convert_input"):
+            X_ranger = np.asarray(X, dtype="float64")
+        with profiling.phase("ranger"):
+            result = ranger.ranger(
+                self.tree_type_,
+                X_ranger,
+                np.asfortranarray([[]]),
+                self.feature_names_,  # variable_names
+                self.mtry_,
+                self.ranger_forest_["forest"]["num_trees"],  # num_trees
+                self.verbose,
+                self.seed,
+                self._prediction_threads(X_ranger),  # num_threads
+                False,  # write_forest
+                self.importance_mode_,
+                self.min_node_size,
+                self.split_select_weights or [],
+                bool(self.split_select_weights),  # use_split_select_weights
+                [],  # always_split_variable_names
+                False,  # use_always_split_variable_names
+                True,  # prediction_mode
+                self.ranger_forest_["forest"],  # loaded_forest
+                np.asfortranarray([[]]),  # snp_data
+                self.replace,  # sample_with_replacement
+                False,  # probability
+                self.categorical_features_,  # unordered_feature_names
+                bool(self.categorical_features_),  # use_unordered_features
+                False,  # save_memory
+                self.split_rule_,
+                [],  # case_weights
+                False,  # use_case_weights
+                [],  # class_weights
+                False,  # predict_all
+                self.keep_inbag,
+                self.sample_fraction_,
+                self.alpha,
+                self.minprop,
+                self.holdout,
+                1,  # prediction_type
+                self.num_random_splits,
+                False,  # use_sparse_data
+                self.order_snps_,
+                self.oob_error,
+                self.max_depth,
+                self.inbag or [],
+                bool(self.inbag),  # use_inbag
+                self.regularization_factor_,
+                self.use_regularization_factor_,
+                self.regularization_usedepth,
+                self.missing_features_,
+            )
         return result
 
+    @profiling.profiled("predict_cumulative_hazard_function")
     def predict_cumulative_hazard_function(self, X):
         """Predict cumulative hazard function.
 
         :param array2d X: prediction input features
         """
+        if self.sparse_chf:
+            return self._predict_sparse_chf(X)
         result = self._predict(X)
         return np.atleast_2d(result["predictions"])
 
+    @profiling.profiled("predict_survival_function")
     def predict_survival_function(self, X):
         """Predict survival function.
 
@@ -290,6 +520,14 @@ class RangerForestSurvival(RangerValidationMixin, BaseEstimator):
         chf = self.predict_cumulative_hazard_function(X)
         return np.exp(-chf)
 
+    async def apredict_survival_function(self, X):
+        """Predict survival function without blocking the event loop.
+
+        :param array2d X: prediction input features
+        """
+        return await self._submit_batched("predict_survival_function", X)
+
+    @profiling.profiled("predict")
     def predict(self, X):
         """Predict risk score.
 
@@ -0,0 +1,186 @@
+"""Export of fitted forests to ONNX.
+
+Forests are converted into ``ai.onnx.ml`` ``TreeEnsembleClassifier`` and
+``TreeEnsembleRegressor`` graphs, which can be scored by ONNX runtimes without
+installing skranger::
+
+    from skranger.export import to_onnx
+
+    model = to_onnx(rfc, "model.onnx")
+
+The graph takes a single double tensor input ``X``, the numeric array passed to
+ranger. Classifiers output ``label`` and ``probabilities``, regressors output
+``variable`` and survival forests output ``risk``, the sum of the cumulative hazard
+function over event times returned by ``predict``. Outputs are float, as required by
+the ONNX operators. Requires the ``onnx`` package.
+"""
+import os
+
+import numpy as np
+from sklearn.utils.validation import check_is_fitted
+
+from skranger import codegen
+
+ML_OPSET = 3
+
+
+def _leaf_values(estimator):
+    """Get a function returning the values of a terminal node, in output order.
+
+    :param estimator: a fitted ranger estimator
+    """
+    if estimator.tree_type_ != 5:
+        return codegen._leaf_values(estimator)
+    forest = estimator.ranger_forest_["forest"]
+    if "chf_steps" in forest:
+        steps = forest["chf_steps"].tocsr()
+        # the sum of the cumulative sum of steps over event times
+        weights = np.arange(steps.shape[1], 0, -1)
+        return lambda tree_idx, node: [steps[forest["node_offsets"][tree_idx] + node].toarray().ravel() @ weights]
+    return lambda tree_idx, node: [np.sum(forest["cumulative_hazard_function"][tree_idx][node])]
+
+
+def _tree_attributes(estimator, leaf_prefix, leaf_scale):
+    """Get the node and leaf attributes of a tree ensemble operator.
+
+    :param estimator: a fitted ranger estimator
+    :param str leaf_prefix: ``class`` or ``target``, the prefix of leaf attributes
+    :param float leaf_scale: a factor applied to leaf values
+    """
+    from onnx import TensorProto
+    from onnx import helper
+
+    forest = estimator.ranger_forest_["forest"]
+    leaf_values = _leaf_values(estimator)
+    n_features = estimator.n_features_
+    nodes = {
+        "treeids": [],
+        "nodeids": [],
+        "featureids": [],
+        "modes": [],
+        "values": [],
+        "truenodeids": [],
+        "falsenodeids": [],
+        "missing_value_tracks_true": [],
+    }
+    leaves = {"treeids": [], "nodeids": [], "ids": [], "weights": []}
+    for tree_idx, (children, var_ids, values) in enumerate(
+        zip(forest["child_node_ids"], forest["split_var_ids"], forest["split_values"])
+    ):
+        for node, (left, right) in enumerate(zip(*children)):
+            nodes["treeids"].append(tree_idx)
+            nodes["nodeids"].append(node)
+            nodes["truenodeids"].append(left)
+            nodes["falsenodeids"].append(right)
+            if left == 0 and right == 0:
+                nodes["featureids"].append(0)
+                nodes["modes"].append("LEAF")
+                nodes["values"].append(0.0)
+                nodes["missing_value_tracks_true"].append(0)
+                for output, value in enumerate(leaf_values(tree_idx, node)):
+                    leaves["treeids"].append(tree_idx)
+                    leaves["nodeids"].append(node)
+                    leaves["ids"].append(output)
+                    leaves["weights"].append(value * leaf_scale)
+                continue
+            var = var_ids[node]
+            if not forest["is_ordered"][var]:
+                raise ValueError("Forests with unordered categorical splits can't be exported to ONNX")
+            # missing values go left, except on the twin features, see DataNumpy.h
+            is_twin = var >= n_features
+            nodes["featureids"].append(estimator.missing_features_[var - n_features] if is_twin else var)
+            nodes["modes"].append("BRANCH_LEQ")
+            nodes["values"].append(values[node])
+            nodes["missing_value_tracks_true"].append(0 if is_twin else 1)
+
+    attributes = {}
+    for key, value in nodes.items():
+        if key == "values":
+            attributes["nodes_values_as_tensor"] = helper.make_tensor(
+                "nodes_values_as_tensor", TensorProto.DOUBLE, [len(value)], value
+            )
+        else:
+            attributes["nodes_" + key] = value
+    for key, value in leaves.items():
+        if key == "weights":
+            name = leaf_prefix + "_weights_as_tensor"
+            attributes[name] = helper.make_tensor(name, TensorProto.DOUBLE, [len(value)], value)
+        else:
+            attributes[leaf_prefix + "_" + key] = value
+    return attributes
+
+
+def to_onnx(estimator, path=None):
+    """Convert a fitted forest to an ONNX model.
+
+    :param estimator: a fitted RangerForestClassifier, RangerForestRegressor or
+        RangerForestSurvival
+    :param str path: If set, the path the model is saved to.
+    :return: the ``onnx.ModelProto``
+    """
+    import onnx
+    from onnx import TensorProto
+    from onnx import helper
+
+    check_is_fitted(estimator)
+    n_trees = estimator.ranger_forest_["forest"]["num_trees"]
+    inputs = [helper.make_tensor_value_info("X", TensorProto.DOUBLE, [None, estimator.n_features_])]
+
+    if estimator.tree_type_ == 9:
+        classes = estimator.classes_
+        if np.issubdtype(classes.dtype, np.integer):
+            labels = {"classlabels_int64s": classes.tolist()}
+            label_tensor = helper.make_tensor("classes", TensorProto.INT64, [len(classes)], classes.tolist())
+        else:
+            labels = {"classlabels_strings": [str(c) for c in classes]}
+            label_tensor = helper.make_tensor(
+                "classes", TensorProto.STRING, [len(classes)], [str(c).encode() for c in classes]
+            )
+        # the classifier sums leaf weights, so they are averaged over trees here
+        nodes = [
+            helper.make_node(
+                "TreeEnsembleClassifier",
+                ["X"],
+                ["tree_label", "probabilities"],
+                domain="ai.onnx.ml",
+                post_transform="NONE",
+                **labels,
+                **_tree_attributes(estimator, "class", 1 / n_trees),
+            ),
+            # runtimes special case the labels of binary classifiers, so the label is
+            # taken as the first most probable class like predict does
+            helper.make_node("Constant", [], ["classes"], value=label_tensor),
+            helper.make_node("ArgMax", ["probabilities"], ["class_index"], axis=1, keepdims=0),
+            helper.make_node("Gather", ["classes", "class_index"], ["label"]),
+        ]
+        outputs = [
+            helper.make_tensor_value_info("label", label_tensor.data_type, [None]),
+            helper.make_tensor_value_info("probabilities", TensorProto.FLOAT, [None, len(classes)]),
+        ]
+    else:
+        output = "risk" if estimator.tree_type_ == 5 else "variable"
+        nodes = [
+            helper.make_node(
+                "TreeEnsembleRegressor",
+                ["X"],
+                [output],
+                domain="ai.onnx.ml",
+                n_targets=1,
+                aggregate_function="AVERAGE",
+                post_transform="NONE",
+                **_tree_attributes(estimator, "target", 1.0),
+            )
+        ]
+        outputs = [helper.make_tensor_value_info(output, TensorProto.FLOAT, [None, 1])]
+
+    graph = helper.make_graph(nodes, type(estimator).__name__, inputs, outputs)
+    model = helper.make_model(
+        graph,
+        opset_imports=[helper.make_opsetid("", 13), helper.make_opsetid("ai.onnx.ml", ML_OPSET)],
+        producer_name="skranger",
+    )
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    if path is not None:
+        onnx.save(model, os.fspath(path))
+    return model
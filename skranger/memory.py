@@ -0,0 +1,143 @@
+"""Estimation of the peak memory of fitting forests.
+
+Fitting a large forest can run out of memory long after training started. The peak
+memory can be estimated beforehand from the shape of the training input and the
+estimator parameters::
+
+    from skranger.memory import estimate_memory
+
+    estimate_memory(X.shape, rfc, n_classes=3, copy_input=not X.flags.f_contiguous)["total"]
+
+Estimators accept a ``memory_limit`` in bytes, enabling ``save_memory`` when this
+brings the estimate within the limit, and otherwise raising before training starts.
+
+The estimate is approximate. Tree sizes are derived from ``min_node_size`` and
+``max_depth``, assuming terminal nodes of about ``min_node_size`` samples.
+"""
+import math
+
+from skranger import parallel
+
+# ranger's default minimal node sizes, by tree type
+_MIN_NODE_SIZES = {"regression": 5, "probability": 10, "survival": 3}
+
+# bytes per node of a tree in ranger, child ids, split variable and value
+_NODE_BYTES = 32
+
+# bytes per node of a tree returned to python, as lists of python ints and floats
+_PY_NODE_BYTES = 112
+
+# bytes per terminal node value, class count or CHF value, in ranger and in python
+_LEAF_VALUE_BYTES = 8 + 32
+
+
+def _tree_nodes(n_samples, params, tree_type):
+    """Estimate the number of nodes and terminal nodes of a tree.
+
+    :param int n_samples: the number of training samples
+    :param dict params: the estimator parameters
+    :param str tree_type: ``regression``, ``probability`` or ``survival``
+    """
+    n_inbag = _n_inbag(n_samples, params)
+    if params.get("replace", True):
+        # the expected number of distinct samples drawn with replacement
+        n_inbag = n_samples * (1 - math.exp(-n_inbag / max(n_samples, 1)))
+    min_node_size = params.get("min_node_size") or _MIN_NODE_SIZES[tree_type]
+    n_leaves = max(1, int(n_inbag / min_node_size))
+    if params.get("max_depth"):
+        n_leaves = min(n_leaves, 2 ** params["max_depth"])
+    return 2 * n_leaves - 1, n_leaves
+
+
+def _n_inbag(n_samples, params):
+    """Get the number of in-bag samples of a tree.
+
+    :param int n_samples: the number of training samples
+    :param dict params: the estimator parameters
+    """
+    sample_fraction = params.get("sample_fraction") or [1.0 if params.get("replace", True) else 0.632]
+    return int(n_samples * sum(sample_fraction))
+
+
+def _grown_in_blocks(params):
+    """Whether trees are grown by separate ranger calls, each sorting the input."""
+    regularized = params.get("regularization_factor") and params.get("parallel_regularization")
+    return bool(
+        params.get("on_tree_grown") is not None
+        or params.get("timeout") is not None
+        or params.get("early_stopping")
+        or regularized
+    )
+
+
+def estimate_memory(X_shape, params, n_classes=None, n_event_times=None, copy_input=False):
+    """Estimate the peak memory of fitting a forest.
+
+    The estimate is the sum of:
+
+    * ``data``, the training input passed to ranger, twice if the input is copied to
+      a Fortran ordered float64 array for ranger.
+    * ``sort``, the sorted index of the input which ranger builds unless
+      ``save_memory`` is set, once per thread when trees are grown in blocks.
+    * ``workspace``, the per thread memory of growing trees. Unless ``save_memory``
+      is set, split statistics are counted for all unique values of a feature, times
+      the number of classes or event times.
+    * ``inbag``, the in-bag counts, kept with ``keep_inbag`` or ``early_stopping``, or
+      with ``oob_error`` when trees are grown in blocks.
+    * ``forest``, the grown forest in ranger and its conversion to python, with the
+      class counts of probability trees and the CHFs of survival trees.
+
+    :param tuple X_shape: The shape ``(n_samples, n_features)`` of the training input.
+    :param dict params: The estimator parameters as returned by ``get_params``, or
+        the estimator.
+    :param int n_classes: For classifiers, the number of classes.
+    :param int n_event_times: For survival forests, the number of unique event
+        times.
+    :param bool copy_input: Whether the training input is copied, as it is unless it
+        is a Fortran ordered float64 array, such as a C ordered or integer array.
+    :return: a dict of the estimated bytes of each part, and their ``total``
+    """
+    if hasattr(params, "get_params"):
+        params = params.get_params()
+    n_samples, n_features = X_shape
+    if n_event_times is not None:
+        tree_type, n_values = "survival", n_event_times
+    elif n_classes is not None:
+        tree_type, n_values = "probability", n_classes
+    else:
+        tree_type, n_values = "regression", 0
+    n_trees = params.get("n_estimators", 100)
+    n_threads = min(parallel.num_threads(max(params.get("n_jobs", -1), 0)), n_trees)
+    save_memory = params.get("save_memory", False)
+    n_inbag = _n_inbag(n_samples, params)
+
+    estimate = {}
+    n_targets = 2 if tree_type == "survival" else 1
+    estimate["data"] = 8 * n_samples * (n_features + n_targets)
+    if copy_input:
+        estimate["data"] += 8 * n_samples * n_features
+
+    # index of the sorted values and the unique values of each feature
+    sort = 0 if save_memory else 16 * n_samples * n_features
+    estimate["sort"] = sort * (n_threads if _grown_in_blocks(params) else 1)
+
+    # sample ids, in-bag counts and node ranges of the tree being grown
+    workspace = 8 * (n_inbag + 2 * n_samples)
+    if not save_memory:
+        if tree_type == "regression":
+            workspace += 16 * n_samples
+        else:
+            workspace += 8 * n_samples * (n_values + 1)
+    estimate["workspace"] = workspace * n_threads
+
+    estimate["inbag"] = 0
+    tracks_oob = params.get("early_stopping") or (params.get("oob_error") and _grown_in_blocks(params))
+    if params.get("keep_inbag") or tracks_oob:
+        estimate["inbag"] = 9 * n_trees * n_samples
+
+    n_nodes, n_leaves = _tree_nodes(n_samples, params, tree_type)
+    tree = n_nodes * (_NODE_BYTES + _PY_NODE_BYTES) + n_leaves * n_values * _LEAF_VALUE_BYTES
+    estimate["forest"] = n_trees * tree
+
+    estimate["total"] = sum(estimate.values())
+    return estimate
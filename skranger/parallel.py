@@ -0,0 +1,249 @@
+"""Threads used by skranger.
+
+Ranger grows and predicts trees with ``num_threads`` threads of its own. When trees
+are grown in blocks, each tree is grown by a single threaded ranger call, and these
+calls, like the blocks of proximity matrices, run in a thread pool shared by all
+estimators, so that its threads are reused rather than started for every call.
+
+The number of threads defaults to the number of CPUs available to the calling
+thread, or to the ``OMP_NUM_THREADS`` environment variable, which joblib sets in its
+workers to avoid oversubscription. It is used by estimators with ``n_jobs=-1`` and
+by the shared pool, and can be set globally::
+
+    import skranger
+
+    skranger.set_num_threads(4)
+
+or limited temporarily with threadpoolctl, as the ``skranger`` API::
+
+    from threadpoolctl import threadpool_limits
+
+    with threadpool_limits(limits=1, user_api="skranger"):
+        rfc.fit(X, y)
+
+Ranger starts its threads anew on every call, and at least one even with a single
+thread, so only the calls made in the shared pool reuse threads. Other fits and
+predictions still start ranger's threads every time. Predictions of few samples by
+few trees use a single thread, since starting more threads would take longer than
+predicting.
+
+Threads inherit the CPU affinity of the thread starting them. On machines with
+several NUMA nodes, :func:`cpu_affinity` keeps the threads of a fit or prediction
+on the CPUs of one node::
+
+    from skranger.parallel import cpu_affinity
+
+    with cpu_affinity(numa_node=1):
+        rfc.fit(X, y)
+"""
+import collections
+import contextlib
+import itertools
+import os
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
+from skranger._version import __version__
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# the number of tree traversals, samples times trees, below which ranger predicts
+# with a single thread
+_SINGLE_THREAD_TRAVERSALS = 2 ** 14
+
+_lock = threading.Lock()
+_num_threads = None
+_executor = None
+
+
+def set_num_threads(n_threads=None):
+    """Set the number of threads used by skranger.
+
+    :param int n_threads: The number of threads. The default is the number of CPU
+        cores.
+    """
+    global _num_threads, _executor
+    if n_threads is not None and (not isinstance(n_threads, int) or n_threads < 1):
+        raise ValueError("n_threads must be a positive integer")
+    with _lock:
+        _num_threads = n_threads
+        # the threads of the previous pool exit once its pending calls are done
+        _executor = None
+
+
+def get_num_threads():
+    """Get the number of threads used by skranger."""
+    if _num_threads:
+        return _num_threads
+    # a comma separated list of the number of threads of nested levels
+    env_threads = os.environ.get("OMP_NUM_THREADS", "").split(",")[0].strip()
+    if env_threads.isdigit() and int(env_threads) > 0:
+        return int(env_threads)
+    affinity = _get_affinity()
+    if affinity:
+        return len(affinity)
+    return os.cpu_count() or 1
+
+
+def _get_affinity():
+    """Get the CPUs the calling thread may run on, or None if unsupported."""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return os.sched_getaffinity(0)
+
+
+def _parse_cpu_list(cpu_list):
+    """Parse a Linux CPU list, such as ``0-3,8-11``, into a set of CPUs."""
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_node_cpus(numa_node):
+    """Get the CPUs of a NUMA node.
+
+    :param int numa_node: the NUMA node
+    """
+    path = f"/sys/devices/system/node/node{int(numa_node)}/cpulist"
+    if not os.path.exists(path):
+        raise ValueError(f"NUMA node {numa_node} not found")
+    with open(path) as f:
+        return _parse_cpu_list(f.read())
+
+
+@contextlib.contextmanager
+def cpu_affinity(cpus=None, numa_node=None):
+    """Run the threads skranger starts in the calling thread on the given CPUs.
+
+    Ranger's threads inherit the CPU affinity of the calling thread, which is also
+    applied to the calls of :func:`imap` in the shared pool. Unless set with
+    :func:`set_num_threads`, the number of threads becomes the number of CPUs. Only
+    supported on Linux.
+
+    :param iterable cpus: The CPUs to run on.
+    :param int numa_node: A NUMA node, whose CPUs are run on.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        raise ValueError("CPU affinity is only supported on Linux")
+    if (cpus is None) == (numa_node is None):
+        raise ValueError("Exactly one of cpus and numa_node must be set")
+    if numa_node is not None:
+        cpus = numa_node_cpus(numa_node)
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def get_executor():
+    """Get the thread pool shared by all estimators."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_num_threads(), thread_name_prefix="skranger-worker")
+        return _executor
+
+
+def num_threads(n_jobs=0, traversals=None):
+    """Get the number of threads for a ranger call.
+
+    :param int n_jobs: The number of threads of the estimator, with 0 for the number
+        of threads set by :func:`set_num_threads`.
+    :param int traversals: For predictions, the number of samples times the number
+        of trees. Small predictions use a single thread.
+    """
+    if traversals is not None and traversals < _SINGLE_THREAD_TRAVERSALS:
+        return 1
+    return n_jobs or get_num_threads()
+
+
+def imap(func, items, n_jobs=0):
+    """Apply ``func`` to items in the shared thread pool, yielding results in order.
+
+    At most ``n_jobs`` calls, and no more than the threads of the pool, are pending
+    at once, so that the following items are processed while a result is consumed.
+    When the generator is closed, calls which haven't started are cancelled and the
+    running ones are waited for, so that none outlive the caller.
+
+    :param callable func: the function to apply
+    :param iterable items: the items
+    :param int n_jobs: The number of concurrent calls, with 0 for the number of
+        threads set by :func:`set_num_threads`.
+    """
+    executor = get_executor()
+    affinity = _get_affinity()
+
+    def call(item):
+        # pool threads take the CPU affinity of the calling thread
+        if affinity is not None and os.sched_getaffinity(0) != affinity:
+            os.sched_setaffinity(0, affinity)
+        return func(item)
+
+    items = iter(items)
+    n_pending = min(num_threads(n_jobs), get_num_threads())
+    pending = collections.deque(executor.submit(call, item) for item in itertools.islice(items, n_pending))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(executor.submit(call, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        futures.wait(pending)
+
+
+if threadpoolctl is not None and hasattr(threadpoolctl, "register"):
+
+    class _SkrangerController(threadpoolctl.LibController):
+        """Expose the number of threads of skranger to threadpoolctl.
+
+        The ranger extension exports ``skranger_get_num_threads`` and
+        ``skranger_set_num_threads`` with C linkage, which call
+        :func:`get_num_threads` and :func:`set_num_threads`.
+
+        When a ``threadpool_limits`` block exits, threadpoolctl sets the number of
+        threads it got before the block. If that was the default, rather than a
+        number set with :func:`set_num_threads`, the default is restored so that it
+        still follows ``OMP_NUM_THREADS`` and the CPU affinity.
+        """
+
+        user_api = "skranger"
+        internal_api = "skranger"
+        filename_prefixes = ("ranger.",)
+        check_symbols = ("skranger_get_num_threads", "skranger_set_num_threads")
+
+        def get_num_threads(self):
+            # older builds of the extension don't export the functions
+            get_num_threads = getattr(self.dynlib, "skranger_get_num_threads", None)
+            if get_num_threads is None:
+                return None
+            num_threads = get_num_threads()
+            # the default number of threads, to restore as unset
+            self._default_num_threads = num_threads if _num_threads is None else None
+            return num_threads
+
+        def set_num_threads(self, num_threads):
+            set_threads = getattr(self.dynlib, "skranger_set_num_threads", None)
+            if set_threads is None:
+                return
+            if num_threads == getattr(self, "_default_num_threads", None):
+                set_num_threads(None)
+            else:
+                set_threads(num_threads)
+
+        def get_version(self):
+            return __version__
+
+    threadpoolctl.register(_SkrangerController)
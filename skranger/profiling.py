@@ -0,0 +1,125 @@
+"""Opt-in timing and memory instrumentation of the phases of fit and predict.
+
+Phases are only recorded inside a :class:`profile` context, and are otherwise
+no-ops::
+
+    from skranger import profiling
+
+    with profiling.profile() as prof:
+        rfc.fit(X, y)
+        rfc.predict(X)
+
+    for timing in prof.timings:
+        print(timing.name, timing.seconds, timing.allocated_bytes)
+
+    # the phases of the most recent fit
+    rfc.timings_
+
+Phase names are nested with dots, e.g. ``fit.ranger.run``. Allocated bytes are
+the net change in memory traced by ``tracemalloc`` during the phase, which covers
+python and numpy allocations but not allocations made inside ranger's C++ code.
+"""
+import functools
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+PhaseTiming = namedtuple("PhaseTiming", ["name", "seconds", "allocated_bytes"])
+
+_state = threading.local()
+
+
+class profile:
+    """Context manager which records the phases of fit and predict calls.
+
+    :param callable callback: An optional function called with each
+        :class:`PhaseTiming` as soon as its phase completes.
+    :param bool trace_memory: Trace python allocations with ``tracemalloc`` to
+        record allocated bytes. Tracing slows down python code considerably.
+
+    :ivar list timings: The recorded :class:`PhaseTiming` objects, in order of
+        completion.
+    """
+
+    def __init__(self, callback=None, trace_memory=True):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.timings = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if not hasattr(_state, "profilers"):
+            _state.profilers = []
+            _state.names = []
+        _state.profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.profilers.remove(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _record(self, timing):
+        self.timings.append(timing)
+        if self.callback is not None:
+            self.callback(timing)
+
+
+class phase:
+    """Context manager which records a phase for the active profilers.
+
+    :param str name: The name of the phase.
+    :param estimator: If given, the phases recorded within this phase are set as the
+        estimator's ``timings_`` attribute.
+    """
+
+    def __init__(self, name, estimator=None):
+        self.name = name
+        self.estimator = estimator
+
+    def __enter__(self):
+        self._profilers = list(getattr(_state, "profilers", ()))
+        if not self._profilers:
+            return self
+        _state.names.append(self.name)
+        self._full_name = ".".join(_state.names)
+        self._first = [len(p.timings) for p in self._profilers]
+        self._start_bytes = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._profilers:
+            return
+        seconds = time.perf_counter() - self._start
+        allocated_bytes = tracemalloc.get_traced_memory()[0] - self._start_bytes if tracemalloc.is_tracing() else 0
+        _state.names.pop()
+        timing = PhaseTiming(self._full_name, seconds, allocated_bytes)
+        for profiler in self._profilers:
+            profiler._record(timing)
+        if self.estimator is not None:
+            self.estimator.timings_ = self._profilers[-1].timings[self._first[-1] :]
+
+
+def profiled(name, set_timings=False):
+    """Decorate an estimator method so that it's recorded as a phase.
+
+    :param str name: The name of the phase.
+    :param bool set_timings: Whether to set the recorded phases as the estimator's
+        ``timings_`` attribute.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with phase(name, estimator=self if set_timings else None):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
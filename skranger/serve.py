@@ -0,0 +1,151 @@
+"""A small HTTP server for batched predictions from a saved estimator.
+
+The estimator is loaded once, and rows posted by concurrent requests are coalesced
+into batches with :class:`skranger.batching.MicroBatcher`, so that the estimator's
+prediction method is called once per batch.
+
+Requests are HTTP ``POST`` requests with a JSON body of the form
+``{"instances": [[...], ...]}``, and responses have the form
+``{"predictions": [...]}``. The server listens on TCP or on a Unix socket::
+
+    python -m skranger.serve model.pkl --method predict_proba --port 8080
+    python -m skranger.serve model.pkl --unix-socket /tmp/skranger.sock
+"""
+import argparse
+import asyncio
+import json
+import pickle
+
+import numpy as np
+
+from skranger.batching import MicroBatcher
+
+_REASONS = {200: "OK", 400: "Bad Request", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def load_estimator(path):
+    """Load a pickled estimator.
+
+    :param str path: the path of the pickled estimator
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class PredictionServer:
+    """Serve batched predictions of an estimator over HTTP.
+
+    :param estimator: A fitted estimator.
+    :param str method: The name of the estimator's prediction method to call, e.g.
+        ``predict``, ``predict_proba`` or ``predict_survival_function``.
+    :param int max_batch_size: The number of rows at which a batch is sent without
+        waiting.
+    :param float max_wait: The number of seconds to wait for more requests after the
+        first request of a batch arrives.
+    """
+
+    def __init__(self, estimator, method="predict", max_batch_size=1024, max_wait=0.002):
+        if not callable(getattr(estimator, method, None)):
+            raise ValueError("estimator has no prediction method `{}`".format(method))
+        self.estimator = estimator
+        self.method = method
+        self.batcher = MicroBatcher(getattr(estimator, method), max_batch_size=max_batch_size, max_wait=max_wait)
+
+    async def start(self, host="127.0.0.1", port=8080, unix_socket=None):
+        """Start listening, and return the ``asyncio`` server.
+
+        :param str host: The host to listen on.
+        :param int port: The TCP port to listen on.
+        :param str unix_socket: The path of a Unix socket to listen on instead of TCP.
+        """
+        if unix_socket is not None:
+            return await asyncio.start_unix_server(self._handle_connection, path=unix_socket)
+        return await asyncio.start_server(self._handle_connection, host=host, port=port)
+
+    async def _handle_connection(self, reader, writer):
+        """Handle the requests of a single (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = await self._read_headers(reader)
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._respond(request_line.decode("latin-1").split(), body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_headers(reader):
+        """Read HTTP headers up to the blank line."""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _respond(self, request_line, body):
+        """Determine the status and payload for a request."""
+        if len(request_line) < 2:
+            return 400, {"error": "malformed request line"}
+        if request_line[0] != "POST":
+            return 405, {"error": "only POST requests are supported"}
+        try:
+            instances = np.asarray(json.loads(body.decode("utf-8"))["instances"], dtype="float64")
+        except (ValueError, KeyError, TypeError) as exc:
+            return 400, {"error": "invalid request body: {}".format(exc)}
+        if instances.ndim != 2:
+            return 400, {"error": "instances must be a list of rows"}
+        try:
+            predictions = await self.batcher.submit(instances)
+        except ValueError as exc:
+            # estimators raise ValueError for invalid input, such as the wrong number of
+            # features, which fails only this request of its batch
+            return 400, {"error": "invalid instances: {}".format(exc)}
+        except Exception as exc:
+            return 500, {"error": str(exc)}
+        return 200, {"predictions": np.asarray(predictions).tolist()}
+
+    @staticmethod
+    def _write_response(writer, status, payload, keep_alive):
+        """Write an HTTP response with a JSON payload."""
+        body = json.dumps(payload).encode("utf-8")
+        head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n"
+        head = head.format(status, _REASONS[status], len(body), "keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1") + body)
+
+
+def main(argv=None):
+    """Run the prediction server from the command line."""
+    parser = argparse.ArgumentParser(description="Serve batched predictions from a pickled skranger estimator.")
+    parser.add_argument("model", help="path of the pickled estimator")
+    parser.add_argument("--method", default="predict", help="prediction method to call (default: predict)")
+    parser.add_argument("--host", default="127.0.0.1", help="host to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="TCP port to listen on (default: 8080)")
+    parser.add_argument("--unix-socket", help="path of a Unix socket to listen on instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=1024, help="rows per batch (default: 1024)")
+    parser.add_argument("--max-wait", type=float, default=0.002, help="seconds to wait for a batch (default: 0.002)")
+    args = parser.parse_args(argv)
+
+    server = PredictionServer(
+        load_estimator(args.model), method=args.method, max_batch_size=args.max_batch_size, max_wait=args.max_wait
+    )
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start(host=args.host, port=args.port, unix_socket=args.unix_socket))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import asyncio
+import copy
 import pickle
 import random
 import tempfile
+import warnings
 
 import numpy as np
 import pytest
@@ -11,6 +14,7 @@ from sklearn.metrics import accuracy_score
 from sklearn.model_selection import train_test_split
 from sklearn.utils.validation import check_is_fitted
 
+from skranger import profiling
 from skranger.ensemble import RangerForestClassifier
 
 
@@ -36,18 +40,212 @@ class TestRangerForestClassifier:
         pred = rfc.predict(iris_X)
         assert len(pred) == iris_X.shape[0]
 
+    def test_predict_majority_vote(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(seed=42)
+        rfc.fit(iris_X, iris_y)
+        split_values = copy.deepcopy(rfc.ranger_forest_["forest"]["split_values"])
+        assert "terminal_node_classes" not in rfc.ranger_forest_
+        pred = rfc.predict(iris_X, majority_vote=True)
+        # the majority classes are computed once and kept apart from the split values
+        assert len(rfc.ranger_forest_["terminal_node_classes"]) == rfc.n_estimators
+        assert rfc.ranger_forest_["forest"]["split_values"] == split_values
+        np.testing.assert_array_equal(rfc.predict(iris_X, majority_vote=True), pred)
+        assert len(pred) == iris_X.shape[0]
+        assert set(pred) <= set(rfc.classes_)
+        # hard and soft voting only differ on samples near the decision boundary
+        assert np.mean(pred == rfc.predict(iris_X)) > 0.95
+
+        rfc_sparse = RangerForestClassifier(seed=42, sparse_class_counts=True)
+        rfc_sparse.fit(iris_X, iris_y)
+        np.testing.assert_array_equal(rfc_sparse.predict(iris_X, majority_vote=True), pred)
+
+    def test_predict_return_std(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(keep_inbag=True, seed=42)
+        rfc.fit(iris_X, iris_y)
+        pred, std = rfc.predict(iris_X, return_std=True)
+        np.testing.assert_array_equal(pred, rfc.predict(iris_X))
+        assert std.shape == (iris_X.shape[0], rfc.n_classes_)
+        assert (std >= 0).all()
+        with pytest.raises(ValueError):
+            rfc.predict(iris_X, majority_vote=True, return_std=True)
+
     def test_predict_proba(self, iris_X, iris_y):
         rfc = RangerForestClassifier()
         rfc.fit(iris_X, iris_y)
         pred = rfc.predict_proba(iris_X)
         assert len(pred) == iris_X.shape[0]
 
+    def test_predict_proba_top_k(self, iris_X, iris_y):
+        rfc = RangerForestClassifier()
+        rfc.fit(iris_X, iris_y)
+        probas = rfc.predict_proba(iris_X)
+        top = rfc.predict_proba(iris_X, top_k=1)
+        assert top.shape == probas.shape
+        assert (top.getnnz(axis=1) == 1).all()
+        np.testing.assert_allclose(top.max(axis=1).toarray().ravel(), probas.max(axis=1))
+        with pytest.raises(ValueError):
+            rfc.predict_proba(iris_X, top_k=0)
+
+    def test_sparse_class_counts(self, iris_X, iris_y):
+        rfc = RangerForestClassifier()
+        rfc.fit(iris_X, iris_y)
+        rfc_sparse = RangerForestClassifier(sparse_class_counts=True)
+        rfc_sparse.fit(iris_X, iris_y)
+        assert "terminal_class_counts" not in rfc_sparse.ranger_forest_["forest"]
+        assert "class_fractions" in rfc_sparse.ranger_forest_["forest"]
+
+        np.testing.assert_allclose(rfc.predict_proba(iris_X), rfc_sparse.predict_proba(iris_X))
+        # ties may be broken differently due to floating point summation order
+        assert np.mean(rfc.predict(iris_X) == rfc_sparse.predict(iris_X)) > 0.95
+        top = rfc_sparse.predict_proba(iris_X, top_k=2)
+        assert (top.getnnz(axis=1) <= 2).all()
+
+    def test_apredict_proba(self, iris_X, iris_y):
+        rfc = RangerForestClassifier()
+        rfc.fit(iris_X, iris_y)
+
+        async def predict_all():
+            return await asyncio.gather(*[rfc.apredict_proba(iris_X[i : i + 1]) for i in range(10)])
+
+        loop = asyncio.new_event_loop()
+        probas = loop.run_until_complete(predict_all())
+        loop.close()
+        np.testing.assert_allclose(np.vstack(probas), rfc.predict_proba(iris_X[:10]))
+
+    def test_profiling(self, iris_X, iris_y):
+        rfc = RangerForestClassifier()
+        with profiling.profile() as prof:
+            rfc.fit(iris_X, iris_y)
+        names = [t.name for t in rfc.timings_]
+        assert "fit.ranger.run" in names
+        assert names[-1] == "fit"
+        assert rfc.timings_ == prof.timings
+
     def test_predict_log_proba(self, iris_X, iris_y):
         rfc = RangerForestClassifier()
         rfc.fit(iris_X, iris_y)
         pred = rfc.predict_log_proba(iris_X)
         assert len(pred) == iris_X.shape[0]
 
+    def test_on_tree_grown(self, iris_X, iris_y):
+        grown = []
+
+        def on_tree_grown(i, elapsed):
+            grown.append(i)
+            return i >= 4  # cancel
+
+        rfc = RangerForestClassifier(n_estimators=40, n_jobs=2, on_tree_grown=on_tree_grown)
+        rfc.fit(iris_X, iris_y)
+        # the block of 16 trees is completed
+        assert grown == list(range(16))
+        assert rfc.ranger_forest_["forest"]["num_trees"] == 16
+        assert len(rfc.predict_proba(iris_X)) == iris_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestClassifier(on_tree_grown=1).fit(iris_X, iris_y)
+
+    def test_oob_error_blocks(self, iris_X, iris_y):
+        rfcs = [
+            RangerForestClassifier(n_estimators=40, seed=7, oob_error=True, on_tree_grown=on_tree_grown)
+            for on_tree_grown in (None, lambda i, elapsed: False)
+        ]
+        for rfc in rfcs:
+            rfc.fit(iris_X, iris_y)
+        # the error of trees grown in blocks is that of the forest, not of the blocks
+        assert abs(rfcs[1].ranger_forest_["prediction_error"] - rfcs[0].ranger_forest_["prediction_error"]) < 0.05
+        assert np.shape(rfcs[1].ranger_forest_["predictions"]) == np.shape(rfcs[0].ranger_forest_["predictions"])
+        assert "inbag_counts" not in rfcs[1].ranger_forest_
+
+    def test_early_stopping(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(n_estimators=2000, n_jobs=4, early_stopping=True, tol=1e-3)
+        rfc.fit(iris_X, iris_y)
+        assert rfc.ranger_forest_["forest"]["num_trees"] < 2000
+        assert 0 <= rfc.ranger_forest_["prediction_error"] < 1
+        assert len(rfc.ranger_forest_["predictions"]) == iris_X.shape[0]
+        assert "inbag_counts" not in rfc.ranger_forest_
+        assert len(rfc.predict_proba(iris_X)) == iris_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestClassifier(early_stopping=True, n_iter_no_change=0).fit(iris_X, iris_y)
+
+    def test_apply(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(n_estimators=10)
+        rfc.fit(iris_X, iris_y)
+        leaves = rfc.apply(iris_X)
+        assert leaves.shape == (iris_X.shape[0], 10)
+        assert leaves.dtype == np.int32
+        assert rfc.apply(iris_X[:1]).shape == (1, 10)
+
+    def test_decision_path(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(n_estimators=10)
+        rfc.fit(iris_X, iris_y)
+        indicator, n_nodes_ptr = rfc.decision_path(iris_X)
+        leaves = rfc.apply(iris_X)
+        assert indicator.shape == (iris_X.shape[0], n_nodes_ptr[-1])
+        assert len(n_nodes_ptr) == 11
+        # every path contains the root and the terminal node of each tree
+        assert np.all(indicator[:, n_nodes_ptr[:-1]].toarray() == 1)
+        rows = np.arange(iris_X.shape[0])[:, None]
+        assert np.all(indicator.toarray()[rows, leaves + n_nodes_ptr[:-1]] == 1)
+
+    def test_proximity(self, iris_X, iris_y):
+        rfc = RangerForestClassifier(n_estimators=10, keep_inbag=True)
+        rfc.fit(iris_X, iris_y)
+        leaves = rfc.apply(iris_X)
+        expected = (leaves[:, None, :] == leaves[None, :, :]).mean(axis=2)
+        np.testing.assert_allclose(rfc.proximity(iris_X).toarray(), expected)
+        assert rfc.proximity(iris_X[:5], iris_X).shape == (5, iris_X.shape[0])
+
+        oob_proximity = rfc.proximity(iris_X, oob_only=True).toarray()
+        assert np.all((oob_proximity >= 0) & (oob_proximity <= 1))
+        with pytest.raises(ValueError):
+            rfc.proximity(iris_X[:5], iris_X, oob_only=True)
+
+        proximities, indices = rfc.proximity_neighbors(iris_X, n_neighbors=3)
+        assert proximities.shape == indices.shape == (iris_X.shape[0], 3)
+        assert np.all(indices != np.arange(iris_X.shape[0])[:, None])
+        assert np.all(np.diff(proximities, axis=1) <= 0)
+
+    def test_missing_values(self, iris_X, iris_y):
+        X = np.array(iris_X, dtype=float)
+        X[::3, 0] = np.nan
+        rfc = RangerForestClassifier(n_estimators=10, importance="impurity")
+        rfc.fit(X, iris_y)
+        assert rfc.missing_features_ == [0]
+        assert len(rfc.ranger_forest_["variable_importance"]) == X.shape[1]
+        pred = rfc.predict_proba(X)
+        assert len(pred) == X.shape[0]
+        assert np.all(np.isfinite(pred))
+
+        # missing values in features without missing training values go left
+        X_test = np.array(iris_X[:5], dtype=float)
+        X_test[:, 1] = np.nan
+        assert np.all(np.isfinite(rfc.predict_proba(X_test)))
+
+    def test_dataframe(self, iris_X, iris_y):
+        pd = pytest.importorskip("pandas")
+        X = pd.DataFrame(iris_X, columns=["sepal_length", "sepal_width", "petal_length", "petal_width"])
+        X["size"] = pd.Categorical(np.where(iris_X[:, 2] > 4, "large", "small"))
+        X.loc[::10, "size"] = None
+        rfc = RangerForestClassifier(n_estimators=10)
+        rfc.fit(X, iris_y)
+        assert rfc.feature_names_[0] == b"sepal_length"
+        assert rfc.categorical_features_ == [b"size"]
+        assert list(rfc.categories_["size"]) == ["large", "small"]
+        assert rfc.missing_features_ == []
+
+        # columns are matched by name, and unseen categories are treated as missing
+        X_test = X[X.columns[::-1]].copy()
+        X_test["size"] = X_test["size"].cat.add_categories(["medium"])
+        X_test.loc[::7, "size"] = "medium"
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            probas = rfc.predict_proba(X_test[::7])
+            # columns of other dtypes are converted to the training categories too
+            probas_object = rfc.predict_proba(X_test.astype({"size": object})[::7])
+        np.testing.assert_allclose(probas, rfc.predict_proba(X.assign(size=None)[::7]))
+        np.testing.assert_allclose(probas_object, probas)
+
     def test_serialize(self, iris_X, iris_y):
         tf = tempfile.TemporaryFile()
         rfc = RangerForestClassifier()
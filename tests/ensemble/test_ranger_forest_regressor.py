@@ -1,15 +1,21 @@
+import asyncio
+import gc
 import pickle
 import random
 import tempfile
+import weakref
 
 import numpy as np
 import pytest
+from sklearn import config_context
 from sklearn.base import clone
+from sklearn.datasets import make_regression
 from sklearn.exceptions import NotFittedError
 from sklearn.model_selection import train_test_split
 from sklearn.utils.validation import check_is_fitted
 
 from skranger.ensemble import RangerForestRegressor
+from skranger.memory import estimate_memory
 
 
 class TestRangerForestRegressor:
@@ -31,6 +37,243 @@ class TestRangerForestRegressor:
         pred = rfr.predict(boston_X)
         assert len(pred) == boston_X.shape[0]
 
+    def test_predict_input_layout(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(seed=42)
+        rfr.fit(boston_X, boston_y)
+        pred = rfr.predict(np.asfortranarray(boston_X, dtype="float64"))
+        np.testing.assert_array_equal(rfr.predict(np.ascontiguousarray(boston_X, dtype="float64")), pred)
+        np.testing.assert_array_equal(rfr.predict(np.asarray(boston_X, dtype="float64")[::-1])[::-1], pred)
+        with config_context(assume_finite=True):
+            np.testing.assert_array_equal(rfr.predict(np.ascontiguousarray(boston_X, dtype="float64")), pred)
+            np.testing.assert_array_equal(rfr.predict(boston_X.tolist()), pred)
+
+    def test_predict_return_std(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(seed=42)
+        rfr.fit(boston_X, boston_y)
+        with pytest.raises(ValueError):
+            rfr.predict(boston_X, return_std=True)
+
+        rfr = RangerForestRegressor(keep_inbag=True, seed=42)
+        rfr.fit(boston_X, boston_y)
+        inbag_counts = rfr.ranger_forest_["inbag_counts"]
+        assert inbag_counts.dtype == np.uint8
+        assert inbag_counts.shape == (rfr.n_estimators, boston_X.shape[0])
+        pred, std = rfr.predict(boston_X, return_std=True)
+        np.testing.assert_array_equal(pred, rfr.predict(boston_X))
+        assert std.shape == pred.shape
+        assert (std >= 0).all()
+        assert std.mean() > 0
+
+    def test_inbag_storage(self, boston_X, boston_y):
+        n_samples = boston_X.shape[0]
+        rfr = RangerForestRegressor(keep_inbag=True, replace=False)
+        rfr.fit(boston_X, boston_y)
+        assert "inbag_counts" not in rfr.ranger_forest_
+        assert rfr.ranger_forest_["inbag_bits"].dtype == np.uint8
+        counts = rfr._get_inbag_counts()
+        assert counts.shape == (rfr.n_estimators, n_samples)
+        assert (counts.sum(axis=1) == int(n_samples * 0.632)).all()
+
+        rfr = RangerForestRegressor(keep_inbag=True, regenerate_inbag=True)
+        rfr.fit(boston_X, boston_y)
+        assert not any("inbag" in key for key in rfr.ranger_forest_)
+        counts = rfr._get_inbag_counts()
+        np.testing.assert_array_equal(counts, rfr._get_inbag_counts())
+        assert (counts.sum(axis=1) == n_samples).all()
+        # the counts are passed to ranger as an array rather than python lists
+        assert isinstance(rfr._get_manual_inbag(0, 2, n_samples), np.ndarray)
+        # the trees were grown from the regenerated counts
+        rfr_inbag = RangerForestRegressor(inbag=counts.tolist())
+        rfr_inbag.fit(boston_X, boston_y)
+        np.testing.assert_array_equal(rfr_inbag.predict(boston_X), rfr.predict(boston_X))
+
+        with pytest.raises(ValueError):
+            RangerForestRegressor(inbag=counts.tolist(), regenerate_inbag=True).fit(boston_X, boston_y)
+
+    def test_apredict(self, boston_X, boston_y):
+        rfr = RangerForestRegressor()
+        rfr.fit(boston_X, boston_y)
+
+        async def predict_all():
+            return await asyncio.gather(*[rfr.apredict(boston_X[i : i + 1]) for i in range(10)])
+
+        loop = asyncio.new_event_loop()
+        preds = loop.run_until_complete(predict_all())
+        loop.close()
+        np.testing.assert_allclose(np.concatenate(preds), rfr.predict(boston_X[:10]))
+
+        # the batchers don't keep the estimator alive
+        estimator = weakref.ref(rfr)
+        del rfr
+        gc.collect()
+        assert estimator() is None
+
+    def test_on_tree_grown(self, boston_X, boston_y):
+        grown = []
+
+        def on_tree_grown(i, elapsed):
+            grown.append(i)
+            return i >= 4  # cancel
+
+        rfr = RangerForestRegressor(n_estimators=40, n_jobs=2, on_tree_grown=on_tree_grown)
+        rfr.fit(boston_X, boston_y)
+        # the block of 16 trees is completed
+        assert grown == list(range(16))
+        assert rfr.ranger_forest_["forest"]["num_trees"] == 16
+        assert len(rfr.predict(boston_X)) == boston_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestRegressor(on_tree_grown=1).fit(boston_X, boston_y)
+
+    def test_n_jobs_reproducible(self, boston_X, boston_y):
+        rfrs = [
+            RangerForestRegressor(n_jobs=n_jobs, seed=7, quantiles=True, on_tree_grown=on_tree_grown)
+            for n_jobs in (1, 2)
+            for on_tree_grown in (None, lambda i, elapsed: False)
+        ]
+        for rfr in rfrs:
+            rfr.fit(boston_X, boston_y)
+        # trees and blocks of trees are seeded from the seed and their index, whatever the threads
+        for rfr, expected in zip(rfrs[2:], rfrs[:2]):
+            np.testing.assert_array_equal(rfr.predict(boston_X), expected.predict(boston_X))
+            np.testing.assert_array_equal(rfr.predict_quantiles(boston_X), expected.predict_quantiles(boston_X))
+
+    def test_timeout(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_estimators=100000, n_jobs=2, timeout=0.5)
+        rfr.fit(boston_X, boston_y)
+        assert 0 < rfr.ranger_forest_["forest"]["num_trees"] < 100000
+
+        with pytest.raises(ValueError):
+            RangerForestRegressor(timeout=0).fit(boston_X, boston_y)
+
+    def test_oob_error_blocks(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(
+            n_estimators=40, seed=7, oob_error=True, keep_inbag=True, on_tree_grown=lambda i, elapsed: False
+        )
+        rfr.fit(boston_X, boston_y)
+        # the error of trees grown in blocks is that of the forest, not of the blocks
+        leaves = rfr.apply(boston_X)
+        split_values = rfr.ranger_forest_["forest"]["split_values"]
+        tree_predictions = np.array([np.asarray(values)[leaves[:, tree]] for tree, values in enumerate(split_values)])
+        oob = rfr._get_inbag_counts() == 0
+        predictions = np.sum(tree_predictions * oob, axis=0) / np.sum(oob, axis=0)
+        np.testing.assert_allclose(rfr.ranger_forest_["predictions"], predictions)
+        np.testing.assert_allclose(rfr.ranger_forest_["prediction_error"], np.mean((predictions - boston_y) ** 2))
+
+        rfr = RangerForestRegressor(n_estimators=40, seed=7, oob_error=True, on_tree_grown=lambda i, elapsed: False)
+        rfr.fit(boston_X, boston_y)
+        assert "inbag_counts" not in rfr.ranger_forest_
+
+    def test_early_stopping(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_estimators=2000, n_jobs=4, early_stopping=True, tol=1e-3)
+        rfr.fit(boston_X, boston_y)
+        assert rfr.ranger_forest_["forest"]["num_trees"] < 2000
+        assert rfr.ranger_forest_["prediction_error"] > 0
+        assert len(rfr.ranger_forest_["predictions"]) == boston_X.shape[0]
+        assert "inbag_counts" not in rfr.ranger_forest_
+        assert len(rfr.predict(boston_X)) == boston_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestRegressor(early_stopping=True, n_iter_no_change=0).fit(boston_X, boston_y)
+
+    def test_apply(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_estimators=10)
+        rfr.fit(boston_X, boston_y)
+        leaves = rfr.apply(boston_X)
+        assert leaves.shape == (boston_X.shape[0], 10)
+        assert leaves.dtype == np.int32
+        assert rfr.apply(boston_X[:1]).shape == (1, 10)
+
+    def test_decision_path(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_estimators=10)
+        rfr.fit(boston_X, boston_y)
+        indicator, n_nodes_ptr = rfr.decision_path(boston_X)
+        leaves = rfr.apply(boston_X)
+        assert indicator.shape == (boston_X.shape[0], n_nodes_ptr[-1])
+        assert len(n_nodes_ptr) == 11
+        # every path contains the root and the terminal node of each tree
+        assert np.all(indicator[:, n_nodes_ptr[:-1]].toarray() == 1)
+        rows = np.arange(boston_X.shape[0])[:, None]
+        assert np.all(indicator.toarray()[rows, leaves + n_nodes_ptr[:-1]] == 1)
+
+    def test_proximity(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_estimators=10)
+        rfr.fit(boston_X, boston_y)
+        proximity = rfr.proximity(boston_X[:20], boston_X)
+        assert proximity.shape == (20, boston_X.shape[0])
+        np.testing.assert_allclose(proximity[np.arange(20), np.arange(20)], 1)
+
+    def test_missing_values(self, boston_X, boston_y):
+        X = np.array(boston_X, dtype=float)
+        X[::3, 0] = np.nan
+        rfr = RangerForestRegressor(n_estimators=10, importance="impurity")
+        rfr.fit(X, boston_y)
+        assert rfr.missing_features_ == [0]
+        assert len(rfr.ranger_forest_["variable_importance"]) == X.shape[1]
+        pred = rfr.predict(X)
+        assert len(pred) == X.shape[0]
+        assert np.all(np.isfinite(pred))
+
+        # missing values in features without missing training values go left
+        X_test = np.array(boston_X[:5], dtype=float)
+        X_test[:, 1] = np.nan
+        assert np.all(np.isfinite(rfr.predict(X_test)))
+
+        # a single regularization factor also applies to the twin features
+        rfr = RangerForestRegressor(n_estimators=10, regularization_factor=[0.5], n_jobs=1)
+        rfr.fit(X, boston_y)
+        assert np.all(np.isfinite(rfr.predict(X)))
+
+    def test_missing_values_accuracy(self, boston_X, boston_y):
+        X = np.array(boston_X, dtype=float)
+        X[np.random.RandomState(0).rand(*X.shape) < 0.1] = np.nan
+        X_imputed = np.where(np.isnan(X), np.nanmean(X, axis=0), X)
+        idx_train, idx_test = train_test_split(np.arange(X.shape[0]), random_state=0)
+
+        def mse(X, **kwargs):
+            rfr = RangerForestRegressor(seed=42, **kwargs).fit(X[idx_train], boston_y[idx_train])
+            return np.mean((rfr.predict(X[idx_test]) - boston_y[idx_test]) ** 2)
+
+        # missing values are sent to the better child, rather than imputed
+        assert mse(X) <= 1.1 * mse(X_imputed)
+
+        # extratrees would draw split values between the missing value sentinels
+        assert mse(X_imputed, split_rule="extratrees") > 0
+        with pytest.raises(ValueError, match="extratrees"):
+            mse(X, split_rule="extratrees")
+
+    def test_missing_values_categorical(self, boston_X, boston_y):
+        X = np.array(boston_X, dtype=float)
+        X[:, 0] = np.round(X[:, 0])
+        rfr = RangerForestRegressor(n_estimators=10, respect_categorical_features="partition", categorical_features=[0])
+        X_nan = X.copy()
+        X_nan[::3, 0] = np.nan
+        with pytest.raises(ValueError, match="categorical features"):
+            rfr.fit(X_nan, boston_y)
+
+        rfr.fit(X, boston_y)
+        with pytest.raises(ValueError, match="categorical features"):
+            rfr.predict(X_nan)
+        with config_context(assume_finite=True):
+            with pytest.raises(ValueError, match="categorical features"):
+                rfr.predict(X_nan)
+
+    def test_arrow(self, boston_X, boston_y):
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        columns = {"x{}".format(i): boston_X[:, i] for i in range(boston_X.shape[1])}
+        table = pa.table(dict(columns, target=boston_y))
+        rfr = RangerForestRegressor(n_estimators=10)
+        rfr.fit_from_arrow(table, target="target")
+        assert rfr.feature_names_ == [name.encode() for name in columns]
+        expected = RangerForestRegressor(n_estimators=10).fit(boston_X, boston_y).predict(boston_X)
+        np.testing.assert_allclose(rfr.predict(boston_X), expected)
+
+        with tempfile.TemporaryDirectory() as path:
+            pq.write_table(table, path + "/data.parquet", row_group_size=100)
+            rfr.fit_from_arrow(path, target="target")
+            np.testing.assert_allclose(rfr.predict_from_arrow(path), expected)
+
     def test_serialize(self, boston_X, boston_y):
         tf = tempfile.TemporaryFile()
         rfr = RangerForestRegressor()
@@ -215,6 +458,64 @@ class TestRangerForestRegressor:
         assert rfc.regularization_factor_ == reg
         assert rfc.use_regularization_factor_
 
+    def test_parallel_regularization(self):
+        # few informative features, so that unpenalized trees split on noise features
+        X, y = make_regression(n_samples=300, n_features=30, n_informative=3, random_state=0)
+        reg = [0.1] * X.shape[1]
+        rfr = RangerForestRegressor(regularization_factor=reg, parallel_regularization=True, n_jobs=2, seed=42)
+        rfr.fit(X, y)
+        assert rfr.n_jobs_ == 2
+        assert rfr.ranger_forest_["num_trees"] == rfr.n_estimators
+
+        # the trees don't depend on the scheduling of the threads
+        rfr_again = clone(rfr).fit(X, y)
+        np.testing.assert_array_equal(rfr.predict(X), rfr_again.predict(X))
+
+        # with a single thread the forest is the one grown by ranger
+        with pytest.warns(Warning, match="unless parallel_regularization"):
+            rfr_serial = RangerForestRegressor(regularization_factor=reg, n_jobs=2, seed=42).fit(X, y)
+        rfr_single = clone(rfr).set_params(n_jobs=1).fit(X, y)
+        np.testing.assert_array_equal(rfr_single.predict(X), rfr_serial.predict(X))
+
+        # penalized features are used less than without regularization
+        rfr_unregularized = RangerForestRegressor(n_jobs=2, seed=42).fit(X, y)
+
+        def used_features(forest):
+            forest = forest.ranger_forest_["forest"]
+            used = set()
+            for (left, right), var_ids in zip(forest["child_node_ids"], forest["split_var_ids"]):
+                split = (np.asarray(left) != 0) | (np.asarray(right) != 0)
+                used.update(np.asarray(var_ids)[split].tolist())
+            return used
+
+        assert len(used_features(rfr)) < len(used_features(rfr_unregularized)) - 3
+        assert len(used_features(rfr)) <= len(used_features(rfr_serial)) + 3
+
+    def test_memory_limit(self, boston_X, boston_y):
+        rfr = RangerForestRegressor(n_jobs=2)
+        estimate = estimate_memory(boston_X.shape, rfr)["total"]
+        copy_estimate = estimate_memory(boston_X.shape, rfr, copy_input=True)["total"]
+        saving_estimate = estimate_memory(boston_X.shape, rfr.set_params(save_memory=True), copy_input=True)["total"]
+
+        # C ordered input is copied for ranger
+        assert not boston_X.flags.f_contiguous
+        rfr = RangerForestRegressor(n_jobs=2, memory_limit=copy_estimate)
+        rfr.fit(boston_X, boston_y)
+        assert not rfr.save_memory_
+        rfr = RangerForestRegressor(n_jobs=2, memory_limit=estimate)
+        rfr.fit(np.asfortranarray(boston_X), boston_y)
+        assert not rfr.save_memory_
+
+        # save_memory is enabled to fit within the limit
+        rfr = RangerForestRegressor(n_jobs=2, memory_limit=saving_estimate)
+        with pytest.warns(Warning):
+            rfr.fit(boston_X, boston_y)
+        assert rfr.save_memory_
+        assert not rfr.save_memory
+
+        with pytest.raises(ValueError):
+            RangerForestRegressor(n_jobs=2, memory_limit=saving_estimate - 1).fit(boston_X, boston_y)
+
     def test_always_split_features(self, boston_X, boston_y):
         rfc = RangerForestRegressor(always_split_features=[0])
         rfc.fit(boston_X, boston_y)
@@ -238,3 +539,18 @@ class TestRangerForestRegressor:
         assert quantiles_upper.ndim == 1
         quantiles = rfr.predict_quantiles(X_test, quantiles=[0.1, 0.9])
         assert quantiles.ndim == 2
+
+    def test_predict_distribution(self, boston_X, boston_y):
+        X_train, X_test, y_train, y_test = train_test_split(boston_X, boston_y)
+        rfr = RangerForestRegressor(quantiles=False)
+        rfr.fit(X_train, y_train)
+        with pytest.raises(ValueError):
+            rfr.predict_distribution(X_test)
+        rfr = RangerForestRegressor(quantiles=True)
+        rfr.fit(X_train, y_train)
+        distribution = rfr.predict_distribution(X_test, quantiles=[0.1, 0.5, 0.9], return_variance=True)
+        np.testing.assert_array_equal(distribution["mean"], rfr.predict(X_test))
+        np.testing.assert_array_equal(distribution["quantiles"], rfr.predict_quantiles(X_test, [0.1, 0.5, 0.9]))
+        assert distribution["variance"].shape == (X_test.shape[0],)
+        assert (distribution["variance"] >= 0).all()
+        assert "mean" not in rfr.predict_distribution(X_test, return_mean=False)
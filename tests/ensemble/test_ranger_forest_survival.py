@@ -1,3 +1,4 @@
+import asyncio
 import pickle
 import random
 import tempfile
@@ -46,6 +47,95 @@ class TestRangerForestSurvival:
         pred = rfs.predict_survival_function(lung_X)
         assert len(pred) == lung_X.shape[0]
 
+    def test_apredict_survival_function(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS)
+        rfs.fit(lung_X, lung_y)
+        X = np.asarray(lung_X)[:10]
+
+        async def predict_all():
+            return await asyncio.gather(*[rfs.apredict_survival_function(X[i : i + 1]) for i in range(10)])
+
+        loop = asyncio.new_event_loop()
+        preds = loop.run_until_complete(predict_all())
+        loop.close()
+        np.testing.assert_allclose(np.vstack(preds), rfs.predict_survival_function(X))
+
+    def test_on_tree_grown(self, lung_X, lung_y):
+        grown = []
+
+        def on_tree_grown(i, elapsed):
+            grown.append(i)
+            return i >= 4  # cancel
+
+        rfs = RangerForestSurvival(n_estimators=40, n_jobs=2, on_tree_grown=on_tree_grown)
+        rfs.fit(lung_X, lung_y)
+        # the block of 16 trees is completed
+        assert grown == list(range(16))
+        assert rfs.ranger_forest_["forest"]["num_trees"] == 16
+        assert len(rfs.predict_survival_function(lung_X)) == lung_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestSurvival(on_tree_grown=1).fit(lung_X, lung_y)
+
+    def test_early_stopping(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=2000, n_jobs=4, early_stopping=True, tol=1e-3)
+        rfs.fit(lung_X, lung_y)
+        assert rfs.ranger_forest_["forest"]["num_trees"] < 2000
+        assert 0 <= rfs.ranger_forest_["prediction_error"] < 1
+        assert len(rfs.ranger_forest_["predictions"]) == lung_X.shape[0]
+        assert "inbag_counts" not in rfs.ranger_forest_
+        assert len(rfs.predict_survival_function(lung_X)) == lung_X.shape[0]
+
+        with pytest.raises(ValueError):
+            RangerForestSurvival(early_stopping=True, n_iter_no_change=0).fit(lung_X, lung_y)
+
+    def test_apply(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=10)
+        rfs.fit(lung_X, lung_y)
+        leaves = rfs.apply(lung_X)
+        assert leaves.shape == (lung_X.shape[0], 10)
+        assert leaves.dtype == np.int32
+        assert rfs.apply(lung_X[:1]).shape == (1, 10)
+
+    def test_decision_path(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=10)
+        rfs.fit(lung_X, lung_y)
+        indicator, n_nodes_ptr = rfs.decision_path(lung_X)
+        leaves = rfs.apply(lung_X)
+        assert indicator.shape == (lung_X.shape[0], n_nodes_ptr[-1])
+        assert len(n_nodes_ptr) == 11
+        # every path contains the root and the terminal node of each tree
+        assert np.all(indicator[:, n_nodes_ptr[:-1]].toarray() == 1)
+        rows = np.arange(lung_X.shape[0])[:, None]
+        assert np.all(indicator.toarray()[rows, leaves + n_nodes_ptr[:-1]] == 1)
+
+    def test_missing_values(self, lung_X, lung_y):
+        X = np.array(lung_X, dtype=float)
+        X[::3, 0] = np.nan
+        rfs = RangerForestSurvival(n_estimators=10, importance="impurity")
+        rfs.fit(X, lung_y)
+        assert rfs.missing_features_ == [0]
+        assert len(rfs.ranger_forest_["variable_importance"]) == X.shape[1]
+        pred = rfs.predict_survival_function(X)
+        assert len(pred) == X.shape[0]
+        assert np.all(np.isfinite(pred))
+
+        # missing values in features without missing training values go left
+        X_test = np.array(lung_X[:5], dtype=float)
+        X_test[:, 1] = np.nan
+        assert np.all(np.isfinite(rfs.predict_survival_function(X_test)))
+
+    def test_arrow(self, lung_X, lung_y):
+        pa = pytest.importorskip("pyarrow")
+        table = pa.Table.from_pandas(lung_X, preserve_index=False)
+        table = table.append_column("event", pa.array(lung_y["Status"])).append_column(
+            "time", pa.array(lung_y["Survival_in_days"])
+        )
+        rfs = RangerForestSurvival(n_estimators=10)
+        rfs.fit_from_arrow(table, target=["event", "time"])
+        expected = RangerForestSurvival(n_estimators=10).fit(lung_X, lung_y).predict_survival_function(lung_X)
+        np.testing.assert_allclose(rfs.predict_from_arrow(table, method="predict_survival_function"), expected)
+
     def test_serialize(self, lung_X, lung_y):
         tf = tempfile.TemporaryFile()
         rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS)
@@ -226,3 +316,38 @@ class TestRangerForestSurvival:
         # feature 0 is in every tree split
         for tree in rfc.ranger_forest_["forest"]["split_var_ids"]:
             assert 0 in tree
+
+    def test_time_grid(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS)
+        rfs.fit(lung_X, lung_y)
+        assert rfs.time_grid_ is None
+
+        rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS, time_grid=5)
+        rfs.fit(lung_X, lung_y)
+        assert len(rfs.time_grid_) <= 5
+        assert set(rfs.event_times_).issubset(set(rfs.time_grid_))
+        pred = rfs.predict_cumulative_hazard_function(lung_X)
+        assert pred.shape == (lung_X.shape[0], len(rfs.event_times_))
+
+        grid = [10, 100, 1000]
+        rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS, time_grid=grid)
+        rfs.fit(lung_X, lung_y)
+        assert set(rfs.event_times_).issubset(set(grid))
+
+        for time_grid in [0, []]:
+            rfs = RangerForestSurvival(time_grid=time_grid)
+            with pytest.raises(ValueError):
+                rfs.fit(lung_X, lung_y)
+
+    def test_sparse_chf(self, lung_X, lung_y):
+        rfs = RangerForestSurvival(n_estimators=N_ESTIMATORS)
+        rfs.fit(lung_X, lung_y)
+        rfs_sparse = RangerForestSurvival(n_estimators=N_ESTIMATORS, sparse_chf=True)
+        rfs_sparse.fit(lung_X, lung_y)
+        assert "cumulative_hazard_function" not in rfs_sparse.ranger_forest_["forest"]
+        assert "chf_steps" in rfs_sparse.ranger_forest_["forest"]
+
+        chf = rfs.predict_cumulative_hazard_function(lung_X)
+        chf_sparse = rfs_sparse.predict_cumulative_hazard_function(lung_X)
+        np.testing.assert_allclose(chf, chf_sparse)
+        np.testing.assert_allclose(rfs.predict(lung_X), rfs_sparse.predict(lung_X))
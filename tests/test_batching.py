@@ -0,0 +1,88 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from skranger.batching import MicroBatcher
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestMicroBatcher:
+    def test_submit(self):
+        calls = []
+
+        def func(X):
+            calls.append(X.shape[0])
+            return X.sum(axis=1)
+
+        batcher = MicroBatcher(func, max_wait=0.05)
+
+        async def submit_all():
+            requests = [batcher.submit(np.full((i + 1, 2), i)) for i in range(3)]
+            return await asyncio.gather(*requests)
+
+        results = _run(submit_all())
+        assert calls == [6]
+        for i, result in enumerate(results):
+            np.testing.assert_array_equal(result, np.full(i + 1, 2 * i))
+
+    def test_max_batch_size(self):
+        calls = []
+
+        def func(X):
+            calls.append(X.shape[0])
+            return X
+
+        batcher = MicroBatcher(func, max_batch_size=2, max_wait=0.05)
+
+        async def submit_all():
+            return await asyncio.gather(*[batcher.submit(np.ones((1, 1))) for _ in range(4)])
+
+        results = _run(submit_all())
+        assert calls == [2, 2]
+        assert len(results) == 4
+
+    def test_exception(self):
+        def func(X):
+            raise RuntimeError("failed")
+
+        batcher = MicroBatcher(func)
+        with pytest.raises(RuntimeError):
+            _run(batcher.submit(np.ones((1, 1))))
+
+    def test_invalid_shape(self):
+        batcher = MicroBatcher(lambda X: X)
+        with pytest.raises(ValueError):
+            _run(batcher.submit(np.ones(3)))
+
+    def test_invalid_request(self):
+        calls = []
+
+        def func(X):
+            calls.append(X.shape)
+            if X.shape[1] != 2 or np.isnan(X).any():
+                raise ValueError("invalid")
+            return X.sum(axis=1)
+
+        batcher = MicroBatcher(func, max_wait=0.05)
+
+        async def submit_all():
+            requests = [np.ones((1, 2)), np.ones((2, 3)), np.full((1, 2), np.nan), np.ones((3, 2))]
+            return await asyncio.gather(*[batcher.submit(X) for X in requests], return_exceptions=True)
+
+        results = _run(submit_all())
+        # only the invalid requests fail
+        np.testing.assert_array_equal(results[0], [2])
+        assert isinstance(results[1], ValueError)
+        assert isinstance(results[2], ValueError)
+        np.testing.assert_array_equal(results[3], [2, 2, 2])
+        # requests are grouped by their number of columns, and run separately on failure
+        assert calls[:2] == [(5, 2), (2, 3)] or calls[:2] == [(2, 3), (5, 2)]
+        assert sorted(calls[2:]) == [(1, 2), (1, 2), (3, 2)]
@@ -0,0 +1,63 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from skranger import codegen
+from skranger.ensemble import RangerForestClassifier
+from skranger.ensemble import RangerForestRegressor
+from skranger.ensemble import RangerForestSurvival
+
+pytestmark = pytest.mark.skipif(shutil.which("cc") is None, reason="requires a C compiler")
+
+
+def test_compile_classifier(iris_X, iris_y, tmp_path):
+    rfc = RangerForestClassifier(n_estimators=20, seed=42)
+    rfc.fit(iris_X, iris_y)
+    compiled = codegen.compile(rfc, tmp_path / "model.so")
+    np.testing.assert_array_equal(compiled.predict_proba(iris_X), rfc.predict_proba(iris_X))
+    np.testing.assert_array_equal(compiled.predict(iris_X), rfc.predict(iris_X))
+
+    loaded = codegen.load(tmp_path / "model.so")
+    np.testing.assert_array_equal(loaded.classes_, rfc.classes_)
+    with pytest.raises(ValueError):
+        loaded.predict_proba(iris_X[:, :2])
+
+
+def test_compile_categorical_missing(iris_X, iris_y, tmp_path):
+    X = iris_X.copy()
+    X[:, 0] = np.floor(X[:, 0])
+    X[::7, 1] = np.nan
+    rfc = RangerForestClassifier(
+        n_estimators=20, categorical_features=[0], respect_categorical_features="partition", seed=42
+    )
+    rfc.fit(X, iris_y)
+    compiled = codegen.compile(rfc, tmp_path / "model.so")
+    np.testing.assert_array_equal(compiled.predict_proba(X), rfc.predict_proba(X))
+
+
+def test_compile_regressor(boston_X, boston_y, tmp_path):
+    rfr = RangerForestRegressor(n_estimators=20, seed=42)
+    rfr.fit(boston_X, boston_y)
+    compiled = codegen.compile(rfr, tmp_path / "model.so")
+    np.testing.assert_array_equal(compiled.predict(boston_X), rfr.predict(boston_X))
+    with pytest.raises(ValueError):
+        compiled.predict_proba(boston_X)
+
+
+def test_compile_same_path(boston_X, boston_y, tmp_path):
+    rfr_a = RangerForestRegressor(n_estimators=5, seed=1).fit(boston_X, boston_y)
+    rfr_b = RangerForestRegressor(n_estimators=5, seed=2).fit(boston_X, boston_y)
+    compiled_a = codegen.compile(rfr_a, tmp_path / "model.so")
+    # recompiling to a loaded path loads the new library
+    compiled_b = codegen.compile(rfr_b, tmp_path / "model.so")
+    np.testing.assert_array_equal(compiled_b.predict(boston_X), rfr_b.predict(boston_X))
+    np.testing.assert_array_equal(codegen.load(tmp_path / "model.so").predict(boston_X), rfr_b.predict(boston_X))
+    np.testing.assert_array_equal(compiled_a.predict(boston_X), rfr_a.predict(boston_X))
+
+
+def test_compile_survival(lung_X, lung_y, tmp_path):
+    rfs = RangerForestSurvival(n_estimators=5)
+    rfs.fit(lung_X, lung_y)
+    with pytest.raises(ValueError):
+        codegen.compile(rfs, tmp_path / "model.so")
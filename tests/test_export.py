@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from skranger.ensemble import RangerForestClassifier
+from skranger.ensemble import RangerForestRegressor
+from skranger.ensemble import RangerForestSurvival
+from skranger.export import to_onnx
+
+onnxruntime = pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+
+def _run(model, X):
+    session = onnxruntime.InferenceSession(model.SerializeToString())
+    return session.run(None, {"X": np.asarray(X, dtype="float64")})
+
+
+def test_to_onnx_classifier(iris_X, iris_y, tmp_path):
+    rfc = RangerForestClassifier(n_estimators=20, seed=42)
+    rfc.fit(iris_X, iris_y)
+    label, probabilities = _run(to_onnx(rfc, tmp_path / "model.onnx"), iris_X)
+    np.testing.assert_allclose(probabilities, rfc.predict_proba(iris_X), rtol=1e-5, atol=1e-6)
+    assert np.mean(label == rfc.predict(iris_X)) > 0.99
+    assert (tmp_path / "model.onnx").exists()
+
+
+def test_to_onnx_binary_classifier(iris_X, iris_y):
+    X, y = iris_X[iris_y > 0], np.where(iris_y[iris_y > 0] == 1, "a", "b")
+    rfc = RangerForestClassifier(n_estimators=20, seed=42)
+    rfc.fit(X, y)
+    label, probabilities = _run(to_onnx(rfc), X)
+    np.testing.assert_allclose(probabilities, rfc.predict_proba(X), rtol=1e-5, atol=1e-6)
+    assert np.mean(label == rfc.predict(X)) > 0.99
+
+
+def test_to_onnx_regressor_missing(boston_X, boston_y):
+    X = boston_X.copy()
+    X[::5, 0] = np.nan
+    rfr = RangerForestRegressor(n_estimators=20, seed=42)
+    rfr.fit(X, boston_y)
+    (variable,) = _run(to_onnx(rfr), X)
+    np.testing.assert_allclose(variable[:, 0], rfr.predict(X), rtol=1e-5)
+
+
+@pytest.mark.parametrize("sparse_chf", [False, True])
+def test_to_onnx_survival(lung_X, lung_y, sparse_chf):
+    rfs = RangerForestSurvival(n_estimators=20, sparse_chf=sparse_chf, seed=42)
+    rfs.fit(lung_X, lung_y)
+    (risk,) = _run(to_onnx(rfs), lung_X)
+    np.testing.assert_allclose(risk[:, 0], rfs.predict(lung_X), rtol=1e-5)
+
+
+def test_to_onnx_unordered(iris_X, iris_y):
+    X = iris_X.copy()
+    X[:, 0] = np.floor(X[:, 0])
+    rfc = RangerForestClassifier(
+        n_estimators=20, categorical_features=[0], respect_categorical_features="partition", seed=42
+    )
+    rfc.fit(X, iris_y)
+    with pytest.raises(ValueError):
+        to_onnx(rfc)
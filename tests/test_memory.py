@@ -0,0 +1,40 @@
+import pytest
+
+from skranger.memory import estimate_memory
+
+
+class TestEstimateMemory:
+    def test_parts(self):
+        estimate = estimate_memory((1000, 10), {"n_jobs": 2})
+        assert set(estimate) == {"data", "sort", "workspace", "inbag", "forest", "total"}
+        assert estimate["data"] == 8 * 1000 * 11
+        assert estimate["inbag"] == 0
+        assert estimate["total"] == sum(v for k, v in estimate.items() if k != "total")
+
+        copied = estimate_memory((1000, 10), {"n_jobs": 2}, copy_input=True)
+        assert copied["data"] == estimate["data"] + 8 * 1000 * 10
+
+    def test_params(self):
+        base = estimate_memory((1000, 10), {"n_jobs": 2})
+        saving = estimate_memory((1000, 10), {"n_jobs": 2, "save_memory": True})
+        assert saving["sort"] == 0
+        assert saving["total"] < base["total"]
+
+        inbag = estimate_memory((1000, 10), {"n_jobs": 2, "keep_inbag": True})
+        assert inbag["inbag"] == 9 * 100 * 1000
+
+        threads = estimate_memory((1000, 10), {"n_jobs": 4})
+        assert threads["workspace"] == 2 * base["workspace"]
+        blocks = estimate_memory((1000, 10), {"n_jobs": 4, "early_stopping": True})
+        assert blocks["sort"] == 4 * base["sort"]
+
+        deep = estimate_memory((1000, 10), {"n_jobs": 2, "min_node_size": 1})
+        shallow = estimate_memory((1000, 10), {"n_jobs": 2, "min_node_size": 1, "max_depth": 3})
+        assert shallow["forest"] < base["forest"] < deep["forest"]
+
+    @pytest.mark.parametrize("kwargs", [{"n_classes": 50}, {"n_event_times": 50}])
+    def test_leaf_values(self, kwargs):
+        regression = estimate_memory((1000, 10), {"n_jobs": 2, "min_node_size": 10})
+        estimate = estimate_memory((1000, 10), {"n_jobs": 2, "min_node_size": 10}, **kwargs)
+        assert estimate["forest"] > regression["forest"]
+        assert estimate["workspace"] > regression["workspace"]
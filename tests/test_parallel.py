@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+import pytest
+
+import skranger
+from skranger import parallel
+
+
+@pytest.fixture
+def num_threads(monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    yield
+    skranger.set_num_threads(None)
+
+
+def _available_cpus():
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+
+class TestParallel:
+    def test_set_num_threads(self, num_threads):
+        assert skranger.get_num_threads() == _available_cpus()
+        executor = parallel.get_executor()
+        assert parallel.get_executor() is executor
+
+        skranger.set_num_threads(2)
+        assert skranger.get_num_threads() == 2
+        assert parallel.num_threads(0) == 2
+        assert parallel.num_threads(3) == 3
+        # the pool is recreated with the new number of threads
+        assert parallel.get_executor() is not executor
+        assert parallel.get_executor()._max_workers == 2
+
+        for n_threads in [0, -1, 1.5]:
+            with pytest.raises(ValueError):
+                skranger.set_num_threads(n_threads)
+
+    def test_num_threads_small_prediction(self):
+        assert parallel.num_threads(4, traversals=10) == 1
+        assert parallel.num_threads(4, traversals=10 ** 6) == 4
+
+    def test_imap(self, num_threads):
+        skranger.set_num_threads(4)
+        running = []
+        lock = threading.Lock()
+
+        def func(item):
+            with lock:
+                running.append(item)
+            return item * 2
+
+        assert list(parallel.imap(func, range(10), 2)) == [i * 2 for i in range(10)]
+
+        # closing the generator cancels the pending calls
+        running.clear()
+        results = parallel.imap(func, range(100), 2)
+        assert next(results) == 0
+        results.close()
+        assert len(running) <= 3
+
+    def test_imap_close_waits(self, num_threads):
+        skranger.set_num_threads(2)
+        started = []
+        finished = []
+
+        def func(item):
+            started.append(item)
+            time.sleep(0.05)
+            finished.append(item)
+            return item
+
+        # no more calls are pending than the pool has threads
+        results = parallel.imap(func, range(100), 8)
+        assert next(results) == 0
+        assert len(started) <= 3
+        # closing waits for the running calls
+        results.close()
+        assert sorted(finished) == sorted(started)
+
+    def test_omp_num_threads(self, monkeypatch):
+        monkeypatch.setenv("OMP_NUM_THREADS", "3,1")
+        assert skranger.get_num_threads() == 3
+        monkeypatch.setenv("OMP_NUM_THREADS", "")
+        assert skranger.get_num_threads() == _available_cpus()
+
+    def test_parse_cpu_list(self):
+        assert parallel._parse_cpu_list("0-3,8,10-11\n") == {0, 1, 2, 3, 8, 10, 11}
+
+    @pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="requires Linux")
+    def test_cpu_affinity(self, monkeypatch):
+        monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+        cpu = min(os.sched_getaffinity(0))
+        previous = os.sched_getaffinity(0)
+        with parallel.cpu_affinity(cpus=[cpu]):
+            assert os.sched_getaffinity(0) == {cpu}
+            assert skranger.get_num_threads() == 1
+            # calls in the shared pool run on the same CPUs
+            assert list(parallel.imap(lambda _: os.sched_getaffinity(0), range(2))) == [{cpu}, {cpu}]
+        assert os.sched_getaffinity(0) == previous
+
+        with pytest.raises(ValueError):
+            with parallel.cpu_affinity():
+                pass
+        with pytest.raises(ValueError):
+            with parallel.cpu_affinity(numa_node=10 ** 6):
+                pass
+
+    def test_threadpoolctl(self, num_threads, monkeypatch):
+        threadpoolctl = pytest.importorskip("threadpoolctl")
+        pytest.importorskip("skranger.ensemble.ranger")
+        skranger.set_num_threads(4)
+        info = [lib for lib in threadpoolctl.threadpool_info() if lib["user_api"] == "skranger"]
+        assert len(info) == 1
+        assert info[0]["num_threads"] == 4
+
+        with threadpoolctl.threadpool_limits(limits=2, user_api="skranger"):
+            assert skranger.get_num_threads() == 2
+        assert skranger.get_num_threads() == 4
+
+        # the default still follows the environment once the limits are restored
+        skranger.set_num_threads()
+        monkeypatch.setenv("OMP_NUM_THREADS", "3")
+        with threadpoolctl.threadpool_limits(limits=1, user_api="skranger"):
+            assert skranger.get_num_threads() == 1
+        assert skranger.get_num_threads() == 3
+        monkeypatch.setenv("OMP_NUM_THREADS", "5")
+        assert skranger.get_num_threads() == 5
@@ -0,0 +1,33 @@
+import numpy as np
+
+from skranger import profiling
+
+
+class Estimator:
+    @profiling.profiled("fit", set_timings=True)
+    def fit(self, X):
+        with profiling.phase("convert_input"):
+            self.X_ = np.asfortranarray(X)
+        return self
+
+
+class TestProfiling:
+    def test_inactive(self):
+        estimator = Estimator().fit(np.ones((10, 2)))
+        assert not hasattr(estimator, "timings_")
+
+    def test_profile(self):
+        recorded = []
+        with profiling.profile(callback=recorded.append) as prof:
+            estimator = Estimator().fit(np.ones((10, 2)))
+        assert [t.name for t in prof.timings] == ["fit.convert_input", "fit"]
+        assert recorded == prof.timings
+        assert estimator.timings_ == prof.timings
+        assert all(t.seconds >= 0 for t in prof.timings)
+        # the fortran ordered copy of X is kept by the estimator
+        assert prof.timings[0].allocated_bytes >= 10 * 2 * 8
+
+    def test_trace_memory(self):
+        with profiling.profile(trace_memory=False) as prof:
+            Estimator().fit(np.ones((10, 2)))
+        assert all(t.allocated_bytes == 0 for t in prof.timings)
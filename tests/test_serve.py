@@ -0,0 +1,77 @@
+import asyncio
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+from skranger.serve import PredictionServer
+from skranger.serve import load_estimator
+
+
+class SumEstimator:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        if X.shape[1] != 2 or np.isnan(X).any():
+            raise ValueError("expected 2 features without missing values")
+        return X.sum(axis=1)
+
+
+async def _post(port, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode()
+    request = "POST /predict HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(len(body))
+    writer.write(request.encode() + body)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body.decode())
+
+
+def _serve(estimator, requests):
+    async def run():
+        server = await PredictionServer(estimator, max_wait=0.05).start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.gather(*[_post(port, payload) for payload in requests])
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+class TestPredictionServer:
+    def test_predict(self):
+        estimator = SumEstimator()
+        responses = _serve(estimator, [{"instances": [[1, 2]]}, {"instances": [[3, 4], [5, 6]]}])
+        assert responses == [(200, {"predictions": [3]}), (200, {"predictions": [7, 11]})]
+        assert estimator.calls == 1
+
+    def test_bad_request(self):
+        responses = _serve(SumEstimator(), [{"rows": [[1, 2]]}, {"instances": [1, 2]}])
+        assert [status for status, _ in responses] == [400, 400]
+
+    def test_bad_instances(self):
+        requests = [{"instances": [[1, 2]]}, {"instances": [[1, 2, 3]]}, {"instances": [[None, 2]]}]
+        responses = _serve(SumEstimator(), requests)
+        # only the invalid requests of the batch fail
+        assert responses[0] == (200, {"predictions": [3]})
+        assert [status for status, _ in responses[1:]] == [400, 400]
+
+    def test_invalid_method(self):
+        with pytest.raises(ValueError):
+            PredictionServer(SumEstimator(), method="predict_proba")
+
+    def test_load_estimator(self, tmp_path):
+        path = str(tmp_path / "model.pkl")
+        with open(path, "wb") as f:
+            pickle.dump(SumEstimator(), f)
+        np.testing.assert_array_equal(load_estimator(path).predict(np.ones((2, 2))), [2, 2])